@@ -0,0 +1,75 @@
+""" Measure the time to import pymccrgb and which heavy packages it loads
+
+Each statement is timed in a fresh interpreter, so the results include the
+cost of importing dependencies. Run from the repository root as
+
+    python benchmarks/import_time.py [--repeat N]
+
+For a per-module breakdown, use python -X importtime -c "import pymccrgb".
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+STATEMENTS = [
+    "import pymccrgb",
+    "from pymccrgb import mcc, mcc_rgb, read_data",
+    "import pymccrgb.core",
+    "import pymccrgb.features",
+    "import pymccrgb.plotting",
+]
+
+HEAVY_PACKAGES = ["matplotlib", "pdal", "scipy.spatial", "skimage", "sklearn"]
+
+SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+{statement}
+elapsed = time.perf_counter() - start
+heavy = [name for name in {heavy!r} if name in sys.modules]
+print(json.dumps({{"time": elapsed, "loaded": heavy}}))
+"""
+
+
+def time_statement(statement, repeat=5):
+    """ Returns the median import time and the heavy packages loaded """
+    times = []
+    loaded = []
+    for _ in range(repeat):
+        script = SCRIPT.format(statement=statement, heavy=HEAVY_PACKAGES)
+        output = subprocess.run(
+            [sys.executable, "-c", script], cwd=ROOT, capture_output=True, text=True,
+        )
+        if output.returncode != 0:
+            return None, output.stderr.strip().splitlines()[-1:]
+        result = json.loads(output.stdout)
+        times.append(result["time"])
+        loaded = result["loaded"]
+    return statistics.median(times), loaded
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    for statement in STATEMENTS:
+        elapsed, loaded = time_statement(statement, repeat=args.repeat)
+        if elapsed is None:
+            print("{:<48} failed: {}".format(statement, " ".join(loaded)))
+        else:
+            print(
+                "{:<48} {:8.1f} ms  loads: {}".format(
+                    statement, 1e3 * elapsed, ", ".join(loaded) or "-"
+                )
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,53 @@
-from . import core, datasets, features, ioutils, pointutils, plotting
-from .core import mcc, mcc_rgb
-from .ioutils import read_data
+"""
+Point cloud classification using color and curvature
+
+Submodules, and the third-party packages they depend on, are imported on
+first use, e.g., pymccrgb.plotting imports matplotlib only when it is first
+accessed.
+"""
+
+import importlib
+
+_SUBMODULES = [
+    "batch",
+    "cache",
+    "checkpoint",
+    "classification",
+    "colorize",
+    "core",
+    "datasets",
+    "features",
+    "incremental",
+    "ioutils",
+    "memory",
+    "pointutils",
+    "plotting",
+    "profiling",
+    "search",
+    "service",
+    "telemetry",
+    "tiling",
+]
+
+_ATTRIBUTES = {
+    "mcc": "core",
+    "mcc_rgb": "core",
+    "read_data": "ioutils",
+}
+
+__all__ = _SUBMODULES + list(_ATTRIBUTES)
+
+
+def __getattr__(name):
+    if name in _SUBMODULES:
+        return importlib.import_module("." + name, __name__)
+    if name in _ATTRIBUTES:
+        module = importlib.import_module("." + _ATTRIBUTES[name], __name__)
+        value = getattr(module, name)
+        globals()[name] = value
+        return value
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
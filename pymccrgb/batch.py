@@ -0,0 +1,192 @@
+""" Parallel classification of large point clouds in balanced tiles """
+
+import inspect
+import time
+
+import numpy as np
+
+from concurrent.futures import as_completed
+
+from . import core, profiling
+from .search import get_shared_data, shared_data_pool
+from .telemetry import RunReport
+from .tiling import balanced_tiles, iter_tiles
+
+DEFAULT_TILE_POINTS = 2 ** 21
+
+
+def classify_tiles(
+    data,
+    method="mcc_rgb",
+    max_points=DEFAULT_TILE_POINTS,
+    n_tiles=None,
+    buffer=None,
+    n_jobs=None,
+    candidates=None,
+    use_las_codes=False,
+    callback=None,
+    return_report=False,
+    verbose=False,
+    **params,
+):
+    """ Classifies a point cloud in tiles balanced by point count
+
+    The point cloud is split into tiles with similar numbers of points (see
+    tiling.balanced_tiles), so that dense and sparse areas give similar
+    workloads. Each tile is classified with its buffer in a pool of worker
+    processes that share one copy of the data, starting with the largest
+    tile. The label of each point is taken from the tile that contains it.
+
+    If profiling is enabled, the spans recorded by the workers are merged
+    into the profiler of this process.
+
+    Parameters
+    ----------
+        data: array
+            A n x d data matrix with rows [x, y, z, r, g, b ...]
+
+        method: str
+            The classification function to run, "mcc" or "mcc_rgb".
+            Defaults to "mcc_rgb".
+
+        max_points: int
+            The maximum number of points in a buffered tile. Defaults to
+            2 ** 21.
+
+        n_tiles: int
+            Optional minimum number of tiles, e.g., the number of workers
+
+        buffer: float
+            The width of the buffer around each tile. Defaults to four times
+            the largest interpolation scale. With scales="auto", each tile
+            chooses its own scales from its point spacing.
+
+        n_jobs: int
+            The number of worker processes. Defaults to the number of CPUs.
+            If 1, tiles are classified in this process.
+
+        candidates: array
+            Optional n x 1 boolean mask of points that can be ground
+
+        use_las_codes: bool
+           If True, return LAS 1.4 classification codes (2 = ground,
+           4 = medium vegetation). Default False.
+
+        callback: function
+            Optional function called with each event of the run report
+
+        return_report: bool
+            If True, also return the RunReport of the run. Default False.
+
+        verbose: bool
+            If True, print each event of the run report. Default False.
+
+        Any other keyword argument to method, e.g., scales and tols
+
+    Returns
+    -------
+        data: array
+            An m x d array of ground points
+
+        labels: array
+            An n x 1 array of labels (1 is ground, 0 is nonground)
+
+        report: RunReport
+            The tiles and the events of the run on each tile, if
+            return_report is True
+    """
+    if method not in ("mcc", "mcc_rgb"):
+        raise ValueError(
+            "Unsupported method {}. Please use 'mcc' or 'mcc_rgb'.".format(method)
+        )
+
+    data = np.asarray(data)
+    if buffer is None:
+        scales = params.get(
+            "scales",
+            inspect.signature(getattr(core, method)).parameters["scales"].default,
+        )
+        buffer = core.CHUNK_BUFFER_FACTOR * core.largest_scale(
+            data, scales, params.get("training_scales")
+        )
+
+    xy = data[:, 0:2]
+    tiles = balanced_tiles(xy, max_points=max_points, n_tiles=n_tiles, buffer=buffer)
+    jobs = [
+        (tile, indices, core_mask, None if candidates is None else candidates[indices])
+        for tile, indices, core_mask in iter_tiles(xy, tiles, buffer=buffer)
+    ]
+    jobs.sort(key=lambda job: len(job[1]), reverse=True)
+
+    report = RunReport(callback=callback, verbose=verbose)
+    labels = np.zeros((data.shape[0],), dtype=bool)
+
+    def merge(job, tile_labels, elapsed, events, spans):
+        tile, indices, core_mask, _ = job
+        if len(spans) > 0:
+            profiling.get_profiler().merge(spans)
+        labels[indices[core_mask]] = tile_labels
+        report.emit(
+            "tile",
+            tile=tile,
+            n_tiles=len(tiles),
+            n_points=len(indices),
+            n_core=int(np.count_nonzero(core_mask)),
+            elapsed=elapsed,
+        )
+        forward = report.forward(tile=tile)
+        for event in events:
+            forward(event)
+
+    if n_jobs == 1:
+        for job in jobs:
+            merge(job, *_classify_tile(data, method, params, *job[1:]))
+    else:
+        profile = profiling.is_enabled()
+        with shared_data_pool(data, n_jobs=n_jobs) as pool:
+            futures = {
+                pool.submit(
+                    _classify_shared_tile, method, params, *job[1:], profile=profile
+                ): job
+                for job in jobs
+            }
+            for future in as_completed(futures):
+                merge(futures[future], *future.result())
+
+    data = data[labels, :]
+    report.emit("finish", n_points=int(labels.shape[0]), n_ground=int(data.shape[0]))
+
+    if use_las_codes:
+        labels = np.where(labels, 2, 4)  # Ground, Vegetation
+
+    if return_report:
+        return data, labels, report
+    return data, labels
+
+
+def _classify_shared_tile(method, params, indices, core_mask, candidates, profile):
+    if not profile:
+        return _classify_tile(
+            get_shared_data(), method, params, indices, core_mask, candidates
+        )
+    # Send the spans of the worker back with the labels of the tile
+    with profiling.profile() as profiler:
+        result = _classify_tile(
+            get_shared_data(), method, params, indices, core_mask, candidates
+        )
+    return result[0:3] + (profiler.spans,)
+
+
+def _classify_tile(data, method, params, indices, core_mask, candidates):
+    func = getattr(core, method)
+    defaults = inspect.signature(func).parameters
+    params = dict(params)
+    for name in ("scales", "tols"):
+        params[name] = core.copy_scales(params.get(name, defaults[name].default))
+
+    start = time.perf_counter()
+    _, labels, report = func(
+        data[indices, :], candidates=candidates, return_report=True, **params
+    )
+    elapsed = time.perf_counter() - start
+    return labels[core_mask], elapsed, report.events, []
@@ -0,0 +1,159 @@
+""" Memoization of excess heights for repeated MCC runs on the same points """
+
+import hashlib
+import os
+
+import numpy as np
+
+from collections import OrderedDict
+
+
+def fingerprint(xyz):
+    """ Calculates a fingerprint of a coordinate array
+
+    The fingerprint hashes the array shape and type and every byte of the
+    array, which is cheap compared to interpolating a surface from it.
+
+    Parameters
+    ----------
+        xyz: array
+            An n x 3 array of coordinates
+
+    Returns
+    -------
+        A hexadecimal string identifying the array
+    """
+    xyz = np.ascontiguousarray(xyz)
+    h = hashlib.blake2b(digest_size=16)
+    h.update(str((xyz.shape, xyz.dtype.str)).encode())
+    h.update(xyz.data)
+    return h.hexdigest()
+
+
+class ExcessHeightCache(object):
+    """ A least-recently used cache of excess heights
+
+    Excess heights are keyed by a fingerprint of the xyz coordinates and the
+    interpolation scale. Entries are kept in memory up to max_entries, and
+    are also written to directory if one is given, so that they can be
+    reused between sessions.
+
+    Parameters
+    ----------
+        max_entries: int
+            The maximum number of arrays to keep in memory. Defaults to 16.
+
+        directory: str
+            Optional directory in which to store cached arrays on disk.
+
+    Attributes
+    ----------
+        hits: int
+            The number of lookups found in memory or on disk
+
+        misses: int
+            The number of lookups that had to be computed
+
+        evictions: int
+            The number of arrays evicted from memory
+    """
+
+    def __init__(self, max_entries=16, directory=None):
+        self.max_entries = max_entries
+        self.directory = directory
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        if directory is not None and not os.path.exists(directory):
+            os.makedirs(directory)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def key(self, xyz, scale):
+        """ Returns the cache key of an xyz array at an interpolation scale """
+        return "{}_{}".format(fingerprint(xyz), repr(float(scale)))
+
+    def get(self, key):
+        """ Returns a cached array, or None if key is not cached """
+        if key in self._entries:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return self._entries[key]
+
+        filename = self._filename(key)
+        if filename is not None and os.path.exists(filename):
+            value = np.load(filename)
+            self._insert(key, value)
+            self.hits += 1
+            return value
+
+        self.misses += 1
+        return None
+
+    def put(self, key, value):
+        """ Adds an array to the cache """
+        value = np.asarray(value)
+        self._insert(key, value)
+
+        filename = self._filename(key)
+        if filename is not None:
+            np.save(filename, value)
+
+    def get_or_compute(self, xyz, scale, func):
+        """ Returns a cached result of func(xyz, scale), computing it on a miss
+
+        Parameters
+        ----------
+            xyz: array
+                An n x 3 array of coordinates
+
+            scale: float
+                The interpolation scale
+
+            func: function
+                Function called as func(xyz, scale) on a cache miss
+
+        Returns
+        -------
+            The cached or computed array. Cached arrays are read-only.
+        """
+        key = self.key(xyz, scale)
+        value = self.get(key)
+        if value is None:
+            value = func(xyz, scale)
+            self.put(key, value)
+        return self._entries.get(key, value)
+
+    def clear(self):
+        """ Removes all arrays from memory and resets the statistics """
+        self._entries.clear()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def stats(self):
+        """ Returns a dictionary of cache statistics """
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "entries": len(self._entries),
+            "hit_rate": self.hits / lookups if lookups > 0 else 0.0,
+        }
+
+    def _insert(self, key, value):
+        value.flags.writeable = False
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def _filename(self, key):
+        if self.directory is None:
+            return None
+        return os.path.join(self.directory, key + ".npy")
@@ -0,0 +1,76 @@
+""" Checkpoints of the state of long classification runs """
+
+import json
+import os
+import pickle
+
+import numpy as np
+
+CHECKPOINT_VERSION = 1
+
+
+def save_checkpoint(filename, state, arrays, model=None):
+    """ Saves the state of a run to a binary .npz file
+
+    The file is written to a temporary file that then replaces filename, so
+    an interrupted save never leaves a partial checkpoint behind.
+
+    Parameters
+    ----------
+        filename: str
+            Filename of the checkpoint
+
+        state: dict
+            JSON-serializable loop state, e.g., the current scale domain and
+            iteration
+
+        arrays: dict
+            Arrays to save by name, e.g., the indices of the active points
+
+        model: object
+            Optional picklable object, e.g., a trained classifier
+    """
+    state = dict(state, version=CHECKPOINT_VERSION)
+    entries = {"_state": np.frombuffer(json.dumps(state).encode(), dtype=np.uint8)}
+    if model is not None:
+        entries["_model"] = np.frombuffer(pickle.dumps(model), dtype=np.uint8)
+    for name, value in arrays.items():
+        entries[name] = np.asarray(value)
+
+    temp_filename = filename + ".tmp"
+    with open(temp_filename, "wb") as f:
+        np.savez(f, **entries)
+    os.replace(temp_filename, filename)
+
+
+def load_checkpoint(filename):
+    """ Loads the state of a run saved with save_checkpoint
+
+    The model is unpickled, so only load checkpoints from trusted sources.
+
+    Parameters
+    ----------
+        filename: str
+            Filename of the checkpoint
+
+    Returns
+    -------
+        state: dict
+            The loop state
+
+        arrays: dict
+            The saved arrays by name
+
+        model: object
+            The saved model, or None
+    """
+    with np.load(filename) as f:
+        state = json.loads(f["_state"].tobytes().decode())
+        model = pickle.loads(f["_model"].tobytes()) if "_model" in f else None
+        arrays = {name: f[name] for name in f.files if not name.startswith("_")}
+
+    if state.pop("version", None) != CHECKPOINT_VERSION:
+        raise ValueError(
+            "Checkpoint {} was saved by an incompatible version".format(filename)
+        )
+    return state, arrays, model
@@ -1,8 +1,12 @@
 """ Utilities for updating classifcation of point clouds """
 
-from sklearn.kernel_approximation import RBFSampler
-from sklearn.linear_model import SGDClassifier
-from sklearn.pipeline import Pipeline
+import os
+
+import numpy as np
+
+from concurrent.futures import ThreadPoolExecutor
+
+from .profiling import traced
 
 DEFAULT_PARAMETERS = {
     "n_components": 100,
@@ -12,7 +16,10 @@ DEFAULT_PARAMETERS = {
     "n_jobs": -1,
 }
 
+DEFAULT_PREDICT_BLOCK_SIZE = 2 ** 16
 
+
+@traced("classification.train")
 def make_sgd_pipeline(X_train, y_train, **kwargs):
     """ Returns an sklearn Pipeline for SGD classification with an RBF kernel
 
@@ -43,6 +50,10 @@ def make_sgd_pipeline(X_train, y_train, **kwargs):
     -------
         A trained pipeline composed of an RBF transformer and SGD classifier
     """
+    from sklearn.kernel_approximation import RBFSampler
+    from sklearn.linear_model import SGDClassifier
+    from sklearn.pipeline import Pipeline
+
     if y_train.ndim == 2:
         y_train = y_train.ravel()
 
@@ -59,3 +70,87 @@ def make_sgd_pipeline(X_train, y_train, **kwargs):
     pipeline = Pipeline(estimators)
     pipeline.fit(X_train, y_train)
     return pipeline
+
+
+@traced("classification.update")
+def update_sgd_pipeline(pipeline, X_train, y_train):
+    """ Warm-starts a trained SGD pipeline with new training data
+
+    The fitted RBF feature map of the pipeline is reused as is, so the
+    kernel approximation is identical across updates. The SGD classifier
+    continues from its previous coefficients rather than a random start.
+
+    Parameters
+    ----------
+        pipeline: Pipeline
+            A trained pipeline returned by make_sgd_pipeline
+        X_train: array
+            An n x p array of training examples
+        y_train: array
+            An n x 1 array of training labels
+
+    Returns
+    -------
+        The pipeline, updated in place
+    """
+    if y_train.ndim == 2:
+        y_train = y_train.ravel()
+
+    rbf = pipeline.named_steps["rbf"]
+    clf = pipeline.named_steps["clf"]
+    clf.set_params(warm_start=True)
+    clf.fit(
+        rbf.transform(X_train),
+        y_train,
+        coef_init=clf.coef_,
+        intercept_init=clf.intercept_,
+    )
+    return pipeline
+
+
+@traced("classification.predict")
+def predict_blocks(
+    pipeline, X, block_size=DEFAULT_PREDICT_BLOCK_SIZE, n_jobs=1, deadline=None
+):
+    """ Predicts labels with a trained pipeline in blocks of rows
+
+    Only one block at a time (per thread) is expanded by the RBF feature map,
+    which bounds the memory of prediction for large point clouds.
+
+    Parameters
+    ----------
+        pipeline: Pipeline
+            A trained pipeline returned by make_sgd_pipeline
+        X: array
+            An n x p array of feature vectors
+        block_size: int
+            The number of rows to predict at once
+            (Default: 65536)
+        n_jobs: int
+            The number of threads to predict blocks with
+            (Default: 1, -1 uses all cores)
+        deadline: Deadline
+            Optional deadline checked before each block. Raises
+            TimeBudgetExceeded if it has expired.
+
+    Returns
+    -------
+        An n x 1 array of predicted labels
+    """
+    if X.shape[0] == 0:
+        return np.empty((0,), dtype=pipeline.classes_.dtype)
+    if n_jobs == -1:
+        n_jobs = os.cpu_count()
+
+    def predict(start):
+        if deadline is not None:
+            deadline.check()
+        return pipeline.predict(X[start : start + block_size])
+
+    starts = range(0, X.shape[0], block_size)
+    if n_jobs is not None and n_jobs > 1 and len(starts) > 1:
+        with ThreadPoolExecutor(max_workers=n_jobs) as pool:
+            predictions = list(pool.map(predict, starts))
+    else:
+        predictions = [predict(start) for start in starts]
+    return np.concatenate(predictions)
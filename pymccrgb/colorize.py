@@ -1,7 +1,148 @@
 """ Project colors from imagery onto a georeferenced point cloud """
 
-import pdal
+import json
 
+import numpy as np
 
-def project_point_colors(filename, image_filename):
-    raise NotImplementedError("This method has not yet been implemented.")
+DEFAULT_BLOCK_SIZE = 2 ** 20
+DEFAULT_WINDOW_SIZE = 1024
+
+
+def world_to_pixel(xy, transform):
+    """ Calculates the image row and column of each point
+
+    Parameters
+    ----------
+        xy: array
+            An n x 2 (or more) array of coordinates with rows [x, y, ...]
+
+        transform: tuple
+            The affine transform of the image as a GDAL geotransform,
+            (x0, dx, rx, y0, ry, dy), where (x0, y0) is the upper-left
+            corner of the image, dx and dy are the pixel width and height
+            (dy is usually negative), and rx and ry are rotation terms.
+
+    Returns
+    -------
+        rows: array
+            An n x 1 array of row indices
+
+        cols: array
+            An n x 1 array of column indices
+    """
+    x0, dx, rx, y0, ry, dy = transform
+    det = dx * dy - rx * ry
+    x = xy[:, 0] - x0
+    y = xy[:, 1] - y0
+    cols = np.floor((dy * x - rx * y) / det).astype(np.int64)
+    rows = np.floor((dx * y - ry * x) / det).astype(np.int64)
+    return rows, cols
+
+
+def project_point_colors(
+    data,
+    image,
+    transform,
+    block_size=DEFAULT_BLOCK_SIZE,
+    window_size=DEFAULT_WINDOW_SIZE,
+    fill_value=np.nan,
+):
+    """ Assigns colors from an orthoimage to each point in a point cloud
+
+    Points are processed in blocks. Within a block, the image is read in
+    windows of rows that contain points, so the image can be a memory-mapped
+    array (e.g., from np.load(filename, mmap_mode="r")) that is never loaded
+    into memory in full.
+
+    Parameters
+    ----------
+        data: array
+            A n x d data matrix with rows [x, y, z, ...]
+
+        image: array
+            A rows x cols x bands image array
+
+        transform: tuple
+            The affine transform of the image as a GDAL geotransform. See
+            world_to_pixel.
+
+        block_size: int
+            The number of points to process at once
+
+        window_size: int
+            The number of image rows to read at once
+
+        fill_value: float
+            The color value of points outside the image. Defaults to NaN.
+
+    Returns
+    -------
+        An n x d array with rows [x, y, z, r, g, b, ...]. Columns 3 to
+        3 + bands of data are taken to be colors and replaced, or added if
+        data has fewer columns, and any later columns are kept.
+    """
+    n_rows, n_cols = image.shape[0:2]
+    n_bands = image.shape[2] if image.ndim == 3 else 1
+    colors = np.full((data.shape[0], n_bands), fill_value, dtype=np.float64)
+
+    for start in range(0, data.shape[0], block_size):
+        stop = min(start + block_size, data.shape[0])
+        rows, cols = world_to_pixel(data[start:stop], transform)
+        inside = np.flatnonzero(
+            (rows >= 0) & (rows < n_rows) & (cols >= 0) & (cols < n_cols)
+        )
+        rows = rows[inside]
+        cols = cols[inside]
+
+        windows = rows // window_size
+        order = np.argsort(windows, kind="stable")
+        bounds = np.flatnonzero(np.diff(windows[order])) + 1
+        for group in np.split(order, bounds):
+            if len(group) == 0:
+                continue
+            row_min, row_max = rows[group].min(), rows[group].max()
+            col_min, col_max = cols[group].min(), cols[group].max()
+            window = np.asarray(image[row_min : row_max + 1, col_min : col_max + 1])
+            window = window.reshape(window.shape[0], window.shape[1], n_bands)
+            colors[start + inside[group]] = window[
+                rows[group] - row_min, cols[group] - col_min
+            ]
+
+    return np.hstack([data[:, 0:3], colors, data[:, 3 + n_bands :]])
+
+
+def colorize_las(filename, image_filename, output_filename, dimensions=None):
+    """ Colorizes a LAS or LAZ file from a georeferenced image using PDAL
+
+    The file is read, colorized and written by a PDAL pipeline with the
+    filters.colorization stage, so neither the points nor the image are
+    loaded into Python.
+
+    Parameters
+    ----------
+        filename: str
+            Filename of LAS or LAZ file containing point cloud
+
+        image_filename: str
+            Filename of a georeferenced image readable by GDAL
+
+        output_filename: str
+            Filename of the colorized LAS or LAZ file
+
+        dimensions: str
+            Optional PDAL colorization dimensions, e.g.,
+            "Red:1:256.0, Green:2:256.0, Blue:3:256.0". Defaults to bands
+            1, 2 and 3 as red, green and blue.
+    """
+    import pdal
+
+    colorization = {"type": "filters.colorization", "raster": image_filename}
+    if dimensions is not None:
+        colorization["dimensions"] = dimensions
+
+    pipeline = pdal.Pipeline(
+        json.dumps({"pipeline": [filename, colorization, output_filename]})
+    )
+    pipeline.validate()
+    pipeline.loglevel = 0
+    _ = pipeline.execute()
@@ -1,23 +1,51 @@
 """ Multiscale curvature classification of ground points with color updates """
 
-import numpy as np
+import copy
+import os
+import pickle
+import time
+import warnings
 
-from copy import copy
+import numpy as np
 
-from .classification import make_sgd_pipeline
-from .features import calculate_color_features
-from .pointutils import equal_sample, intersect_rows
+from .cache import fingerprint
+from .checkpoint import load_checkpoint, save_checkpoint
+from .classification import (
+    DEFAULT_PARAMETERS,
+    DEFAULT_PREDICT_BLOCK_SIZE,
+    make_sgd_pipeline,
+    predict_blocks,
+    update_sgd_pipeline,
+)
+from .features import calculate_color_features, calculate_eigenvalue_features
+from .memory import (
+    parse_memory_size,
+    plan_mcc_rgb_memory,
+    resident_mcc_rgb_memory,
+)
+from .pointutils import equal_sample, grid_decimate, local_gradients, nominal_spacing
+from .profiling import traced
+from .telemetry import Deadline, PhaseTimer, RunReport, TimeBudgetExceeded
+from .tiling import balanced_tiles, iter_tiles, tile_counts
 
 from pymcc_lidar import calculate_excess_height
 
+DOWNSAMPLE_CELL_FRACTION = 0.5
+DOWNSAMPLE_GRADIENT_CELLS = 2.0
+PYRAMID_SCALE_FACTOR = 2.0
+PYRAMID_TOL_FACTOR = 10.0
+CHUNK_BUFFER_FACTOR = 4.0
+AUTO_SCALE_FACTORS = [1.0, 2.0, 3.0]
+BUFFER_SPACING_PERCENTILE = 90
+
 
-def classify_ground_mcc(data, scale, tol, downsample=False):
+def classify_ground_mcc(data, scale, tol, downsample=False, cache=None):
     """ Classifies ground points by a single iteration of the MCC algorithm
 
     Classifies ground and nonground (or "high") points by comparing the
     elevation of each data point to an interpolated surface. If downsample is
     True, a down-sampled version of the data coordinates will be used when
-    interpolating (currently not implemented).
+    interpolating, and all points are compared to that surface.
 
     Based on MCC algorithm implemented in [1]_ and [2]_.
     
@@ -40,25 +68,137 @@ def classify_ground_mcc(data, scale, tol, downsample=False):
             The height tolerance. Points exceeding the durface by more than
             tol units are classified as nonground
 
-        downsample: bool
-            If True, use a downsampled dataset for interpolation.
-            Not implemented.
+        downsample: bool or str
+            If True or "min", interpolate the surface from the lowest point
+            in each grid cell. If "voxel", interpolate the surface from the
+            centroid of each voxel. Cells are half the interpolation scale.
+            The surface at each point is extended from the representative of
+            its cell along the local slope of the surface. Default False.
+
+        cache: ExcessHeightCache
+            Optional cache of previously computed excess heights.
 
     Returns
     -------
         An n x 1 array of point class labels. By default, 1 is ground,
         and 0 is nonground.
     """
+    height = excess_height(data, scale, downsample=downsample, cache=cache)
+    y = height < tol  # 0 = nonground, 1 = ground
+    return y
+
+
+def classify_ground_mcc_tols(data, scale, tols, downsample=False, cache=None):
+    """ Classifies ground points at several height tolerances
+
+    Equivalent to calling classify_ground_mcc once per tolerance, except
+    that the interpolated surface is only computed once.
+
+    Parameters
+    ----------
+        data: array
+            A n x 3 (or more) data matrix with rows [x, y, z, ...]
+
+        scale: float
+            The interpolation scale.
+
+        tols: list
+            The height tolerances to classify at
+
+        downsample: bool or str
+            If True, "min" or "voxel", use a downsampled dataset for
+            interpolation. See classify_ground_mcc. Default False.
+
+        cache: ExcessHeightCache
+            Optional cache of previously computed excess heights.
+
+    Returns
+    -------
+        An n x k array of point class labels, one column per tolerance in
+        tols. 1 is ground, and 0 is nonground.
+    """
+    height = excess_height(data, scale, downsample=downsample, cache=cache)
+    tols = np.asarray(tols, dtype=float).reshape(1, -1)
+    return height.reshape(-1, 1) < tols
+
+
+def excess_height(data, scale, downsample=False, cache=None):
+    """ Calculates the height of each point above an interpolated surface
+
+    This is the continuous quantity that classify_ground_mcc thresholds to
+    label points as ground or nonground.
+
+    Parameters
+    ----------
+        data: array
+            A n x 3 (or more) data matrix with rows [x, y, z, ...]
+
+        scale: float
+            The interpolation scale. This defines the resolution of the
+            interpolated surface, which is calculated by a 3 x 3 windowed
+            mean around each interpolation point.
 
+        downsample: bool or str
+            If True, "min" or "voxel", use a downsampled dataset for
+            interpolation. See classify_ground_mcc. Default False.
+
+        cache: ExcessHeightCache
+            Optional cache of previously computed excess heights. The cache
+            is keyed by a fingerprint of the xyz coordinates and the scale.
+
+    Returns
+    -------
+        An n x 1 array of heights above the interpolated surface
+    """
+    height, _ = _excess_height(data, scale, downsample=downsample, cache=cache)
+    return height
+
+
+@traced("core.excess_height")
+def _excess_height(data, scale, downsample=False, cache=None):
+    """ Returns excess heights and statistics of the interpolated surface
+
+    The statistics are the number of points used to interpolate the surface,
+    the mean horizontal distance from each point to the representative of
+    its cell, and the time taken.
+    """
+    start = time.perf_counter()
+    xyz = np.ascontiguousarray(data[:, 0:3], dtype=np.float64)
+
+    if not downsample:
+        surface_xyz = xyz
+    else:
+        method = "min" if downsample is True else downsample
+        cell_size = DOWNSAMPLE_CELL_FRACTION * scale
+        surface_xyz, inverse = grid_decimate(xyz, cell_size, method=method)
+
+    if cache is not None:
+        height = cache.get_or_compute(surface_xyz, scale, calculate_excess_height)
+    else:
+        height = calculate_excess_height(surface_xyz, scale)
+
+    offset = 0.0
     if downsample:
-        raise NotImplementedError("Downsampling has not been implemented.")
+        # Extend the surface from each representative along its local slope
+        surface = surface_xyz[:, 2] - height
+        gradients = local_gradients(
+            surface_xyz, surface, DOWNSAMPLE_GRADIENT_CELLS * cell_size
+        )
+        delta = xyz[:, 0:2] - surface_xyz[inverse, 0:2]
+        surface = surface[inverse] + np.einsum("ij,ij->i", delta, gradients[inverse])
+        height = xyz[:, 2] - surface
+        offset = np.mean(np.hypot(delta[:, 0], delta[:, 1]))
 
-    xyz = data[:, 0:3]
-    height = calculate_excess_height(xyz.copy(order="C"), scale)
-    y = height < tol  # 0 = nonground, 1 = ground
-    return y
+    stats = {
+        "n_points": xyz.shape[0],
+        "n_surface": surface_xyz.shape[0],
+        "offset": offset,
+        "time": time.perf_counter() - start,
+    }
+    return height, stats
 
 
+@traced("core.mcc")
 def mcc(
     data,
     scales=[0.5, 1, 1.5],
@@ -66,6 +206,14 @@ def mcc(
     threshs=[1, 0.1, 0.01],
     use_las_codes=False,
     verbose=False,
+    *,
+    candidates=None,
+    downsample=False,
+    pyramid=False,
+    cache=None,
+    time_budget=None,
+    callback=None,
+    return_report=False,
 ):
     """ Classifies ground points using the MCC algorithm
 
@@ -91,7 +239,9 @@ def mcc(
             The interpolation scales. This defines the resolution of the
             interpolated surface, which is calculated by a 3 x 3 windowed
             mean around each intrpolation point. Defaults to [0.5, 1, 1.5]
-            meters.
+            meters. If "auto", one set of scales is chosen from the nominal
+            point spacing of all of data (see auto_scales). Only the tiles
+            of batch.classify_tiles choose their own scales.
 
         tols: list
             The height tolerances. Points exceeding the durface by more than
@@ -105,6 +255,46 @@ def mcc(
            If True, return LAS 1.4 classification codes (2 = ground,
            4 = medium vegetation). Default False.
 
+        verbose: bool
+            If True, print each event of the run report. Default False.
+
+        candidates: array
+            Optional n x 1 boolean mask of points that can be ground, e.g.,
+            from ioutils.ground_candidates. Other points are labeled
+            nonground without being classified. Integer arrays are
+            converted to booleans.
+
+        downsample: bool or str
+            If True, "min" or "voxel", interpolate surfaces from a
+            downsampled copy of the points. See classify_ground_mcc.
+            Default False.
+
+        pyramid: bool or tuple
+            If True, first remove obvious nonground points with a single
+            downsampled pass at a coarse scale and tolerance, which default
+            to twice the largest scale and ten times the largest tolerance.
+            A (scale, tol) tuple sets the coarse scale and tolerance.
+            Default False.
+
+        cache: ExcessHeightCache
+            Optional cache of excess heights, which avoids recomputing
+            surfaces for repeated runs on the same points.
+
+        time_budget: float
+            Optional wall-clock time budget in seconds. The budget is checked
+            between iterations. If it runs out, the run stops and the
+            current labels are returned, with points not yet classified
+            labeled as ground. Use return_report to get the report, whose
+            timed_out and completed_domains attributes describe how far the
+            run got.
+
+        callback: function
+            Optional function called with each event of the run report,
+            e.g., to collect progress from worker processes.
+
+        return_report: bool
+            If True, also return the RunReport of the run. Default False.
+
     Returns
     -------
         data: array
@@ -112,55 +302,90 @@ def mcc(
 
         labels: array
             An n x 1 array of labels (1 is ground, 0 is nonground)
-    """
-    original_data = copy(data)
 
-    for scale, tol, thresh in zip(scales, tols, threshs):
-        converged = False
+        report: RunReport
+            The iterations, timings and memory use of the run, if
+            return_report is True
+    """
+    if candidates is not None:
+        candidates = np.asarray(candidates, dtype=bool)
+    report = RunReport(callback=callback, verbose=verbose)
+    if isinstance(scales, str):
+        scales = auto_scales(data, method=scales)
+        report.emit("scales", scales=scales)
+    deadline = Deadline(time_budget)
+    timed_out = False
+    completed_domains = []
+    points = _ActivePoints(data, candidates)
+    if pyramid:
+        _pyramid_pass(points, scales, tols, pyramid, report, cache=cache)
+
+    for domain, (scale, tol, thresh) in enumerate(zip(scales, tols, threshs)):
+        # There is nothing to classify once every point has been removed
+        converged = points.n == 0
         niter = 0
         while not converged:
-            n_points = data.shape[0]
-            y = classify_ground_mcc(data, scale, tol)
-            ground = y == 1
-            n_removed = np.sum(y == 0)
-            converged = 100 * (n_removed / n_points) < thresh
-            data = data[ground, :]
-
-            if verbose:
-                print("-" * 20)
-                print("MCC iteration")
-                print("-" * 20)
-                print(
-                    "Scale: {:.2f}, Relative height: {:.1e}, iter: {}".format(
-                        scale, tol, niter
-                    )
+            if deadline.expired():
+                timed_out = True
+                report.emit(
+                    "timeout", time_budget=time_budget, domain=domain, iteration=niter
                 )
-                print(
-                    "Removed {} nonground points ({:.2f} %)".format(
-                        n_removed, 100 * (n_removed / n_points)
-                    )
+                break
+            timer = PhaseTimer()
+            n_points = points.n
+            with timer("surface"):
+                height, surface_stats = _excess_height(
+                    points.xyz, scale, downsample=downsample, cache=cache
                 )
+            y = height < tol
+            ground = y == 1
+            n_removed = n_points - np.count_nonzero(ground)
+            with timer("compaction"):
+                points.compact(ground)
+            converged = points.n == 0 or 100 * (n_removed / n_points) < thresh
+
+            report.emit(
+                "iteration",
+                algorithm="mcc",
+                domain=domain,
+                scale=float(scale),
+                tol=float(tol),
+                iteration=niter,
+                n_in=int(n_points),
+                n_out=int(points.n),
+                n_removed_mcc=int(n_removed),
+                update=False,
+                n_reclassified=0,
+                surface=surface_stats,
+                phases=timer.times,
+            )
 
             niter += 1
 
-    labels = intersect_rows(data, original_data)
+        if timed_out:
+            break
+        completed_domains.append(domain)
 
-    if verbose:
-        n_ground = data.shape[0]
-        n_points = original_data.shape[0]
-        print(
-            "Retained {} ground points ({:.2f} %)".format(
-                n_ground, 100 * (n_ground / n_points)
-            )
-        )
+    labels = points.labels()
+    data = data[points.indices, :]
+    report.emit(
+        "finish",
+        n_points=int(labels.shape[0]),
+        n_ground=int(data.shape[0]),
+        timed_out=timed_out,
+        completed_domains=completed_domains,
+    )
 
     if use_las_codes:
         labels[labels == 0] = 4  # Vegetation
         labels[labels == 1] = 2  # Ground
 
+    if return_report:
+        return data, labels, report
     return data, labels
 
 
+@traced("core.mcc_rgb")
 def mcc_rgb(
     data,
     scales=[0.5, 1, 1.5],
@@ -174,6 +399,21 @@ def mcc_rgb(
     seed=None,
     use_las_codes=False,
     verbose=False,
+    *,
+    warm_start=False,
+    geometric_features=False,
+    color_stats=None,
+    candidates=None,
+    downsample=False,
+    pyramid=False,
+    cache=None,
+    memory_limit=None,
+    predict_block_size=DEFAULT_PREDICT_BLOCK_SIZE,
+    pipeline=None,
+    checkpoint=None,
+    time_budget=None,
+    callback=None,
+    return_report=False,
     **pipeline_kwargs,
 ):
     """ Classifies ground points using the MCC-RGB algorithm
@@ -194,6 +434,10 @@ def mcc_rgb(
             interpolated surface, which is calculated by a 3 x 3 windowed
             mean around each interpolation point. Defaults to [0.5, 1, 1.5]
             meters. Scale domains are processed in order of increasing scale.
+            If "auto", one set of scales is chosen from the nominal point
+            spacing of all of data (see auto_scales). Only the chunks of a
+            run with a memory limit, or the tiles of batch.classify_tiles,
+            choose their own scales.
 
         tols: list
             The height tolerances. Points exceeding the surface by more than
@@ -229,6 +473,91 @@ def mcc_rgb(
            If True, return LAS 1.4 classification codes (2 = ground,
            4 = medium vegetation). Default False.
 
+        verbose: bool
+            If True, print each event of the run report. Default False.
+
+        warm_start: bool
+            If True, each classification update step after the first reuses
+            the RBF feature map of the previous step's classifier and
+            continues training from its coefficients. Default False.
+
+        geometric_features: bool
+            If True, add local eigenvalue features (see
+            calculate_eigenvalue_features) of the input point cloud to the
+            color features used by the classifier. Default False.
+
+        color_stats: ColorStatistics
+            Optional fixed color statistics used to rescale colors, e.g.,
+            calculated over a whole survey. By default, colors are rescaled
+            by the range of the points in each classification update step.
+
+        candidates: array
+            Optional n x 1 boolean mask of points that can be ground, e.g.,
+            from ioutils.ground_candidates. Other points are labeled
+            nonground without being classified. Integer arrays are
+            converted to booleans.
+
+        downsample: bool or str
+            If True, "min" or "voxel", interpolate surfaces from a
+            downsampled copy of the points. See classify_ground_mcc.
+            Default False.
+
+        pyramid: bool or tuple
+            If True, first remove obvious nonground points with a single
+            downsampled pass at a coarse scale and tolerance, which default
+            to twice the largest scale and ten times the largest tolerance.
+            A (scale, tol) tuple sets the coarse scale and tolerance.
+            Default False.
+
+        cache: ExcessHeightCache
+            Optional cache of excess heights, which avoids recomputing
+            surfaces for repeated runs on the same points.
+
+        memory_limit: int or str
+            Optional memory budget in bytes or as a string, e.g., "4GB". The
+            memory of each stage is estimated (see memory.plan_mcc_rgb_memory)
+            and, if needed, the points are classified in spatial chunks with
+            buffers around them, with smaller prediction blocks and fewer
+            training examples. Each chunk trains its own color classifier.
+            The input data and labels are held for the whole run and
+            count towards the budget. A warning is raised if the budget
+            cannot be met, and a ValueError if they leave no memory for
+            classification.
+
+        predict_block_size: int
+            The number of points to predict at once in the classification
+            update step. Defaults to 65536.
+
+        pipeline: Pipeline
+            Optional trained classifier, e.g., from an earlier run on
+            overlapping points. With warm_start, the first classification
+            update step continues training a copy of it instead of training
+            a new classifier.
+
+        checkpoint: str
+            Optional filename of a checkpoint of the run. The active points,
+            classifier and loop state are saved after each classification
+            update step and scale domain. If the file exists, the run resumes
+            from the saved state, which must be of the same points and
+            parameters. With a memory limit, each chunk has its own
+            checkpoint file, named after checkpoint and the chunk.
+
+        time_budget: float
+            Optional wall-clock time budget in seconds. The budget is checked
+            between iterations and prediction blocks, and before each chunk
+            with a memory limit. If it runs out, the run stops and the
+            current labels are returned, with points not yet classified
+            labeled as ground. Use return_report to get the report, whose
+            timed_out and completed_domains attributes describe how far the
+            run got.
+
+        callback: function
+            Optional function called with each event of the run report,
+            e.g., to collect progress from worker processes.
+
+        return_report: bool
+            If True, also return the RunReport of the run. Default False.
+
     Returns
     -------
         data: array
@@ -237,6 +566,10 @@ def mcc_rgb(
         labels: array
             An n x 1 array of labels (1 is ground, 0 is nonground)
 
+        report: RunReport
+            The iterations, timings and memory use of the run, if
+            return_report is True
+
         updated: array
             An n x 1 array of labels indicating whether the point was
             updated in an MCC-RGB step. -1 indicates the point's classification
@@ -244,6 +577,43 @@ def mcc_rgb(
             this will be the index of the scale and tolerance range defined
             in training_scales and training_tols.
     """
+    if candidates is not None:
+        candidates = np.asarray(candidates, dtype=bool)
+    if memory_limit is not None:
+        return _mcc_rgb_chunked(
+            data,
+            memory_limit,
+            scales=scales,
+            tols=tols,
+            threshs=threshs,
+            training_scales=training_scales,
+            training_tols=training_tols,
+            n_train=n_train,
+            max_iter=max_iter,
+            n_jobs=n_jobs,
+            seed=seed,
+            warm_start=warm_start,
+            geometric_features=geometric_features,
+            color_stats=color_stats,
+            use_las_codes=use_las_codes,
+            candidates=candidates,
+            downsample=downsample,
+            pyramid=pyramid,
+            cache=cache,
+            pipeline=pipeline,
+            checkpoint=checkpoint,
+            time_budget=time_budget,
+            callback=callback,
+            return_report=return_report,
+            verbose=verbose,
+            **pipeline_kwargs,
+        )
+
+    chosen_scales = None
+    if isinstance(scales, str):
+        # Copy the chosen scales, since training scales are appended below
+        chosen_scales = auto_scales(data, method=scales)
+        scales = list(chosen_scales)
     if training_scales is None:
         training_scales = scales[0:1]
     if training_tols is None:
@@ -276,64 +646,152 @@ def mcc_rgb(
     scales = scales[idx]
     tols = tols[idx]
 
-    original_data = copy(data)
+    report = RunReport(callback=callback, verbose=verbose)
+    if chosen_scales is not None:
+        report.emit("scales", scales=chosen_scales)
+    deadline = Deadline(time_budget)
+    timed_out = False
 
     # Mask NaN and infinite index/color values
-    X = calculate_color_features(data)
-    mask = np.isfinite(X).all(axis=-1)
-    data = data[mask, :]
-    n_points = data.shape[0]
-    # updated = np.full((n_points,), fill_value=-1)
+    X_color = calculate_color_features(data, stats=color_stats)
+    mask = np.isfinite(X_color).all(axis=-1)
+    if geometric_features:
+        # Degenerate neighborhoods, e.g., of duplicate points, have NaN
+        # features, but the points can still be classified
+        G = _fill_nonfinite(calculate_eigenvalue_features(data, n_jobs=n_jobs))
+    if candidates is None:
+        removed = np.array([], dtype=np.intp)
+    else:
+        removed = np.flatnonzero(mask & ~candidates)
+        mask = mask & candidates
     reached_max_iter = False
+    if pipeline is not None:
+        # Warm starts update the classifier in place
+        pipeline = copy.deepcopy(pipeline)
+    start_domain, start_iter = 0, 0
+
+    if checkpoint is not None:
+        run_key = _checkpoint_key(
+            data,
+            scales,
+            tols,
+            threshs,
+            training_scales,
+            training_tols,
+            candidates=candidates,
+            color_stats=color_stats,
+            pyramid=pyramid,
+            pipeline_kwargs=pipeline_kwargs,
+            n_train=int(n_train),
+            max_iter=int(max_iter),
+            seed=None if seed is None else int(seed),
+            warm_start=bool(warm_start),
+            geometric_features=bool(geometric_features),
+            downsample=downsample,
+            pipeline=None if pipeline is None else _model_fingerprint(pipeline),
+        )
+    if checkpoint is not None and os.path.exists(checkpoint):
+        state, arrays, pipeline = load_checkpoint(checkpoint)
+        if state["key"] != run_key:
+            raise ValueError(
+                "Checkpoint {} is of different points or parameters".format(checkpoint)
+            )
+        mask = np.zeros_like(mask)
+        mask[arrays["indices"]] = True
+        removed = arrays["removed"]
+        points = _ActivePoints(data, mask)
+        n_points = state["n_points"]
+        start_domain, start_iter = state["domain"], state["iteration"]
+        reached_max_iter = state["reached_max_iter"]
+        completed_domains = list(range(start_domain))
+        report.emit(
+            "resume",
+            checkpoint=checkpoint,
+            domain=start_domain,
+            iteration=start_iter,
+            n_active=int(points.n),
+        )
+    else:
+        points = _ActivePoints(data, mask)
+        n_points = points.n
+        completed_domains = []
+        # updated = np.full((n_points,), fill_value=-1)
+
+        if pyramid:
+            removed = np.concatenate(
+                [
+                    removed,
+                    _pyramid_pass(points, scales, tols, pyramid, report, cache=cache),
+                ]
+            )
 
-    for scale, tol, thresh in zip(scales, tols, threshs):
-        converged = False
-        niter = 0
+    for domain, (scale, tol, thresh) in enumerate(zip(scales, tols, threshs)):
+        if domain < start_domain:
+            continue
+        # There is nothing to classify once every point has been removed
+        converged = points.n == 0
+        # Domains after the one that reached max_iter are never run
+        complete = converged
+        niter = start_iter if domain == start_domain else 0
         while not converged and not reached_max_iter:
-            y = classify_ground_mcc(data, scale, tol)
-
-            if verbose:
-                n_removed_mcc = np.sum(y == 0)
-                print("-" * 20)
-                print("MCC step")
-                print("-" * 20)
-                print(
-                    "Scale: {:.2f}, Relative height: {:.1e}, iter: {}".format(
-                        scale, tol, niter
-                    )
+            if deadline.expired():
+                timed_out = True
+                report.emit(
+                    "timeout", time_budget=time_budget, domain=domain, iteration=niter
                 )
-                print(
-                    "Removed {} nonground points ({:.2f} %)".format(
-                        n_removed_mcc, 100 * (n_removed_mcc / n_points)
-                    )
+                break
+            timer = PhaseTimer()
+            n_in = points.n
+            with timer("surface"):
+                height, surface_stats = _excess_height(
+                    points.xyz, scale, downsample=downsample, cache=cache
                 )
+            y = height < tol
+            n_removed_mcc = n_in - np.count_nonzero(y)
+            n_reclassified = 0
 
             update_step = scale in training_scales and tol in training_tols
             first_iter = niter == 0
-            if update_step and first_iter:
-                if verbose:
-                    print("-" * 20)
-                    print("Classification update step")
-                    print("-" * 20)
+            update_step = update_step and first_iter
+            if update_step:
                 try:
-                    X = calculate_color_features(data)
-                    X_train, y_train = equal_sample(
-                        X, y, size=int(n_train / 2), seed=seed
-                    )
-                    pipeline = make_sgd_pipeline(X_train, y_train, **pipeline_kwargs)
-
-                    if n_jobs > 1 or n_jobs == -1:
-                        if verbose:
-                            print(f"Predicting in parallel using {n_jobs}")
-
-                        from sklearn.externals.joblib import Parallel, delayed
+                    # Points removed before the iterations would have been
+                    # nonground training examples in the first scale domain
+                    indices = points.indices
+                    y_all = y
+                    if domain == 0 and len(removed) > 0:
+                        indices = np.concatenate([indices, removed])
+                        y_all = np.concatenate(
+                            [y, np.zeros_like(removed, dtype=y.dtype)]
+                        )
+                    with timer("features"):
+                        if color_stats is None:
+                            X = calculate_color_features(data[indices, :])
+                        else:
+                            X = X_color[indices, :]
+                        if geometric_features:
+                            X = np.hstack([X, G[indices, :]])
+
+                    with timer("training"):
+                        X_train, y_train = equal_sample(
+                            X, y_all, size=int(n_train / 2), seed=seed
+                        )
+                        X = X[0 : points.n, :]
+                        if warm_start and pipeline is not None:
+                            pipeline = update_sgd_pipeline(pipeline, X_train, y_train)
+                        else:
+                            pipeline = make_sgd_pipeline(
+                                X_train, y_train, **pipeline_kwargs
+                            )
 
-                        pool = Parallel(n_jobs=n_jobs)
-                        wrapper = delayed(pipeline.predict)
-                        result = pool(wrapper(x.reshape(1, -1)) for x in X[y == 1, :])
-                        y_pred_ground = np.array(result).ravel()
-                    else:
-                        y_pred_ground = pipeline.predict(X[y == 1, :])
+                    with timer("predict"):
+                        y_pred_ground = predict_blocks(
+                            pipeline,
+                            X[y == 1, :],
+                            block_size=predict_block_size,
+                            n_jobs=n_jobs,
+                            deadline=deadline,
+                        )
                     y_pred = np.zeros_like(y)
                     y_pred[y == 1] = y_pred_ground
 
@@ -341,48 +799,433 @@ def mcc_rgb(
                     # update_step_idx = params.index((scale, tol))
                     # updated[(y == 1) & (y_pred == 0)] = update_step_idx
 
-                    if verbose:
-                        n_removed_clf = np.sum((y == 1) & (y_pred == 0))
-                        print(
-                            "Scale: {:.2f}, Relative height: {:.1e}".format(scale, tol)
-                        )
-                        print(
-                            "Reclassified {} ground points as nonground ({:.2f} %)".format(
-                                n_removed_clf, 100 * (n_removed_clf / n_points)
-                            )
-                        )
-
+                    n_reclassified = np.sum((y == 1) & (y_pred == 0))
                     y[(y == 1) & (y_pred == 0)] = 0
                 except ValueError as e:
-                    print("Skipping classification update. ")
-                    print("ValueError: " + str(e))
+                    update_step = False
+                    warnings.warn(
+                        "Skipping classification update. ValueError: " + str(e)
+                    )
+                except TimeBudgetExceeded:
+                    # Keep the MCC labels of this iteration
+                    update_step = False
+                    timed_out = True
 
             ground = y == 1
-            data = data[ground, :]
+            with timer("compaction"):
+                points.compact(ground)
 
             n_removed = np.sum(y == 0)
-            converged = 100 * (n_removed / n_points) < thresh
+            converged = points.n == 0 or 100 * (n_removed / n_points) < thresh
             reached_max_iter = niter >= max_iter
-
-            if reached_max_iter and verbose:
-                print("Reached maximum number of iterations ({})".format(max_iter))
+            complete = converged or reached_max_iter
+
+            report.emit(
+                "iteration",
+                algorithm="mcc_rgb",
+                domain=domain,
+                scale=float(scale),
+                tol=float(tol),
+                iteration=niter,
+                n_in=int(n_in),
+                n_out=int(points.n),
+                n_removed_mcc=int(n_removed_mcc),
+                update=update_step,
+                n_reclassified=int(n_reclassified),
+                surface=surface_stats,
+                phases=timer.times,
+            )
+            if reached_max_iter:
+                report.emit("max_iter", domain=domain, max_iter=max_iter)
+            if timed_out:
+                report.emit(
+                    "timeout", time_budget=time_budget, domain=domain, iteration=niter
+                )
+                break
+
+            if checkpoint is not None and (
+                update_step or converged or reached_max_iter
+            ):
+                done = converged or reached_max_iter
+                save_checkpoint(
+                    checkpoint,
+                    {
+                        "key": run_key,
+                        "n_points": int(n_points),
+                        "domain": domain + 1 if done else domain,
+                        "iteration": 0 if done else niter + 1,
+                        "reached_max_iter": reached_max_iter,
+                    },
+                    {"indices": points.indices, "removed": removed},
+                    model=pipeline,
+                )
+                report.emit(
+                    "checkpoint", checkpoint=checkpoint, domain=domain, iteration=niter
+                )
 
             niter += 1
 
-    labels = intersect_rows(data, original_data)
+        if timed_out:
+            break
+        if complete:
+            completed_domains.append(domain)
+
+    labels = points.labels()
+    data = data[points.indices, :]
+    report.emit(
+        "finish",
+        n_points=int(labels.shape[0]),
+        n_ground=int(data.shape[0]),
+        timed_out=timed_out,
+        completed_domains=completed_domains,
+    )
+
+    if use_las_codes:
+        labels[labels == 0] = 4  # Vegetation
+        labels[labels == 1] = 2  # Ground
+
+    if return_report:
+        return data, labels, report
+    return data, labels  # , updated
+
 
-    if verbose:
-        n_ground = data.shape[0]
-        n_points = original_data.shape[0]
-        print()
-        print(
-            "Retained {} ground points ({:.2f} %)".format(
-                n_ground, 100 * (n_ground / n_points)
+def _mcc_rgb_chunked(
+    data,
+    memory_limit,
+    candidates=None,
+    use_las_codes=False,
+    callback=None,
+    return_report=False,
+    verbose=False,
+    **kwargs,
+):
+    """ Runs mcc_rgb in spatial chunks planned to fit a memory budget """
+    memory_limit = parse_memory_size(memory_limit)
+    report = RunReport(callback=callback, verbose=verbose)
+    plan = plan_mcc_rgb_memory(
+        data.shape[0],
+        memory_limit,
+        n_columns=data.shape[1],
+        n_train=kwargs["n_train"],
+        n_components=kwargs.get("n_components", DEFAULT_PARAMETERS["n_components"]),
+        geometric_features=kwargs["geometric_features"],
+        n_jobs=kwargs["n_jobs"],
+        resident_bytes=resident_mcc_rgb_memory(data.shape[0], data.shape[1]),
+    )
+    if not plan["fits"]:
+        warnings.warn(
+            "Cannot fit mcc_rgb within a memory limit of {} bytes. Using chunks "
+            "of {} points, with an estimated {} bytes per chunk.".format(
+                memory_limit, plan["points_per_chunk"], plan["estimate"]["total"]
             )
         )
+    report.emit(
+        "plan",
+        memory_limit=memory_limit,
+        points_per_chunk=plan["points_per_chunk"],
+        n_chunks=plan["n_chunks"],
+        predict_block_size=plan["predict_block_size"],
+        n_train=plan["n_train"],
+        estimate=plan["estimate"]["total"],
+        resident_bytes=plan["resident_bytes"],
+        fits=plan["fits"],
+    )
+    kwargs.update(
+        n_train=plan["n_train"], predict_block_size=plan["predict_block_size"]
+    )
+
+    checkpoint = kwargs.pop("checkpoint", None)
+    time_budget = kwargs.pop("time_budget", None)
+    deadline = Deadline(time_budget)
+    timed_out = False
+    completed_domains = None
+
+    def classify(points, candidates, callback, tile=None):
+        # Copy the scale lists, which mcc_rgb extends with training scales
+        params = dict(
+            kwargs, scales=copy_scales(kwargs["scales"]), tols=list(kwargs["tols"])
+        )
+        if checkpoint is not None and tile is not None:
+            root, ext = os.path.splitext(checkpoint)
+            params["checkpoint"] = "{}_tile{}{}".format(root, tile, ext)
+        else:
+            params["checkpoint"] = checkpoint
+        _, labels, tile_report = mcc_rgb(
+            points,
+            candidates=candidates,
+            time_budget=deadline.remaining(),
+            callback=callback,
+            return_report=True,
+            **params,
+        )
+        return labels, tile_report
+
+    if plan["n_chunks"] == 1:
+        labels, tile_report = classify(data, candidates, report.forward())
+        timed_out = tile_report.timed_out
+        completed_domains = tile_report.completed_domains
+    else:
+        xy = data[:, 0:2]
+        buffer = CHUNK_BUFFER_FACTOR * largest_scale(
+            data, kwargs["scales"], kwargs["training_scales"]
+        )
+        tiles = balanced_tiles(
+            xy,
+            max_points=plan["points_per_chunk"],
+            n_tiles=plan["n_chunks"],
+            buffer=buffer,
+        )
+        largest = tile_counts(xy, tiles, buffer=buffer).max()
+        if largest > plan["points_per_chunk"]:
+            warnings.warn(
+                "Could not split points into chunks of at most {} points. The "
+                "largest chunk has {} points.".format(plan["points_per_chunk"], largest)
+            )
+
+        # Points of tiles that are not classified in time are left as ground
+        if candidates is None:
+            labels = np.ones((data.shape[0],), dtype=bool)
+        else:
+            labels = np.array(candidates, dtype=bool)
+        for tile, indices, core in iter_tiles(xy, tiles, buffer=buffer):
+            if deadline.expired():
+                timed_out = True
+                completed_domains = []
+                report.emit(
+                    "timeout", time_budget=time_budget, domain=None, iteration=None
+                )
+                break
+            report.emit(
+                "tile",
+                tile=tile,
+                n_tiles=len(tiles),
+                n_points=len(indices),
+                n_core=int(np.count_nonzero(core)),
+            )
+            tile_labels, tile_report = classify(
+                data[indices, :],
+                None if candidates is None else candidates[indices],
+                report.forward(tile=tile),
+                tile=tile,
+            )
+            labels[indices[core]] = tile_labels[core]
+
+            # A domain is complete when it is complete in every tile
+            timed_out = timed_out or tile_report.timed_out
+            if completed_domains is None:
+                completed_domains = tile_report.completed_domains
+            completed_domains = [
+                domain
+                for domain in completed_domains
+                if domain in tile_report.completed_domains
+            ]
+
+    data = data[labels, :]
+    report.emit(
+        "finish",
+        n_points=int(labels.shape[0]),
+        n_ground=int(data.shape[0]),
+        timed_out=timed_out,
+        completed_domains=completed_domains or [],
+    )
 
     if use_las_codes:
         labels[labels == 0] = 4  # Vegetation
         labels[labels == 1] = 2  # Ground
 
-    return data, labels  # , updated
+    if return_report:
+        return data, labels, report
+    return data, labels
+
+
+def auto_scales(data, method="auto", factors=AUTO_SCALE_FACTORS, q=50):
+    """ Chooses interpolation scales from the nominal point spacing
+
+    The scales are multiples of the nominal point spacing estimated from
+    point counts in a grid (see pointutils.nominal_spacing), so sparse
+    lidar gets coarser scales and dense photogrammetric point clouds get
+    finer scales.
+
+    Parameters
+    ----------
+        data: array
+            A n x d data matrix with rows [x, y, z, ...]
+
+        method: str
+            The method of choosing scales. Only "auto" is supported.
+
+        factors: list
+            The multiples of the point spacing. Defaults to [1, 2, 3].
+
+        q: float
+            The percentile of local point spacings to use. Defaults to 50.
+
+    Returns
+    -------
+        A list of interpolation scales
+    """
+    if method != "auto":
+        raise ValueError(
+            "Unsupported scales {}. Please give a list of scales "
+            "or 'auto'.".format(method)
+        )
+    spacing = nominal_spacing(data, q=q)
+    return [factor * spacing for factor in factors]
+
+
+def largest_scale(data, scales, training_scales=None):
+    """ Returns the largest interpolation scale of a run, e.g., for buffers
+
+    If scales is "auto", the scales of the sparser areas of data are used,
+    since each part of a tiled run chooses its own scales.
+    """
+    if isinstance(scales, str):
+        scales = auto_scales(data, method=scales, q=BUFFER_SPACING_PERCENTILE)
+    if training_scales is None:
+        training_scales = 0
+    return float(max(np.max(scales), np.max(training_scales)))
+
+
+def copy_scales(scales):
+    """ Copies a list of scales, which mcc_rgb extends with training scales """
+    if isinstance(scales, str):
+        return scales
+    return list(scales)
+
+
+def _checkpoint_key(
+    data,
+    scales,
+    tols,
+    threshs,
+    training_scales,
+    training_tols,
+    candidates=None,
+    color_stats=None,
+    pyramid=False,
+    pipeline_kwargs=None,
+    **params,
+):
+    """ Identifies the points and parameters of a run for its checkpoints
+
+    Any other keyword argument is a JSON-serializable parameter that changes
+    the results of the run, e.g., n_train and seed.
+    """
+    key = {
+        "fingerprint": fingerprint(data),
+        "n_total": int(data.shape[0]),
+        "scales": [float(value) for value in scales],
+        "tols": [float(value) for value in tols],
+        "threshs": [float(value) for value in threshs],
+        "training_scales": [float(value) for value in training_scales],
+        "training_tols": [float(value) for value in training_tols],
+        "candidates": None if candidates is None else fingerprint(candidates),
+        "color_stats": None
+        if color_stats is None
+        else fingerprint(np.stack(color_stats.in_range())),
+        "pyramid": pyramid
+        if isinstance(pyramid, bool)
+        else [float(value) for value in pyramid],
+        "pipeline_kwargs": {
+            name: repr(value) for name, value in (pipeline_kwargs or {}).items()
+        },
+    }
+    key.update(params)
+    return key
+
+
+def _model_fingerprint(model):
+    """ Identifies a trained classifier by a hash of its pickled bytes """
+    return fingerprint(np.frombuffer(pickle.dumps(model), dtype=np.uint8))
+
+
+@traced("core.pyramid")
+def _pyramid_pass(points, scales, tols, pyramid, report, cache=None):
+    """ Removes obvious nonground points using a coarse, downsampled surface
+
+    Returns the indices of the removed points in the input data.
+    """
+    if pyramid is True:
+        scale = PYRAMID_SCALE_FACTOR * np.max(scales)
+        tol = PYRAMID_TOL_FACTOR * np.max(tols)
+    else:
+        scale, tol = pyramid
+
+    timer = PhaseTimer()
+    n_points = points.n
+    with timer("surface"):
+        height = excess_height(points.xyz, scale, downsample=True, cache=cache)
+    ground = height < tol
+    removed = points.indices[~ground]
+    with timer("compaction"):
+        points.compact(ground)
+
+    report.emit(
+        "pyramid",
+        scale=float(scale),
+        tol=float(tol),
+        n_in=int(n_points),
+        n_out=int(points.n),
+        phases=timer.times,
+    )
+    return removed
+
+
+def _fill_nonfinite(X):
+    """ Replaces NaN and infinite values by the median of their column """
+    X = np.array(X, dtype=float)
+    finite = np.isfinite(X)
+    for j in range(X.shape[1]):
+        values = X[finite[:, j], j]
+        X[~finite[:, j], j] = np.median(values) if len(values) > 0 else 0.0
+    return X
+
+
+class _ActivePoints(object):
+    """ The coordinates of points retained by MCC iterations
+
+    Keeps the xyz coordinates of retained points in a C-contiguous buffer,
+    which is passed to the surface interpolation without copying, and the
+    indices of the retained points in the input data. Removing points
+    compacts both into a second preallocated buffer, so the iterations do
+    not copy any other data columns.
+    """
+
+    def __init__(self, data, mask=None):
+        self.n_total = data.shape[0]
+        if mask is None:
+            indices = np.arange(self.n_total)
+        else:
+            indices = np.flatnonzero(mask)
+
+        self.n = len(indices)
+        self._xyz = np.empty((2, self.n, 3), dtype=np.float64)
+        self._indices = np.empty((2, self.n), dtype=np.intp)
+        self._xyz[0] = data[indices, 0:3]
+        self._indices[0] = indices
+        self._current = 0
+
+    @property
+    def xyz(self):
+        return self._xyz[self._current, 0 : self.n]
+
+    @property
+    def indices(self):
+        return self._indices[self._current, 0 : self.n]
+
+    def compact(self, keep):
+        """ Retains only the points where keep is True """
+        n_keep = np.count_nonzero(keep)
+        if n_keep == self.n:
+            return
+        other = 1 - self._current
+        np.compress(keep, self.xyz, axis=0, out=self._xyz[other, 0:n_keep])
+        np.compress(keep, self.indices, out=self._indices[other, 0:n_keep])
+        self._current = other
+        self.n = n_keep
+
+    def labels(self):
+        """ Returns a mask of retained points in the input data """
+        labels = np.zeros((self.n_total,), dtype=bool)
+        labels[self.indices] = True
+        return labels
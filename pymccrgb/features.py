@@ -4,13 +4,149 @@ Calculate indices and other features from multi-channel point cloud data
 Inputs are assumed to be n x 6 arrays with each row being x, y, z, r, g, b
 """
 
+import os
+
 import numpy as np
 
-from skimage.color import rgb2lab
-from skimage.exposure import rescale_intensity
+from concurrent.futures import ThreadPoolExecutor
+
+from .pointutils import DEFAULT_CHUNK_SIZE, PointIndex
+from .profiling import span, traced
+
+EIGENVALUE_FEATURE_NAMES = [
+    "linearity",
+    "planarity",
+    "sphericity",
+    "curvature",
+    "verticality",
+]
+
+COLOR_HISTOGRAM_BINS = 2 ** 16
+COLOR_PERCENTILES = (1, 99)
+
 
+class ColorStatistics(object):
+    """ Streaming statistics of the color channels of a point cloud
+
+    Statistics are accumulated one chunk of points at a time with update(),
+    and statistics of different chunks or workers can be combined with
+    merge(). Passing the statistics to the color feature functions rescales
+    each channel from a fixed percentile range, so features are comparable
+    between tiles and are not set by a few outliers.
+
+    Percentiles are calculated from histograms of integer color values
+    between 0 and 65535 (e.g., 8 or 16 bit LAS colors). The minimum and
+    maximum are exact.
+
+    Parameters
+    ----------
+        n_channels: int
+            The number of color channels. Defaults to 3.
+
+        lower: float
+            The lower percentile of the range of each channel. Defaults to 1.
+
+        upper: float
+            The upper percentile of the range of each channel. Defaults to
+            99.
+
+    Attributes
+    ----------
+        min: array
+            The minimum of each channel
+
+        max: array
+            The maximum of each channel
+
+        count: int
+            The number of points
+    """
 
-def calculate_color_features(data):
+    def __init__(
+        self, n_channels=3, lower=COLOR_PERCENTILES[0], upper=COLOR_PERCENTILES[1]
+    ):
+        self.lower = lower
+        self.upper = upper
+        self.min = np.full((n_channels,), np.inf)
+        self.max = np.full((n_channels,), -np.inf)
+        self.count = 0
+        self.histograms = np.zeros((n_channels, COLOR_HISTOGRAM_BINS), dtype=np.int64)
+
+    @classmethod
+    def from_data(cls, data, chunk_size=DEFAULT_CHUNK_SIZE, **kwargs):
+        """ Calculates statistics of an n x d data array in chunks
+
+        Any other keyword argument is passed to ColorStatistics.
+        """
+        stats = cls(**kwargs)
+        for start in range(0, data.shape[0], chunk_size):
+            stats.update(data[start : start + chunk_size])
+        return stats
+
+    def update(self, data):
+        """ Adds the colors of an n x d data array with rows [x, y, z, r, g, b] """
+        rgb = data[:, 3:6]
+        finite = np.isfinite(rgb).all(axis=1)
+        rgb = rgb[finite]
+        if rgb.shape[0] == 0:
+            return self
+        if (
+            np.any(rgb < 0)
+            or np.any(rgb >= COLOR_HISTOGRAM_BINS)
+            or np.any(rgb != np.rint(rgb))
+        ):
+            raise ValueError(
+                "Color statistics need integer colors between 0 and {}, e.g., "
+                "8 or 16 bit LAS colors. Please rescale other colors, e.g., "
+                "floats between 0 and 1.".format(COLOR_HISTOGRAM_BINS - 1)
+            )
+
+        self.min = np.minimum(self.min, rgb.min(axis=0))
+        self.max = np.maximum(self.max, rgb.max(axis=0))
+        self.count += rgb.shape[0]
+        values = np.clip(np.rint(rgb), 0, COLOR_HISTOGRAM_BINS - 1).astype(np.int64)
+        for i in range(self.histograms.shape[0]):
+            self.histograms[i] += np.bincount(
+                values[:, i], minlength=COLOR_HISTOGRAM_BINS
+            )
+        return self
+
+    def merge(self, other):
+        """ Adds the statistics of another ColorStatistics object """
+        self.min = np.minimum(self.min, other.min)
+        self.max = np.maximum(self.max, other.max)
+        self.count += other.count
+        self.histograms += other.histograms
+        return self
+
+    def percentile(self, q):
+        """ Returns the q-th percentile (0 to 100) of each channel """
+        cdf = np.cumsum(self.histograms, axis=1)
+        target = q / 100 * cdf[:, -1]
+        return np.array([np.searchsorted(c, t) for c, t in zip(cdf, target)], float)
+
+    def in_range(self, lower=None, upper=None):
+        """ Returns the range of each channel to rescale to 0-255
+
+        Parameters
+        ----------
+            lower: float
+                Optional lower percentile. Defaults to the lower attribute.
+
+            upper: float
+                Optional upper percentile. Defaults to the upper attribute.
+
+        Returns
+        -------
+            A tuple (low, high) of arrays of the range of each channel
+        """
+        low = self.percentile(self.lower if lower is None else lower)
+        high = self.percentile(self.upper if upper is None else upper)
+        return low, high
+
+
+@traced("features.color")
+def calculate_color_features(data, stats=None):
     """ Calculates color features related to the greenness of each point.
 
     The default features are [a, b, NGRDVI] where a and b are the green-red and
@@ -21,22 +157,152 @@ def calculate_color_features(data):
         data: array
         An n x d array of input data. Rows are [x, y, z, r, g, b, ...]
 
+        stats: ColorStatistics
+            Optional color statistics used to rescale colors. By default,
+            colors are rescaled by the minimum and maximum of data.
+
     Returns
     -------
         An n x 3 array of features for each point.
     """
+    from skimage.color import rgb2lab
 
-    rgb = rescale_intensity(data[:, 3:6], out_range="uint8").astype(np.uint8)
+    rgb = _rescale_colors(data, stats)
     lab = rgb2lab(np.array([rgb]))[0].reshape(-1, 3)
-    ngrdvi = calculate_ngrdvi(data).reshape(-1, 1)
+    ngrdvi = calculate_ngrdvi(data, stats=stats).reshape(-1, 1)
     return np.hstack([lab[:, 1:3], ngrdvi])
 
 
-def calculate_eigenvalue_features(data):
-    raise NotImplementedError("This method has not yet been implemented.")
+@traced("features.eigenvalue")
+def calculate_eigenvalue_features(
+    data, k=10, radius=None, index=None, chunk_size=DEFAULT_CHUNK_SIZE, n_jobs=1
+):
+    """ Calculates geometric features from the local covariance of each point
+
+    The eigenvalues l1 >= l2 >= l3 of the covariance matrix of the
+    neighborhood of each point are used to calculate the features
+    [linearity, planarity, sphericity, curvature, verticality], where
 
+        linearity = (l1 - l2) / l1
+        planarity = (l2 - l3) / l1
+        sphericity = l3 / l1
+        curvature = l3 / (l1 + l2 + l3)
+        verticality = 1 - |nz|
 
-def calculate_ngrdvi(data):
+    and nz is the vertical component of the normal vector, the eigenvector of
+    the smallest eigenvalue. Points are processed in chunks, and chunks are
+    processed in parallel threads.
+
+    Parameters
+    ----------
+        data: array
+        An n x d array of input data. Rows are [x, y, z, ...]
+
+        k: int
+            The number of nearest neighbors in each neighborhood, including
+            the point itself. Ignored if radius is given. Defaults to 10.
+
+        radius: float
+            Optional neighborhood radius. If given, neighborhoods are all
+            points within radius of each point.
+
+        index: PointIndex
+            Optional 3D index of the data coordinates
+
+        chunk_size: int
+            The number of points to process at once
+
+        n_jobs: int
+            The number of threads to use. Defaults to 1; -1 uses all cores.
+
+    Returns
+    -------
+        An n x 5 array of features for each point. Features are NaN for
+        points with fewer than three neighbors within radius, or other
+        degenerate neighborhoods.
+    """
+    xyz = np.ascontiguousarray(data[:, 0:3], dtype=np.float64)
+    if index is None:
+        index = PointIndex(xyz, dims=3)
+    if n_jobs == -1:
+        n_jobs = os.cpu_count()
+
+    def process(start):
+        with span("features.eigenvalue_chunk", start=start):
+            chunk = xyz[start : start + chunk_size]
+            if radius is None:
+                _, idx = index.query(chunk, k=k, workers=1)
+                cov = _knn_covariance(xyz, chunk, idx)
+            else:
+                neighbors = index.query_radius(chunk, radius, workers=1)
+                cov = _radius_covariance(xyz, chunk, neighbors)
+            return _eigenvalue_features(cov)
+
+    starts = range(0, xyz.shape[0], chunk_size)
+    if n_jobs is not None and n_jobs > 1:
+        with ThreadPoolExecutor(max_workers=n_jobs) as pool:
+            features = list(pool.map(process, starts))
+    else:
+        features = [process(start) for start in starts]
+
+    if len(features) == 0:
+        return np.empty((0, len(EIGENVALUE_FEATURE_NAMES)))
+    return np.vstack(features)
+
+
+def _knn_covariance(xyz, chunk, idx):
+    """ Returns the covariance matrices of k-nearest neighborhoods """
+    if idx.ndim == 1:
+        idx = idx.reshape(-1, 1)
+    neighbors = xyz[idx] - chunk[:, None, :]
+    neighbors -= neighbors.mean(axis=1, keepdims=True)
+    return np.einsum("nki,nkj->nij", neighbors, neighbors) / idx.shape[1]
+
+
+def _radius_covariance(xyz, chunk, neighbors):
+    """ Returns the covariance matrices of variable-size neighborhoods """
+    lengths = np.array([len(n) for n in neighbors])
+    cov = np.full((len(neighbors), 3, 3), np.nan)
+    valid = lengths >= 3
+    if not valid.any():
+        return cov
+
+    idx = np.concatenate([n for n, v in zip(neighbors, valid) if v])
+    owner = np.repeat(np.flatnonzero(valid), lengths[valid])
+    offsets = np.cumsum(lengths[valid]) - lengths[valid]
+    centered = xyz[idx] - chunk[owner]
+    mean = np.add.reduceat(centered, offsets, axis=0) / lengths[valid, None]
+    second = (
+        np.add.reduceat(centered[:, :, None] * centered[:, None, :], offsets, axis=0)
+        / lengths[valid, None, None]
+    )
+    cov[valid] = second - mean[:, :, None] * mean[:, None, :]
+    return cov
+
+
+def _eigenvalue_features(cov):
+    """ Returns eigenvalue features of a batch of covariance matrices """
+    features = np.full((cov.shape[0], len(EIGENVALUE_FEATURE_NAMES)), np.nan)
+    valid = np.isfinite(cov).all(axis=(1, 2))
+    if not valid.any():
+        return features
+
+    # eigh returns eigenvalues in ascending order
+    values, vectors = np.linalg.eigh(cov[valid])
+    values = np.clip(values, 0, None)
+    l3, l2, l1 = values[:, 0], values[:, 1], values[:, 2]
+    total = l1 + l2 + l3
+    with np.errstate(divide="ignore", invalid="ignore"):
+        features[valid, 0] = (l1 - l2) / l1
+        features[valid, 1] = (l2 - l3) / l1
+        features[valid, 2] = l3 / l1
+        features[valid, 3] = l3 / total
+    features[valid, 4] = 1 - np.abs(vectors[:, 2, 0])
+    return features
+
+
+@traced("features.ngrdvi")
+def calculate_ngrdvi(data, stats=None):
     """ Calculates red-green difference index (NGRDVI) from color data
 
     Parameters
@@ -44,19 +310,23 @@ def calculate_ngrdvi(data):
         data: array
         An n x d array of input data. Rows are [x, y, z, r, g, b, ...]
 
+        stats: ColorStatistics
+            Optional color statistics used to rescale colors
+
     Returns
     -------
         An n x 1 array of NGRDVI values
     """
 
-    rgb = rescale_intensity(data[:, 3:6], out_range="uint8").astype(np.uint8)
+    rgb = _rescale_colors(data, stats)
     red = rgb[:, 0].reshape(-1, 1)
     green = rgb[:, 1].reshape(-1, 1)
 
     return (green - red) / (green + red)
 
 
-def calculate_vdvi(data):
+@traced("features.vdvi")
+def calculate_vdvi(data, stats=None):
     """ Calculates visual difference vegetation index (VDVI) from color data
 
     Parameters
@@ -64,14 +334,36 @@ def calculate_vdvi(data):
         data: array
         An n x d array of input data. Rows are [x, y, z, r, g, b, ...]
 
+        stats: ColorStatistics
+            Optional color statistics used to rescale colors
+
     Returns
     -------
         An n x 1 array of VDVI values
     """
 
-    rgb = rescale_intensity(data[:, 3:6], out_range="uint8").astype(np.uint8)
+    rgb = _rescale_colors(data, stats)
     red = rgb[:, 0].reshape(-1, 1)
     green = rgb[:, 1].reshape(-1, 1)
     blue = rgb[:, 2].reshape(-1, 1)
 
     return (2 * green - red - blue) / (2 * green + red + blue)
+
+
+def _rescale_colors(data, stats=None):
+    """ Rescales colors to 8 bit integers by data or fixed statistics
+
+    By default, colors are rescaled by the minimum and maximum of all
+    channels of data. With statistics, each channel is rescaled by its own
+    percentile range, and values outside the range are clipped.
+    """
+    if stats is None:
+        from skimage.exposure import rescale_intensity
+
+        rgb = rescale_intensity(data[:, 3:6], in_range="image", out_range="uint8")
+        return rgb.astype(np.uint8)
+
+    low, high = stats.in_range()
+    width = np.where(high > low, high - low, 1.0)
+    rgb = np.clip((data[:, 3:6] - low) / width, 0, 1) * 255
+    return rgb.astype(np.uint8)
@@ -0,0 +1,379 @@
+""" Incremental classification of point clouds that grow over time """
+
+import inspect
+import os
+
+import numpy as np
+
+from . import core
+from .batch import DEFAULT_TILE_POINTS
+from .checkpoint import load_checkpoint, save_checkpoint
+from .telemetry import RunReport
+from .tiling import balanced_tiles, tile_mask
+
+STORE_FILENAME = "store.npz"
+
+
+class TileStore(object):
+    """ A classified point cloud stored on disk in tiles
+
+    Each tile file holds the points of the tile, their labels and ids, and
+    the color classifier trained on the tile (for mcc_rgb). When points are
+    added with update, only the tiles whose buffered extents contain new
+    points are classified again, so an update costs time in proportion to
+    the new data rather than to the whole point cloud. A reclassified tile
+    continues training its stored classifier (see the warm_start argument
+    of core.mcc_rgb) rather than training a new one.
+
+    The tiles that receive new points are written first, and the number of
+    points in store.npz last, so an update that fails part way never
+    leaves the store with more points than it records.
+
+    Interpolated surfaces are not stored, since pymcc_lidar does not expose
+    them and any surface near new points has to be recomputed anyway.
+
+    Use TileStore.create to classify a point cloud into a new store, and
+    TileStore(directory) to open an existing store.
+
+    Parameters
+    ----------
+        directory: str
+            The directory of the store
+
+    Attributes
+    ----------
+        tiles: array
+            A k x 4 array of tile bounds (see tiling.balanced_tiles)
+
+        method: str
+            The classification function, "mcc" or "mcc_rgb"
+
+        params: dict
+            The keyword arguments of method
+
+        buffer: float
+            The width of the buffer around each tile
+
+        n_points: int
+            The number of points in the store. Points have ids 0, ...,
+            n_points - 1 in the order they were added.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        state, arrays, params = load_checkpoint(os.path.join(directory, STORE_FILENAME))
+        self.method = state["method"]
+        self.buffer = state["buffer"]
+        self.n_points = state["n_points"]
+        self.tiles = arrays["tiles"]
+        self.params = params
+
+    def __len__(self):
+        return len(self.tiles)
+
+    @classmethod
+    def create(
+        cls,
+        directory,
+        data,
+        method="mcc_rgb",
+        max_points=DEFAULT_TILE_POINTS,
+        buffer=None,
+        candidates=None,
+        callback=None,
+        return_report=False,
+        verbose=False,
+        **params,
+    ):
+        """ Classifies a point cloud in tiles and saves it as a new store
+
+        Parameters
+        ----------
+            directory: str
+                The directory of the store. It must not contain a store.
+
+            data: array
+                A n x d data matrix with rows [x, y, z, r, g, b ...]
+
+            method: str
+                The classification function, "mcc" or "mcc_rgb". Defaults to
+                "mcc_rgb".
+
+            max_points: int
+                The maximum number of points in a buffered tile. Tiles are
+                planned for the initial points and are not split by updates.
+
+            buffer: float
+                The width of the buffer around each tile. Defaults to four
+                times the largest interpolation scale.
+
+            candidates: array
+                Optional n x 1 boolean mask of points that can be ground
+
+            callback, return_report, verbose:
+                See core.mcc_rgb
+
+            Any other keyword argument to method, e.g., scales and tols
+
+        Returns
+        -------
+            store: TileStore
+                The new store
+
+            report: RunReport
+                The events of the run on each tile, if return_report is True
+        """
+        if method not in ("mcc", "mcc_rgb"):
+            raise ValueError(
+                "Unsupported method {}. Please use 'mcc' or 'mcc_rgb'.".format(method)
+            )
+        filename = os.path.join(directory, STORE_FILENAME)
+        if os.path.exists(filename):
+            raise ValueError("A tile store already exists in {}".format(directory))
+        os.makedirs(directory, exist_ok=True)
+
+        if buffer is None:
+            scales = params.get(
+                "scales",
+                inspect.signature(getattr(core, method)).parameters["scales"].default,
+            )
+            buffer = core.CHUNK_BUFFER_FACTOR * core.largest_scale(
+                data, scales, params.get("training_scales")
+            )
+        tiles = balanced_tiles(data[:, 0:2], max_points=max_points, buffer=buffer)
+        save_checkpoint(
+            filename,
+            {"method": method, "buffer": float(buffer), "n_points": 0},
+            {"tiles": tiles},
+            model=params,
+        )
+
+        store = cls(directory)
+        report = RunReport(callback=callback, verbose=verbose)
+        store._add(data, candidates)
+        store._classify(range(len(tiles)), report)
+
+        if return_report:
+            return store, report
+        return store
+
+    def update(
+        self, data, candidates=None, callback=None, return_report=False, verbose=False
+    ):
+        """ Adds points to the store and reclassifies the tiles around them
+
+        Parameters
+        ----------
+            data: array
+                An m x d data matrix of new points with the same columns as
+                the points in the store
+
+            candidates: array
+                Optional m x 1 boolean mask of new points that can be ground
+
+            callback, return_report, verbose:
+                See core.mcc_rgb
+
+        Returns
+        -------
+            tiles: list
+                The indices of the reclassified tiles
+
+            report: RunReport
+                The events of the run on each tile, if return_report is True
+        """
+        report = RunReport(callback=callback, verbose=verbose)
+        xy = data[:, 0:2]
+        affected = [
+            tile
+            for tile, bounds in enumerate(self.tiles)
+            if np.any(tile_mask(xy, bounds, buffer=self.buffer))
+        ]
+        self._add(data, candidates)
+        self._classify(affected, report)
+
+        if return_report:
+            return affected, report
+        return affected
+
+    def read(self):
+        """ Returns all points in the store and their labels
+
+        Returns
+        -------
+            data: array
+                An n x d array of points, in the order they were added
+
+            labels: array
+                An n x 1 array of labels (1 is ground, 0 is nonground)
+        """
+        tiles = [self._load(tile)[1] for tile in range(len(self.tiles))]
+        tiles = [arrays for arrays in tiles if len(arrays["ids"]) > 0]
+        order = np.argsort(np.concatenate([arrays["ids"] for arrays in tiles]))
+        data = np.vstack([arrays["points"] for arrays in tiles])
+        labels = np.concatenate([arrays["labels"] for arrays in tiles])
+        return data[order], labels[order]
+
+    def model(self, tile):
+        """ Returns the color classifier trained on a tile, or None for mcc """
+        return self._load(tile)[2]
+
+    def _filename(self, tile):
+        return os.path.join(self.directory, "tile_{}.npz".format(tile))
+
+    def _load(self, tile):
+        filename = self._filename(tile)
+        if not os.path.exists(filename):
+            return {}, _empty_tile(0), None
+        return load_checkpoint(filename)
+
+    def _save(self, tile, arrays, model=None):
+        save_checkpoint(self._filename(tile), {"tile": tile}, arrays, model=model)
+
+    def _add(self, data, candidates=None):
+        """ Appends points to the tiles that contain them """
+        ids = np.arange(self.n_points, self.n_points + data.shape[0])
+        if candidates is None:
+            candidates = np.ones((data.shape[0],), dtype=bool)
+
+        # Stage the new tile files, and replace the old ones only when all
+        # of them have been written
+        staged = []
+        try:
+            for tile, bounds in enumerate(self.tiles):
+                inside = tile_mask(data[:, 0:2], bounds)
+                if not np.any(inside):
+                    continue
+                _, arrays, model = self._load(tile)
+                if len(arrays["ids"]) == 0:
+                    arrays = _empty_tile(data.shape[1])
+                filename = self._filename(tile) + ".new"
+                staged.append((filename, self._filename(tile)))
+                save_checkpoint(
+                    filename,
+                    {"tile": tile},
+                    {
+                        "points": np.vstack([arrays["points"], data[inside]]),
+                        "ids": np.concatenate([arrays["ids"], ids[inside]]),
+                        "candidates": np.concatenate(
+                            [arrays["candidates"], candidates[inside]]
+                        ),
+                        # New points are ground until they are classified
+                        "labels": np.concatenate(
+                            [arrays["labels"], np.ones(np.count_nonzero(inside), bool)]
+                        ),
+                    },
+                    model=model,
+                )
+        except BaseException:
+            for filename, _ in staged:
+                if os.path.exists(filename):
+                    os.remove(filename)
+            raise
+        for filename, target in staged:
+            os.replace(filename, target)
+
+        self.n_points += data.shape[0]
+        _, arrays, params = load_checkpoint(
+            os.path.join(self.directory, STORE_FILENAME)
+        )
+        save_checkpoint(
+            os.path.join(self.directory, STORE_FILENAME),
+            {"method": self.method, "buffer": self.buffer, "n_points": self.n_points},
+            arrays,
+            model=params,
+        )
+
+    def _neighbors(self, tile):
+        """ Returns the tiles that intersect a buffered tile """
+        x_min, y_min, x_max, y_max = self.tiles[tile]
+        b = self.buffer
+        return np.flatnonzero(
+            (self.tiles[:, 0] < x_max + b)
+            & (self.tiles[:, 2] > x_min - b)
+            & (self.tiles[:, 1] < y_max + b)
+            & (self.tiles[:, 3] > y_min - b)
+        )
+
+    def _classify(self, tiles, report):
+        """ Classifies tiles with their buffers and saves their labels """
+        loaded = {}
+        func = getattr(core, self.method)
+        for tile in tiles:
+            parts = []
+            for neighbor in self._neighbors(tile):
+                if neighbor not in loaded:
+                    loaded[neighbor] = self._load(neighbor)[1]
+                arrays = loaded[neighbor]
+                if len(arrays["ids"]) == 0:
+                    continue
+                if neighbor == tile:
+                    inside = np.ones((len(arrays["ids"]),), dtype=bool)
+                else:
+                    inside = tile_mask(
+                        arrays["points"], self.tiles[tile], buffer=self.buffer
+                    )
+                parts.append((neighbor == tile, arrays, inside))
+            own = [arrays for is_tile, arrays, _ in parts if is_tile]
+            if len(own) == 0:
+                continue
+
+            points = np.vstack(
+                [arrays["points"][inside] for _, arrays, inside in parts]
+            )
+            candidates = np.concatenate(
+                [arrays["candidates"][inside] for _, arrays, inside in parts]
+            )
+            core_mask = np.concatenate(
+                [
+                    np.full(np.count_nonzero(inside), is_tile)
+                    for is_tile, _, inside in parts
+                ]
+            )
+            report.emit(
+                "tile",
+                tile=int(tile),
+                n_tiles=len(self.tiles),
+                n_points=points.shape[0],
+                n_core=int(np.count_nonzero(core_mask)),
+            )
+
+            params = dict(self.params)
+            for name in ("scales", "tols"):
+                if name in params:
+                    params[name] = core.copy_scales(params[name])
+            model = None
+            if self.method == "mcc_rgb":
+                # The final checkpoint of the run holds the trained classifier
+                checkpoint = os.path.join(self.directory, "run_{}.npz".format(tile))
+                if os.path.exists(checkpoint):
+                    os.remove(checkpoint)
+                params["checkpoint"] = checkpoint
+                model = self.model(tile)
+                if model is not None:
+                    params.update(pipeline=model, warm_start=True)
+            _, labels, _ = func(
+                points,
+                candidates=candidates,
+                callback=report.forward(tile=int(tile)),
+                return_report=True,
+                **params,
+            )
+            if self.method == "mcc_rgb" and os.path.exists(checkpoint):
+                model = load_checkpoint(checkpoint)[2]
+                os.remove(checkpoint)
+
+            arrays = dict(own[0], labels=labels[core_mask])
+            loaded[tile] = arrays
+            self._save(tile, arrays, model=model)
+
+        report.emit("finish", n_points=int(self.n_points), n_tiles=len(tiles))
+
+
+def _empty_tile(n_columns):
+    return {
+        "points": np.empty((0, n_columns)),
+        "ids": np.empty((0,), dtype=np.intp),
+        "candidates": np.empty((0,), dtype=bool),
+        "labels": np.empty((0,), dtype=bool),
+    }
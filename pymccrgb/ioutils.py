@@ -3,14 +3,20 @@
 import os
 
 import numpy as np
-import pdal
+
+from .profiling import traced
 
 DEFAULT_COLUMN_INDICES = range(6)
 DEFAULT_COLUMN_NAMES = ["X", "Y", "Z", "Red", "Green", "Blue"]
 DEFAULT_HEADER = "X,Y,Z,Red,Green,Blue"
+RETURN_COLUMN_NAMES = ["ReturnNumber", "NumberOfReturns", "Classification"]
+
+# LAS codes of vegetation, buildings, noise and bridge decks
+NONGROUND_LAS_CODES = [3, 4, 5, 6, 7, 17, 18]
 
 
-def read_data(filename, usecols=None, userows=None, nrows=None):
+@traced("ioutils.read_data")
+def read_data(filename, usecols=None, userows=None, nrows=None, prefilter=False):
     """ Loads a point cloud as numpy array
 
     Parameters
@@ -30,10 +36,22 @@ def read_data(filename, usecols=None, userows=None, nrows=None):
             Number of random rows to load. Ignored if userows is given.
             Default: Not used.
 
+        prefilter: bool
+            If True, also load the return numbers and classification of each
+            point from a LAS file and return a mask of points that can be
+            ground (see ground_candidates). Default False.
+
     Returns
     -------
-        A data array of shape (nrows x ncols)
+        A data array of shape (nrows x ncols), and if prefilter is True, an
+        nrows x 1 boolean mask of ground candidates
     """
+    if prefilter and not filename.endswith((".las", ".laz")):
+        raise ValueError(
+            "Prefiltering requires return numbers from a LAS/LAZ file. "
+            "You provided the file " + filename
+        )
+
     if filename.endswith(".csv") or filename.endswith(".txt"):
         if usecols is None:
             usecols = DEFAULT_COLUMN_INDICES
@@ -41,7 +59,13 @@ def read_data(filename, usecols=None, userows=None, nrows=None):
     elif filename.endswith(".las") or filename.endswith(".laz"):
         if usecols is None:
             usecols = DEFAULT_COLUMN_NAMES
+        if prefilter:
+            usecols = list(usecols) + RETURN_COLUMN_NAMES
         data = read_las(filename, usecols=usecols, userows=userows, nrows=nrows)
+        if prefilter:
+            n = len(RETURN_COLUMN_NAMES)
+            candidates = ground_candidates(*data[:, -n:].T)
+            return data[:, :-n], candidates
     else:
         raise ValueError(
             "Unsupported format provided. Please provide a CSV file"
@@ -50,6 +74,36 @@ def read_data(filename, usecols=None, userows=None, nrows=None):
     return data
 
 
+def ground_candidates(return_number, number_of_returns, classification=None):
+    """ Returns a mask of points that can be ground from LAS attributes
+
+    Only last returns can be ground. Points that have already been
+    classified as vegetation, buildings, noise or bridge decks are also
+    excluded.
+
+    Parameters
+    ----------
+        return_number: array
+            An n x 1 array of LAS return numbers
+
+        number_of_returns: array
+            An n x 1 array of LAS numbers of returns
+
+        classification: array
+            Optional n x 1 array of LAS classification codes
+
+    Returns
+    -------
+        An n x 1 boolean array, True for points that can be ground
+    """
+    # Files without return information have zero returns
+    candidates = (return_number >= number_of_returns) | (number_of_returns == 0)
+    if classification is not None:
+        candidates &= ~np.isin(classification, NONGROUND_LAS_CODES)
+    return candidates
+
+
+@traced("ioutils.read_txt")
 def read_txt(filename, usecols=DEFAULT_COLUMN_INDICES, userows=None, nrows=None):
     """ Loads a point cloud from text file as numpy array
 
@@ -97,6 +151,7 @@ def read_txt(filename, usecols=DEFAULT_COLUMN_INDICES, userows=None, nrows=None)
     return np.array(data)
 
 
+@traced("ioutils.read_las")
 def read_las(filename, usecols=DEFAULT_COLUMN_NAMES, userows=None, nrows=None):
     """Loads a point cloud from a LAS or LAZ file into a Numpy array
 
@@ -125,6 +180,8 @@ def read_las(filename, usecols=DEFAULT_COLUMN_NAMES, userows=None, nrows=None):
     """
 
     json = '{"pipeline": ["' + filename + '"]}'
+    import pdal
+
     pipeline = pdal.Pipeline(json)
     pipeline.validate()
     pipeline.loglevel = 0
@@ -166,6 +223,8 @@ def write_dem(data, filename, resolution=1, radius=None):
         + filename
         + '"}]}'
     )
+    import pdal
+
     pipeline = pdal.Pipeline(json)
     pipeline.validate()
     pipeline.loglevel = 0
@@ -188,6 +247,8 @@ def write_pdal(arr, filename, writer, header=DEFAULT_HEADER):
         + filename
         + '"}]}'
     )
+    import pdal
+
     pipeline = pdal.Pipeline(json)
     pipeline.validate()
     pipeline.loglevel = 0
@@ -0,0 +1,276 @@
+""" Estimates of the memory used by MCC-RGB and plans that fit a budget """
+
+import math
+import os
+import re
+
+from .classification import DEFAULT_PARAMETERS, DEFAULT_PREDICT_BLOCK_SIZE
+from .features import EIGENVALUE_FEATURE_NAMES
+from .pointutils import DEFAULT_CHUNK_SIZE
+
+FLOAT_BYTES = 8
+N_COLOR_FEATURES = 3
+
+# Approximate bytes per point of each stage, excluding the feature matrix
+ACTIVE_POINTS_BYTES_PER_POINT = 64  # double-buffered xyz and indices
+SURFACE_BYTES_PER_POINT = 80  # xyz copy, heights and interpolation
+COLOR_TEMP_BYTES_PER_POINT = 96  # rescaled colors and CIE-Lab conversion
+MASK_BYTES_PER_POINT = 4  # boolean masks and labels
+KDTREE_BYTES_PER_POINT = 64  # neighbor search index for eigenvalue features
+
+# Limits on the size of the work units chosen by plan_mcc_rgb_memory
+MIN_CHUNK_POINTS = 10000
+MIN_PREDICT_BLOCK_SIZE = 1024
+MIN_TRAIN = 100
+MAX_FIXED_FRACTION = 0.5
+
+_UNITS = {"": 1, "K": 2 ** 10, "M": 2 ** 20, "G": 2 ** 30, "T": 2 ** 40}
+
+
+def parse_memory_size(size):
+    """ Converts a memory size to bytes
+
+    Parameters
+    ----------
+        size: int, float or str
+            A number of bytes, or a string with a binary unit, e.g., "512MB",
+            "4G" or "1.5 GiB"
+
+    Returns
+    -------
+        The size in bytes as an int
+    """
+    if isinstance(size, str):
+        match = re.fullmatch(
+            r"\s*([0-9.]+)\s*([KMGT]?)(I?B)?\s*", size.upper(), flags=re.ASCII
+        )
+        if match is None:
+            raise ValueError("Could not parse memory size {}".format(size))
+        value, unit = float(match.group(1)), match.group(2)
+        size = value * _UNITS[unit]
+    size = int(size)
+    if size <= 0:
+        raise ValueError("Memory size must be positive, but was {}".format(size))
+    return size
+
+
+def estimate_mcc_rgb_memory(
+    n_points,
+    n_columns=6,
+    n_train=int(1e3),
+    n_components=DEFAULT_PARAMETERS["n_components"],
+    geometric_features=False,
+    predict_block_size=DEFAULT_PREDICT_BLOCK_SIZE,
+    n_jobs=1,
+):
+    """ Estimates the memory used by each stage of mcc_rgb
+
+    The estimates are deliberately conservative: the total assumes that
+    every stage is held in memory at once.
+
+    Parameters
+    ----------
+        n_points: int
+            The number of points
+
+        n_columns: int
+            The number of columns of the data matrix. Defaults to 6.
+
+        n_train: int
+            The number of training examples
+
+        n_components: int
+            The number of components of the RBF feature map
+
+        geometric_features: bool
+            Whether eigenvalue features are calculated
+
+        predict_block_size: int
+            The number of points predicted at once
+
+        n_jobs: int
+            The number of threads used for features and prediction
+
+    Returns
+    -------
+        A dictionary of estimated bytes for the stages data, active_points,
+        surface, features, training and predict, and their total
+    """
+    n_jobs = _n_threads(n_jobs)
+    n_features = _n_features(geometric_features)
+    per_point = _per_point_bytes(n_columns, geometric_features)
+
+    stages = {
+        "data": n_points * per_point["data"],
+        "active_points": n_points * per_point["active_points"],
+        "surface": n_points * per_point["surface"],
+        "features": n_points * per_point["features"],
+        "training": n_train * (n_features + n_components) * FLOAT_BYTES * 2,
+        "predict": n_jobs
+        * predict_block_size
+        * (n_features + 2 * n_components)
+        * FLOAT_BYTES,
+    }
+    if geometric_features:
+        # Neighbor coordinates and covariance matrices of each chunk
+        stages["features"] += (
+            n_jobs * DEFAULT_CHUNK_SIZE * (10 * 3 + 3 * 9) * FLOAT_BYTES
+        )
+    stages["total"] = sum(stages.values())
+    return stages
+
+
+def plan_mcc_rgb_memory(
+    n_points,
+    memory_limit,
+    n_columns=6,
+    n_train=int(1e3),
+    n_components=DEFAULT_PARAMETERS["n_components"],
+    geometric_features=False,
+    n_jobs=1,
+    resident_bytes=0,
+):
+    """ Chooses work unit sizes for mcc_rgb that fit a memory budget
+
+    The memory held for the whole run, e.g., the input data, is subtracted
+    from the budget first. The prediction block size and then the number of
+    training examples are reduced until the memory that does not scale with
+    the number of points is at most half of the remaining budget. The rest
+    determines the number of points that can be classified at once.
+
+    Parameters
+    ----------
+        n_points: int
+            The number of points
+
+        memory_limit: int or str
+            The memory budget (see parse_memory_size)
+
+        n_columns, n_train, n_components, geometric_features, n_jobs:
+            See estimate_mcc_rgb_memory
+
+        resident_bytes: int
+            The memory held outside of the chunks for the whole run (see
+            resident_mcc_rgb_memory). Defaults to 0.
+
+    Returns
+    -------
+        A dictionary with keys
+
+        points_per_chunk: the number of points that can be classified at once
+        n_chunks: the number of spatial chunks needed for all points
+        predict_block_size: the number of points to predict at once
+        n_train: the number of training examples
+        estimate: the estimated bytes for a chunk (see estimate_mcc_rgb_memory)
+        resident_bytes: the memory held outside of the chunks
+        fits: False if the budget cannot be met by the minimum work units
+
+    Raises
+    ------
+        ValueError if the resident memory alone exceeds the budget
+    """
+    budget = parse_memory_size(memory_limit) - resident_bytes
+    if budget <= 0:
+        raise ValueError(
+            "A memory limit of {} bytes leaves no memory for classification "
+            "after the {} bytes held for the whole run".format(
+                parse_memory_size(memory_limit), resident_bytes
+            )
+        )
+    block_size = DEFAULT_PREDICT_BLOCK_SIZE
+    min_train = min(MIN_TRAIN, n_train)
+
+    def fixed_bytes(block_size, n_train):
+        estimate = estimate_mcc_rgb_memory(
+            0,
+            n_columns=n_columns,
+            n_train=n_train,
+            n_components=n_components,
+            geometric_features=geometric_features,
+            predict_block_size=block_size,
+            n_jobs=n_jobs,
+        )
+        return estimate["total"]
+
+    while fixed_bytes(block_size, n_train) > MAX_FIXED_FRACTION * budget:
+        if block_size > MIN_PREDICT_BLOCK_SIZE:
+            block_size = max(MIN_PREDICT_BLOCK_SIZE, block_size // 2)
+        elif n_train > min_train:
+            n_train = max(min_train, n_train // 2)
+        else:
+            break
+
+    per_point = sum(_per_point_bytes(n_columns, geometric_features).values())
+    available = budget - fixed_bytes(block_size, n_train)
+    points_per_chunk = int(available // per_point) if available > 0 else 0
+    fits = points_per_chunk >= min(MIN_CHUNK_POINTS, n_points)
+    if not fits:
+        points_per_chunk = min(MIN_CHUNK_POINTS, n_points)
+    points_per_chunk = max(1, min(points_per_chunk, n_points))
+
+    return {
+        "points_per_chunk": points_per_chunk,
+        "n_chunks": max(1, math.ceil(n_points / points_per_chunk)),
+        "predict_block_size": block_size,
+        "n_train": n_train,
+        "estimate": estimate_mcc_rgb_memory(
+            points_per_chunk,
+            n_columns=n_columns,
+            n_train=n_train,
+            n_components=n_components,
+            geometric_features=geometric_features,
+            predict_block_size=block_size,
+            n_jobs=n_jobs,
+        ),
+        "resident_bytes": resident_bytes,
+        "fits": fits,
+    }
+
+
+def resident_mcc_rgb_memory(n_points, n_columns=6):
+    """ Estimates the memory held for a whole run of mcc_rgb in chunks
+
+    The input data and the labels and masks of all points are held while
+    each chunk is classified.
+
+    Parameters
+    ----------
+        n_points: int
+            The number of points
+
+        n_columns: int
+            The number of columns of the data matrix. Defaults to 6.
+
+    Returns
+    -------
+        The estimated bytes
+    """
+    return n_points * (n_columns * FLOAT_BYTES + MASK_BYTES_PER_POINT)
+
+
+def _n_features(geometric_features):
+    if geometric_features:
+        return N_COLOR_FEATURES + len(EIGENVALUE_FEATURE_NAMES)
+    return N_COLOR_FEATURES
+
+
+def _n_threads(n_jobs):
+    if n_jobs is None or n_jobs < 1:
+        return os.cpu_count() or 1
+    return n_jobs
+
+
+def _per_point_bytes(n_columns, geometric_features):
+    """ Returns the bytes per point of the stages that scale with points """
+    n_features = _n_features(geometric_features)
+    return {
+        "data": n_columns * FLOAT_BYTES,
+        "active_points": ACTIVE_POINTS_BYTES_PER_POINT,
+        "surface": SURFACE_BYTES_PER_POINT,
+        # The full feature matrix, the features of an update step and the
+        # features of ground points to predict
+        "features": 3 * n_features * FLOAT_BYTES
+        + COLOR_TEMP_BYTES_PER_POINT
+        + MASK_BYTES_PER_POINT
+        + (KDTREE_BYTES_PER_POINT if geometric_features else 0),
+    }
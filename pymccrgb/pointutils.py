@@ -2,7 +2,159 @@
 
 import numpy as np
 
-from scipy.spatial import cKDTree
+DEFAULT_CHUNK_SIZE = 2 ** 16
+DEFAULT_BLOCK_SHAPE = (1024, 1024)
+SPACING_CELL_POINTS = 16
+
+
+class PointIndex(object):
+    """ A KD-tree index of point coordinates for repeated neighborhood queries
+
+    The index is built once per point cloud and can be reused for any
+    number of queries. Queries are processed in chunks of target points to
+    bound memory use, and each chunk is queried with multiple threads.
+
+    PointIndex objects can be pickled to send them to worker processes, or
+    saved with save() and loaded with a memory-mapped coordinate array with
+    PointIndex.load().
+
+    Parameters
+    ----------
+        points: array
+            An n x d array of points with rows [x, y, z, ...]
+
+        dims: int
+            The number of coordinates to index, 2 (x, y) or 3 (x, y, z).
+            Defaults to 2.
+
+        leafsize: int
+            The leaf size of the KD-tree. Defaults to 16.
+    """
+
+    def __init__(self, points, dims=2, leafsize=16):
+        self.dims = dims
+        self.leafsize = leafsize
+        self.coords = np.ascontiguousarray(points[:, 0:dims], dtype=np.float64)
+        from scipy.spatial import cKDTree
+
+        self.tree = cKDTree(self.coords, leafsize=leafsize)
+
+    def __len__(self):
+        return self.coords.shape[0]
+
+    def save(self, filename):
+        """ Saves the indexed coordinates to a .npy file """
+        np.save(filename, self.coords)
+
+    @classmethod
+    def load(cls, filename, mmap_mode="r", leafsize=16):
+        """ Loads an index from coordinates saved with save()
+
+        Parameters
+        ----------
+            filename: str
+                Filename of the saved coordinates
+
+            mmap_mode: str
+                Memory-map mode of the coordinate array, e.g., "r" to share
+                read-only coordinates between processes. Defaults to "r".
+
+            leafsize: int
+                The leaf size of the KD-tree. Defaults to 16.
+
+        Returns
+        -------
+            A PointIndex
+        """
+        coords = np.load(filename, mmap_mode=mmap_mode)
+        return cls(coords, dims=coords.shape[1], leafsize=leafsize)
+
+    def query(self, targets, k=1, chunk_size=DEFAULT_CHUNK_SIZE, workers=-1):
+        """ Finds the k nearest indexed points to each target point
+
+        Parameters
+        ----------
+            targets: array
+                An m x d array of target points. Only the first dims
+                columns are used.
+
+            k: int
+                The number of neighbors to find. Defaults to 1.
+
+            chunk_size: int
+                The number of target points to query at once.
+
+            workers: int
+                The number of threads to use. Defaults to -1, all cores.
+
+        Returns
+        -------
+            dist: array
+                An m x 1 (k = 1) or m x k array of distances to neighbors
+
+            idx: array
+                An m x 1 (k = 1) or m x k array of indices of neighbors
+        """
+        targets = targets[:, 0 : self.dims]
+        shape = (targets.shape[0],) if k == 1 else (targets.shape[0], k)
+        dist = np.empty(shape, dtype=np.float64)
+        idx = np.empty(shape, dtype=np.intp)
+        for start in range(0, targets.shape[0], chunk_size):
+            stop = start + chunk_size
+            dist[start:stop], idx[start:stop] = self.tree.query(
+                targets[start:stop], k=k, workers=workers
+            )
+        return dist, idx
+
+    def query_radius(
+        self, targets, r, chunk_size=DEFAULT_CHUNK_SIZE, workers=-1, counts=False
+    ):
+        """ Finds the indexed points within a radius of each target point
+
+        Parameters
+        ----------
+            targets: array
+                An m x d array of target points. Only the first dims
+                columns are used.
+
+            r: float
+                The neighborhood radius
+
+            chunk_size: int
+                The number of target points to query at once.
+
+            workers: int
+                The number of threads to use. Defaults to -1, all cores.
+
+            counts: bool
+                If True, return only the number of neighbors of each target
+                point. Default False.
+
+        Returns
+        -------
+            A list of m arrays of neighbor indices, or an m x 1 array of
+            neighbor counts
+        """
+        targets = targets[:, 0 : self.dims]
+        output = []
+        for start in range(0, targets.shape[0], chunk_size):
+            result = self.tree.query_ball_point(
+                targets[start : start + chunk_size],
+                r,
+                workers=workers,
+                return_sorted=False,
+                return_length=counts,
+            )
+            if counts:
+                output.append(result)
+            else:
+                output.extend(
+                    np.array(neighbors, dtype=np.intp) for neighbors in result
+                )
+
+        if counts:
+            return np.concatenate(output) if output else np.array([], dtype=np.intp)
+        return output
 
 
 def intersect_rows(arr1, arr2):
@@ -26,7 +178,46 @@ def point_grid(x_min, x_max, y_min, y_max, dx, dy=None):
     return points
 
 
-def sample_point_cloud(source, target, sample_indices=[2]):
+def iter_point_grid(
+    x_min, x_max, y_min, y_max, dx, dy=None, block_shape=DEFAULT_BLOCK_SHAPE
+):
+    """ Generates a grid of points within a bounding box in blocks
+
+    The grid is the same as point_grid, but only one block of grid points
+    is held in memory at a time.
+
+    Parameters
+    ----------
+        x_min, x_max, y_min, y_max: float
+            The bounding box of the grid
+
+        dx: float
+            The grid spacing in x
+
+        dy: float
+            The grid spacing in y. Defaults to dx.
+
+        block_shape: tuple
+            The number of grid rows (y) and columns (x) in each block.
+            Defaults to (1024, 1024).
+
+    Yields
+    ------
+        An m x 2 array of grid points in each block. Blocks are in row-major
+        order, and points in each block are in row-major order.
+    """
+    if dy is None:
+        dy = dx
+    x = np.arange(x_min, x_max + dx, dx)
+    y = np.arange(y_min, y_max + dy, dy)
+    n_rows, n_cols = block_shape
+    for i in range(0, len(y), n_rows):
+        for j in range(0, len(x), n_cols):
+            X, Y = np.meshgrid(x[j : j + n_cols], y[i : i + n_rows])
+            yield np.vstack([X.ravel(), Y.ravel()]).T
+
+
+def sample_point_cloud(source, target, sample_indices=[2], index=None):
     """ Resamples a source point cloud at the coordinates of a target points
 
         Uses the nearest point in the target point cloud to the source point
@@ -43,13 +234,18 @@ def sample_point_cloud(source, target, sample_indices=[2]):
             List of indices to sample from source. Defaults to 2 (z or height
             dimension)
 
+        index: PointIndex
+            Optional index of the source x, y coordinates. Pass an existing
+            index to avoid rebuilding it when resampling a source repeatedly.
+
     Returns
     -------
         An array of sampled points
     """
     sample_indices = np.array(sample_indices)
-    tree = cKDTree(source[:, 0:2])
-    dist, idx = tree.query(target, n_jobs=-1)
+    if index is None:
+        index = PointIndex(source, dims=2)
+    dist, idx = index.query(target)
     output = np.hstack(
         [
             target,
@@ -61,6 +257,480 @@ def sample_point_cloud(source, target, sample_indices=[2]):
     return output
 
 
+class GridIndex(object):
+    """ A hashed grid index of points for fixed-radius neighborhoods
+
+    Points are binned into square (2D) or cubic (3D) cells. The index stores
+    the sorted keys of the occupied cells, the point indices sorted by cell,
+    and the offset of each cell in the sorted indices, so the points in a cell
+    are a contiguous slice. This is cheaper to build than a KD-tree, and
+    faster for neighborhoods of a fixed size in point clouds of roughly
+    uniform density.
+
+    Parameters
+    ----------
+        points: array
+            An n x d array of points with rows [x, y, z, ...]
+
+        cell_size: float
+            The grid cell size
+
+        dims: int
+            The number of coordinates to index, 2 (x, y) or 3 (x, y, z).
+            Defaults to 2.
+
+    Attributes
+    ----------
+        keys: array
+            An m x 1 array of the sorted keys of occupied cells
+
+        offsets: array
+            An (m + 1) x 1 array. The points in cell i are
+            order[offsets[i]:offsets[i + 1]].
+
+        order: array
+            An n x 1 array of point indices sorted by cell
+
+        inverse: array
+            An n x 1 array of the cell (0, ..., m - 1) containing each point
+    """
+
+    def __init__(self, points, cell_size, dims=2):
+        self.dims = dims
+        self.cell_size = cell_size
+        self.coords = points[:, 0:dims]
+        self.origin = self.coords.min(axis=0)
+        cells = self._cells(self.coords)
+        self.shape = cells.max(axis=0) + 1
+        if np.prod(self.shape.astype(float)) >= 2 ** 62:
+            raise ValueError(
+                "Too many grid cells for cell size {}. "
+                "Please use a larger cell size.".format(cell_size)
+            )
+
+        keys = self._keys(cells)
+        self.order = np.argsort(keys, kind="stable")
+        self.keys, starts, counts = np.unique(
+            keys[self.order], return_index=True, return_counts=True
+        )
+        self.offsets = np.append(starts, len(keys))
+        self.inverse = np.empty((len(keys),), dtype=np.intp)
+        self.inverse[self.order] = np.repeat(np.arange(len(self.keys)), counts)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __iter__(self):
+        for i in range(len(self.keys)):
+            yield self.cell_indices(i)
+
+    @property
+    def counts(self):
+        """ The number of points in each cell """
+        return np.diff(self.offsets)
+
+    def cell_indices(self, i):
+        """ Returns the indices of the points in cell i """
+        return self.order[self.offsets[i] : self.offsets[i + 1]]
+
+    def cell_coords(self):
+        """ Returns an m x dims array of the integer coordinates of each cell """
+        return np.column_stack(np.unravel_index(self.keys, self.shape))
+
+    def cell_centers(self):
+        """ Returns an m x dims array of the center coordinates of each cell """
+        return self.origin + (self.cell_coords() + 0.5) * self.cell_size
+
+    def lookup(self, targets):
+        """ Returns the cell containing each target point, or -1 if empty """
+        cells = self._cells(targets[:, 0 : self.dims])
+        return self._find(cells)
+
+    def reduce(self, values, func="mean"):
+        """ Calculates a summary of point values in each cell
+
+        Parameters
+        ----------
+            values: array
+                An n x 1 array of point values, e.g., z coordinates
+
+            func: str
+                The reduction: "min", "max", "sum", "mean" or "count".
+                Defaults to "mean".
+
+        Returns
+        -------
+            An m x 1 array of summary values of each cell
+        """
+        if func == "count":
+            return self.counts
+        values = values[self.order]
+        starts = self.offsets[:-1]
+        if func == "min":
+            return np.minimum.reduceat(values, starts)
+        elif func == "max":
+            return np.maximum.reduceat(values, starts)
+        elif func == "sum":
+            return np.add.reduceat(values, starts)
+        elif func == "mean":
+            return np.add.reduceat(values, starts) / self.counts
+        raise ValueError(
+            "Unsupported reduction {}. Please use 'min', 'max', 'sum', 'mean' "
+            "or 'count'.".format(func)
+        )
+
+    def argmin(self, values):
+        """ Returns the index of the point with the minimum value in each cell """
+        order = np.lexsort((values, self.inverse))
+        return order[self.offsets[:-1]]
+
+    def query_radius(self, targets, r, chunk_size=DEFAULT_CHUNK_SIZE, counts=False):
+        """ Finds the indexed points within a radius of each target point
+
+        Parameters
+        ----------
+            targets: array
+                An m x d array of target points. Only the first dims
+                columns are used.
+
+            r: float
+                The neighborhood radius
+
+            chunk_size: int
+                The number of target points to query at once.
+
+            counts: bool
+                If True, return only the number of neighbors of each target
+                point. Default False.
+
+        Returns
+        -------
+            A list of m arrays of neighbor indices, or an m x 1 array of
+            neighbor counts
+        """
+        targets = targets[:, 0 : self.dims]
+        ring = int(np.ceil(r / self.cell_size))
+        stencil = np.stack(
+            np.meshgrid(*(self.dims * [np.arange(-ring, ring + 1)]), indexing="ij"),
+            axis=-1,
+        ).reshape(-1, self.dims)
+
+        output = []
+        for start in range(0, targets.shape[0], chunk_size):
+            chunk = targets[start : start + chunk_size]
+            target_idx, point_idx = self._candidates(chunk, stencil)
+            dist = np.linalg.norm(self.coords[point_idx] - chunk[target_idx], axis=-1)
+            within = dist <= r
+            target_idx = target_idx[within]
+            point_idx = point_idx[within]
+            n_neighbors = np.bincount(target_idx, minlength=chunk.shape[0])
+            if counts:
+                output.append(n_neighbors)
+            else:
+                point_idx = point_idx[np.argsort(target_idx, kind="stable")]
+                output.extend(np.split(point_idx, np.cumsum(n_neighbors)[:-1]))
+
+        if counts:
+            return np.concatenate(output) if output else np.array([], dtype=np.intp)
+        return output
+
+    def _candidates(self, targets, stencil):
+        """ Returns pairs of targets and points in neighboring cells """
+        cells = self._cells(targets)
+        target_idx = []
+        cell_idx = []
+        for offset in stencil:
+            found = self._find(cells + offset)
+            hit = found >= 0
+            target_idx.append(np.flatnonzero(hit))
+            cell_idx.append(found[hit])
+        target_idx = np.concatenate(target_idx)
+        cell_idx = np.concatenate(cell_idx)
+
+        starts = self.offsets[cell_idx]
+        lengths = self.offsets[cell_idx + 1] - starts
+        target_idx = np.repeat(target_idx, lengths)
+        position = np.arange(lengths.sum()) - np.repeat(
+            np.cumsum(lengths) - lengths, lengths
+        )
+        point_idx = self.order[np.repeat(starts, lengths) + position]
+        return target_idx, point_idx
+
+    def _cells(self, coords):
+        return np.floor((coords - self.origin) / self.cell_size).astype(np.int64)
+
+    def _keys(self, cells):
+        keys = np.zeros((cells.shape[0],), dtype=np.int64)
+        for i in range(self.dims):
+            keys = keys * self.shape[i] + cells[:, i]
+        return keys
+
+    def _find(self, cells):
+        inside = ((cells >= 0) & (cells < self.shape)).all(axis=1)
+        found = np.full((cells.shape[0],), -1, dtype=np.intp)
+        keys = self._keys(cells[inside])
+        pos = np.searchsorted(self.keys, keys)
+        pos[pos == len(self.keys)] = 0
+        hit = self.keys[pos] == keys
+        found[np.flatnonzero(inside)[hit]] = pos[hit]
+        return found
+
+
+def nominal_spacing(points, q=50, cell_size=None):
+    """ Estimates the nominal point spacing from point counts in a grid
+
+    Points are counted in grid cells that hold about 16 points on average,
+    and the spacing of each occupied cell is the inverse square root of its
+    density. Empty cells, such as water or gaps, do not affect the estimate.
+
+    Parameters
+    ----------
+        points: array
+            An n x d array of points with rows [x, y, ...]
+
+        q: float
+            The percentile of cell spacings to return. Defaults to 50
+            (the median). Higher values give the spacing of sparser areas.
+
+        cell_size: float
+            Optional grid cell size. By default, it is chosen from the
+            average density of the point cloud.
+
+    Returns
+    -------
+        The nominal point spacing in the units of the coordinates
+    """
+    xy = points[:, 0:2]
+    if xy.shape[0] < 2:
+        raise ValueError("At least two points are needed to estimate spacing.")
+    if cell_size is None:
+        extent = np.ptp(xy, axis=0)
+        area = np.prod(extent) if np.all(extent > 0) else np.max(extent) ** 2
+        if area <= 0:
+            raise ValueError("Cannot estimate the spacing of coincident points.")
+        cell_size = np.sqrt(SPACING_CELL_POINTS * area / xy.shape[0])
+
+    grid = GridIndex(xy, cell_size, dims=2)
+    spacing = cell_size / np.sqrt(grid.counts)
+    return float(np.percentile(spacing, q))
+
+
+def grid_decimate(xyz, cell_size, method="min"):
+    """ Selects one representative point in each cell of a regular grid
+
+    Parameters
+    ----------
+        xyz: array
+            An n x 3 array of coordinates
+
+        cell_size: float
+            The grid cell size
+
+        method: str
+            The decimation method. "min" selects the lowest point in each 2D
+            grid cell, and "voxel" selects the centroid of the points in each
+            3D voxel. Defaults to "min".
+
+    Returns
+    -------
+        points: array
+            An m x 3 array of representative points
+
+        inverse: array
+            An n x 1 array of the index of the representative of each point
+    """
+    if method == "min":
+        grid = GridIndex(xyz, cell_size, dims=2)
+        points = xyz[grid.argmin(xyz[:, 2]), 0:3]
+    elif method == "voxel":
+        grid = GridIndex(xyz, cell_size, dims=3)
+        points = np.column_stack([grid.reduce(xyz[:, i]) for i in range(3)])
+    else:
+        raise ValueError(
+            "Unsupported decimation method {}. "
+            "Please use 'min' or 'voxel'.".format(method)
+        )
+
+    return np.ascontiguousarray(points, dtype=np.float64), grid.inverse
+
+
+def local_gradients(points, values, radius, chunk_size=DEFAULT_CHUNK_SIZE):
+    """ Estimates the gradient of values sampled at points from local planes
+
+    At each point, a plane through the point is fitted by least squares to
+    the values at the other points within radius in x and y. The gradient is
+    zero where the neighbors do not determine a plane.
+
+    Parameters
+    ----------
+        points: array
+            An n x 2 (or more) array of points with rows [x, y, ...]
+
+        values: array
+            An n x 1 array of values at the points, e.g., surface heights
+
+        radius: float
+            The neighborhood radius
+
+        chunk_size: int
+            The number of points to fit at once. Defaults to 65536.
+
+    Returns
+    -------
+        An n x 2 array of gradients [d/dx, d/dy]
+    """
+    xy = points[:, 0:2]
+    n = xy.shape[0]
+    grid = GridIndex(xy, radius, dims=2)
+    stencil = np.stack(
+        np.meshgrid(np.arange(-1, 2), np.arange(-1, 2), indexing="ij"), axis=-1
+    ).reshape(-1, 2)
+
+    sums = np.zeros((5, n))  # dx dx, dx dy, dy dy, dx dv, dy dv
+    for start in range(0, n, chunk_size):
+        chunk = xy[start : start + chunk_size]
+        target_idx, point_idx = grid._candidates(chunk, stencil)
+        d = xy[point_idx] - chunk[target_idx]
+        dv = values[point_idx] - values[start + target_idx]
+        within = (np.hypot(d[:, 0], d[:, 1]) <= radius) & (
+            point_idx != start + target_idx
+        )
+        target_idx, d, dv = target_idx[within], d[within], dv[within]
+        for i, weights in enumerate(
+            [d[:, 0] ** 2, d[:, 0] * d[:, 1], d[:, 1] ** 2, d[:, 0] * dv, d[:, 1] * dv]
+        ):
+            sums[i, start : start + chunk.shape[0]] = np.bincount(
+                target_idx, weights=weights, minlength=chunk.shape[0]
+            )
+
+    sxx, sxy, syy, sxv, syv = sums
+    det = sxx * syy - sxy ** 2
+    valid = det > 1e-6 * (sxx + syy) ** 2
+    gradients = np.zeros((n, 2))
+    gradients[valid, 0] = (syy * sxv - sxy * syv)[valid] / det[valid]
+    gradients[valid, 1] = (sxx * syv - sxy * sxv)[valid] / det[valid]
+    return gradients
+
+
+def remove_duplicates(data, resolution=None, policy="first"):
+    """ Merges duplicate and near-duplicate points
+
+    Points are duplicates if their x, y, z coordinates are identical or, if
+    resolution is given, fall in the same voxel of that size. Each group of
+    duplicates is replaced by a single point, and the thinned points are in
+    order of the first point of each group.
+
+    Labels calculated on the thinned points can be assigned to all original
+    points with labels[inverse].
+
+    Parameters
+    ----------
+        data: array
+            A n x d data matrix with rows [x, y, z, r, g, b, ...]
+
+        resolution: float
+            Optional voxel size for merging near-duplicate points. By
+            default, only points with identical coordinates are merged.
+
+        policy: str
+            How to merge duplicates. "first" keeps the first point in each
+            group, "mean" averages all columns, and "max" keeps the
+            coordinates of the first point and the maximum of each other
+            column (e.g., color). Defaults to "first".
+
+    Returns
+    -------
+        thinned: array
+            An m x d array of unique points
+
+        inverse: array
+            An n x 1 array of the index of the unique point of each point
+    """
+    if policy not in ("first", "mean", "max"):
+        raise ValueError(
+            "Unsupported policy {}. Please use 'first', 'mean' or 'max'.".format(policy)
+        )
+
+    if resolution is None:
+        xyz = np.ascontiguousarray(data[:, 0:3], dtype=np.float64)
+        rows = xyz.view(np.dtype((np.void, xyz.dtype.itemsize * 3))).ravel()
+        _, inverse = np.unique(rows, return_inverse=True)
+        inverse = inverse.ravel()
+    else:
+        inverse = GridIndex(data, resolution, dims=3).inverse
+
+    order = np.argsort(inverse, kind="stable")
+    counts = np.bincount(inverse)
+    starts = np.cumsum(counts) - counts
+    first = order[starts]
+
+    # Number groups in order of their first point
+    rank = np.argsort(first)
+    group = np.empty_like(rank)
+    group[rank] = np.arange(len(rank))
+    inverse = group[inverse]
+    first = first[rank]
+
+    if policy == "first":
+        thinned = data[first]
+    elif policy == "mean":
+        thinned = np.add.reduceat(data[order], starts, axis=0) / counts[:, None]
+        thinned = thinned[rank]
+    else:
+        thinned = data[first].copy()
+        thinned[:, 3:] = np.maximum.reduceat(data[order, 3:], starts, axis=0)[rank]
+
+    return thinned, inverse
+
+
+def sample_point_grid(
+    source,
+    x_min,
+    x_max,
+    y_min,
+    y_max,
+    dx,
+    dy=None,
+    sample_indices=[2],
+    index=None,
+    block_shape=DEFAULT_BLOCK_SHAPE,
+):
+    """ Resamples a source point cloud on a regular grid in blocks
+
+    Equivalent to sample_point_cloud(source, point_grid(...)), except that
+    the grid is generated and sampled one block at a time, so memory use
+    does not depend on the size of the grid.
+
+    Parameters
+    ----------
+        source: array
+            Input point cloud
+
+        x_min, x_max, y_min, y_max, dx, dy: float
+            The grid bounding box and spacing. See point_grid.
+
+        sample_indices: list
+            List of indices to sample from source. Defaults to 2 (z or height
+            dimension)
+
+        index: PointIndex
+            Optional index of the source x, y coordinates
+
+        block_shape: tuple
+            The number of grid rows (y) and columns (x) in each block.
+
+    Yields
+    ------
+        An array of sampled points in each block of the grid
+    """
+    if index is None:
+        index = PointIndex(source, dims=2)
+    for block in iter_point_grid(
+        x_min, x_max, y_min, y_max, dx, dy=dy, block_shape=block_shape
+    ):
+        yield sample_point_cloud(source, block, sample_indices, index=index)
+
+
 def equal_sample(X, y, size=100, seed=None):
     """ Takes a sample of equal number of feature vectors from each input class
 
@@ -0,0 +1,263 @@
+""" Opt-in timing spans with aggregate statistics and Chrome trace export
+
+Spans are disabled by default and cost a single flag check when disabled.
+Enable them for a block of code with the profile context manager, or for a
+whole process by setting the PYMCCRGB_PROFILE environment variable. If the
+variable is a filename ending in .json, a Chrome trace is written to it when
+the process exits, e.g.,
+
+    PYMCCRGB_PROFILE=trace.json python classify.py
+
+Traces can be opened in chrome://tracing or https://ui.perfetto.dev.
+"""
+
+import atexit
+import functools
+import json
+import os
+import threading
+import time
+
+from contextlib import contextmanager
+
+PROFILE_ENV_VAR = "PYMCCRGB_PROFILE"
+
+
+class Profiler(object):
+    """ A collection of completed timing spans
+
+    Attributes
+    ----------
+        spans: list
+            Completed spans as tuples (name, start, duration, pid, tid, args),
+            with start and duration in nanoseconds
+    """
+
+    def __init__(self):
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def record(self, name, start, duration, args=None):
+        """ Adds a completed span """
+        span = (name, start, duration, os.getpid(), threading.get_ident(), args)
+        with self._lock:
+            self.spans.append(span)
+
+    def merge(self, other):
+        """ Adds the spans of another profiler, e.g., from a worker process
+
+        Parameters
+        ----------
+            other: Profiler or list
+                A profiler or its list of spans
+        """
+        spans = other.spans if isinstance(other, Profiler) else other
+        with self._lock:
+            self.spans.extend(spans)
+        return self
+
+    def clear(self):
+        """ Removes all spans """
+        with self._lock:
+            self.spans = []
+
+    def stats(self):
+        """ Returns aggregate statistics of each span name
+
+        Returns
+        -------
+            A dictionary mapping span names to dictionaries with the count,
+            and the total, mean, min and max durations in seconds
+        """
+        stats = {}
+        for name, _, duration, _, _, _ in self.spans:
+            seconds = duration * 1e-9
+            entry = stats.get(name)
+            if entry is None:
+                stats[name] = {
+                    "count": 1,
+                    "total": seconds,
+                    "min": seconds,
+                    "max": seconds,
+                }
+            else:
+                entry["count"] += 1
+                entry["total"] += seconds
+                entry["min"] = min(entry["min"], seconds)
+                entry["max"] = max(entry["max"], seconds)
+
+        for entry in stats.values():
+            entry["mean"] = entry["total"] / entry["count"]
+        return stats
+
+    def trace_events(self):
+        """ Returns the spans as Chrome trace complete ("X") events """
+        events = []
+        for name, start, duration, pid, tid, args in self.spans:
+            event = {
+                "name": name,
+                "cat": name.split(".")[0],
+                "ph": "X",
+                "ts": start / 1e3,
+                "dur": duration / 1e3,
+                "pid": pid,
+                "tid": tid,
+            }
+            if args:
+                event["args"] = args
+            events.append(event)
+        return events
+
+    def export_chrome_trace(self, filename):
+        """ Writes the spans to a Chrome trace (Perfetto) JSON file
+
+        Parameters
+        ----------
+            filename: str
+                The output filename
+        """
+        with open(filename, "w") as f:
+            json.dump({"traceEvents": self.trace_events(), "displayTimeUnit": "ms"}, f)
+
+
+class _Span(object):
+    __slots__ = ("name", "args", "start", "profiler")
+
+    def __init__(self, name, args):
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        # Record in the profiler active when the span starts, even if a
+        # profile block in another thread has replaced it when it ends
+        self.profiler = _profiler
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        duration = time.perf_counter_ns() - self.start
+        self.profiler.record(self.name, self.start, duration, self.args)
+        return False
+
+
+class _NullSpan(object):
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+_profiler = Profiler()
+_enabled = False
+
+
+def span(name, **args):
+    """ Returns a context manager that times a named block of code
+
+    Parameters
+    ----------
+        name: str
+            The span name, by convention "module.step", e.g., "core.surface"
+
+        Any other keyword argument is stored with the span and shown in the
+        trace viewer
+
+    Returns
+    -------
+        A context manager. If profiling is disabled, it does nothing.
+    """
+    if not _enabled:
+        return _NULL_SPAN
+    return _Span(name, args)
+
+
+def traced(name):
+    """ Decorates a function so that each call is timed as a span """
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+            with _Span(name, None):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def enable():
+    """ Enables span recording in this process """
+    global _enabled
+    _enabled = True
+
+
+def disable():
+    """ Disables span recording in this process """
+    global _enabled
+    _enabled = False
+
+
+def is_enabled():
+    """ Returns True if spans are being recorded """
+    return _enabled
+
+
+def get_profiler():
+    """ Returns the profiler that spans are recorded in """
+    return _profiler
+
+
+def stats():
+    """ Returns aggregate statistics of all recorded spans (see Profiler) """
+    return _profiler.stats()
+
+
+def export_chrome_trace(filename):
+    """ Writes all recorded spans to a Chrome trace JSON file """
+    _profiler.export_chrome_trace(filename)
+
+
+@contextmanager
+def profile(filename=None):
+    """ Records spans within a block of code
+
+    Parameters
+    ----------
+        filename: str
+            Optional filename of a Chrome trace to write at the end of the
+            block
+
+    Yields
+    ------
+        A Profiler with the spans recorded within the block
+    """
+    global _profiler, _enabled
+    previous_profiler, previous_enabled = _profiler, _enabled
+    _profiler, _enabled = Profiler(), True
+    profiler = _profiler
+    try:
+        yield profiler
+    finally:
+        _profiler, _enabled = previous_profiler, previous_enabled
+        if previous_enabled:
+            previous_profiler.merge(profiler)
+        if filename is not None:
+            profiler.export_chrome_trace(filename)
+
+
+def _configure_from_environment():
+    value = os.environ.get(PROFILE_ENV_VAR, "")
+    if value.lower() in ("", "0", "false", "no", "off"):
+        return
+    enable()
+    if value.endswith(".json"):
+        atexit.register(export_chrome_trace, value)
+
+
+_configure_from_environment()
@@ -0,0 +1,225 @@
+""" Parallel parameter grid search for the MCC and MCC-RGB algorithms """
+
+import itertools
+import sys
+import time
+
+import numpy as np
+
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from multiprocessing import resource_tracker, shared_memory, util
+
+from . import core
+
+_shared_memory = None
+_shared_data = None
+
+
+def parameter_grid(**params):
+    """ Generates all combinations of a set of parameter values
+
+    Parameters
+    ----------
+        Keyword arguments of mcc or mcc_rgb, each given as a list of values
+        to try. For example, scales=[[0.5, 1, 1.5], [1, 2, 3]] tries two
+        scale lists.
+
+    Returns
+    -------
+        A list of dictionaries of keyword arguments, one per combination
+    """
+    names = list(params.keys())
+    return [
+        dict(zip(names, values))
+        for values in itertools.product(*[params[name] for name in names])
+    ]
+
+
+def run_parameter_grid(data, grid, method="mcc_rgb", n_jobs=None, reference=None):
+    """ Classifies a point cloud with each configuration in a parameter grid
+
+    The point cloud is copied once into shared memory, and configurations are
+    run concurrently in a pool of worker processes that read from the shared
+    copy, rather than each receiving their own pickled copy of the data.
+
+    Parameters
+    ----------
+        data: array
+            A n x d data matrix with rows [x, y, z, r, g, b ...]
+
+        grid: list
+            A list of dictionaries of keyword arguments to method, e.g.,
+            from parameter_grid
+
+        method: str
+            The classification function to run, "mcc" or "mcc_rgb".
+            Defaults to "mcc_rgb".
+
+        n_jobs: int
+            The number of worker processes. Defaults to the number of CPUs.
+            If 1, configurations are run in this process.
+
+        reference: array
+            Optional n x 1 array of reference labels (1 is ground, 0 is
+            nonground) to compare each configuration to
+
+    Returns
+    -------
+        A list of results, one dictionary per configuration with keys
+
+        params: the keyword arguments of the configuration
+        labels: an n x 1 array of labels (1 is ground, 0 is nonground)
+        time: the run time in seconds
+        ground_fraction: the fraction of points classified as ground
+        agreement: the fraction of labels that agree with the majority vote
+            of all configurations
+        reference_agreement: the fraction of labels that agree with the
+            reference labels, if given
+    """
+    if method not in ("mcc", "mcc_rgb"):
+        raise ValueError(
+            "Unsupported method {}. Please use 'mcc' or 'mcc_rgb'.".format(method)
+        )
+
+    data = np.asarray(data)
+    if n_jobs == 1:
+        outputs = [_run_configuration(data, method, params) for params in grid]
+    else:
+        with shared_data_pool(data, n_jobs=n_jobs) as pool:
+            futures = [
+                pool.submit(_run_shared_configuration, method, params)
+                for params in grid
+            ]
+            outputs = [future.result() for future in futures]
+
+    return _summarize(grid, outputs, reference)
+
+
+@contextmanager
+def shared_data_pool(data, n_jobs=None):
+    """ Creates a process pool whose workers share a read-only data array
+
+    The array is copied once into shared memory. Functions submitted to the
+    pool read it with get_shared_data, rather than each task receiving its
+    own pickled copy.
+
+    Parameters
+    ----------
+        data: array
+            The array to share
+
+        n_jobs: int
+            The number of worker processes. Defaults to the number of CPUs.
+
+    Yields
+    ------
+        A ProcessPoolExecutor
+    """
+    shm = shared_memory.SharedMemory(create=True, size=max(data.nbytes, 1))
+    shared = np.ndarray(data.shape, dtype=data.dtype, buffer=shm.buf)
+    try:
+        shared[:] = data
+        with ProcessPoolExecutor(
+            max_workers=n_jobs,
+            initializer=_attach_shared_data,
+            initargs=(shm.name, data.shape, data.dtype.str),
+        ) as pool:
+            yield pool
+    finally:
+        # Release the view of the buffer before closing the shared memory
+        del shared
+        shm.close()
+        shm.unlink()
+
+
+def get_shared_data():
+    """ Returns the shared data array in a worker of shared_data_pool """
+    return _shared_data
+
+
+def _attach_shared_data(name, shape, dtype):
+    global _shared_memory, _shared_data
+    _shared_memory = _open_shared_memory(name)
+    _shared_data = np.ndarray(shape, dtype=dtype, buffer=_shared_memory.buf)
+    _shared_data.flags.writeable = False
+    # Pool workers exit without running atexit handlers, but do run finalizers
+    util.Finalize(None, _detach_shared_data, exitpriority=10)
+
+
+def _open_shared_memory(name):
+    """ Attaches to a shared memory block without tracking it
+
+    The block belongs to the process that created it, which unlinks it.
+    Before Python 3.13, attaching also registers the block with the resource
+    tracker, which unlinks blocks still registered when it shuts down. The
+    tracker is shared with the parent process, so unregistering the block
+    here would drop the parent's registration instead, and registering is
+    skipped.
+    """
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=name, track=False)
+
+    register = resource_tracker.register
+
+    def register_untracked(name, rtype):
+        if rtype != "shared_memory":
+            register(name, rtype)
+
+    resource_tracker.register = register_untracked
+    try:
+        return shared_memory.SharedMemory(name=name)
+    finally:
+        resource_tracker.register = register
+
+
+def _detach_shared_data():
+    global _shared_memory, _shared_data
+    if _shared_memory is not None:
+        # Release the view of the buffer before closing the shared memory
+        _shared_data = None
+        _shared_memory.close()
+        _shared_memory = None
+
+
+def _run_shared_configuration(method, params):
+    return _run_configuration(_shared_data, method, params)
+
+
+def _run_configuration(data, method, params):
+    func = getattr(core, method)
+    # mcc_rgb extends scales and tols, and parameter_grid shares those lists
+    # between configurations
+    params = dict(params)
+    for name in ("scales", "tols"):
+        if name in params:
+            params[name] = core.copy_scales(params[name])
+    start = time.perf_counter()
+    _, labels = func(data, **params)
+    elapsed = time.perf_counter() - start
+    ground_code = 2 if params.get("use_las_codes", False) else 1
+    return labels == ground_code, elapsed
+
+
+def _summarize(grid, outputs, reference=None):
+    if len(outputs) == 0:
+        return []
+
+    labels = np.vstack([ground for ground, _ in outputs])
+    consensus = labels.mean(axis=0) >= 0.5
+    if reference is not None:
+        reference = np.asarray(reference).ravel() == 1
+
+    results = []
+    for params, (ground, elapsed) in zip(grid, outputs):
+        result = {
+            "params": params,
+            "labels": ground.astype(int),
+            "time": elapsed,
+            "ground_fraction": ground.mean(),
+            "agreement": np.mean(ground == consensus),
+        }
+        if reference is not None:
+            result["reference_agreement"] = np.mean(ground == reference)
+        results.append(result)
+    return results
@@ -0,0 +1,522 @@
+""" A local classification server that keeps models and imports warm
+
+The server listens on a UNIX socket or a localhost TCP port. Each message is
+a 4-byte big-endian header length, a JSON header and an optional payload of
+the header's "nbytes" bytes holding a NumPy .npy array.
+
+A request header has "type": "classify", an optional "path" of a point cloud
+file to read with ioutils.read_data, and optional "params" for the
+classification function. Without a path, the payload holds the data array.
+The server answers with "labels" messages holding consecutive blocks of
+labels, then a "finish" message, or an "error" message. After a message
+that cannot be parsed, the server sends an "error" message and closes the
+connection.
+"""
+
+import asyncio
+import io
+import json
+import os
+import socket
+import struct
+import time
+
+import numpy as np
+
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from . import core
+from .cache import ExcessHeightCache
+
+DEFAULT_BATCH_POINTS = 2 ** 20
+DEFAULT_BATCH_DELAY = 0.01
+DEFAULT_STREAM_BLOCK_SIZE = 2 ** 16
+
+# Parameters that only the server may set, since they refer to its files,
+# its cache or the shape of its results
+SERVER_PARAMS = ("checkpoint", "cache", "return_report", "time_budget", "memory_limit")
+
+_HEADER_LENGTH = struct.Struct(">I")
+# The legacy and LAS 1.4 point counts and their offsets in a LAS header
+_LAS_POINT_COUNT = (struct.Struct("<I"), 107)
+_LAS_POINT_COUNT_64 = (struct.Struct("<Q"), 247)
+_cache = None
+
+
+class ServiceError(RuntimeError):
+    """ Raised by the client when the server fails to classify a request """
+
+
+class ClassificationServer(object):
+    """ An asyncio server that classifies point clouds in a worker pool
+
+    The workers import the classification dependencies once when they start,
+    and keep a cache of excess heights, so repeated requests on the same
+    points skip the interpolation. Requests that arrive within batch_delay
+    seconds of each other are collected into a batch of up to batch_points
+    points, which is split among the workers by point count. Each worker
+    classifies its share of the requests, so several small requests share
+    one round trip to a worker only when there are more requests than
+    workers.
+
+    Parameters
+    ----------
+        address: str or tuple
+            The path of a UNIX socket, or a (host, port) pair. Port 0 picks a
+            free port, and address is updated when the server starts.
+
+        method: str
+            The classification function, "mcc" or "mcc_rgb". Defaults to
+            "mcc_rgb".
+
+        n_jobs: int
+            The number of worker processes. Defaults to the number of CPUs.
+            If 1, requests are classified in a thread of this process.
+
+        batch_points: int
+            The maximum number of points in a batch of requests. Defaults to
+            2 ** 20.
+
+        batch_delay: float
+            The time in seconds to wait for more requests to batch. Defaults
+            to 0.01.
+
+        stream_block_size: int
+            The number of labels in each labels message. Defaults to 2 ** 16.
+
+        cache_entries: int
+            The number of excess height arrays cached by each worker.
+            Defaults to 16.
+
+        Any other keyword argument to method, e.g., scales and tols. Requests
+        may override them, except for the parameters in SERVER_PARAMS.
+    """
+
+    def __init__(
+        self,
+        address,
+        method="mcc_rgb",
+        n_jobs=None,
+        batch_points=DEFAULT_BATCH_POINTS,
+        batch_delay=DEFAULT_BATCH_DELAY,
+        stream_block_size=DEFAULT_STREAM_BLOCK_SIZE,
+        cache_entries=16,
+        **params,
+    ):
+        if method not in ("mcc", "mcc_rgb"):
+            raise ValueError(
+                "Unsupported method {}. Please use 'mcc' or 'mcc_rgb'.".format(method)
+            )
+        self.address = address
+        self.method = method
+        self.n_jobs = n_jobs
+        self.batch_points = batch_points
+        self.batch_delay = batch_delay
+        self.stream_block_size = stream_block_size
+        self.cache_entries = cache_entries
+        self.params = params
+        self._pool = None
+        self._n_workers = 1
+        self._server = None
+        self._queue = None
+        self._batcher = None
+        self._batches = set()
+        self._connections = set()
+        self._responding = set()
+        self._closing = False
+
+    async def start(self):
+        """ Starts the worker pool and begins accepting connections """
+        self._closing = False
+        if self.n_jobs == 1:
+            self._n_workers = 1
+            self._pool = ThreadPoolExecutor(
+                max_workers=1,
+                initializer=_start_worker,
+                initargs=(self.cache_entries,),
+            )
+        else:
+            self._n_workers = self.n_jobs or os.cpu_count() or 1
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.n_jobs,
+                initializer=_start_worker,
+                initargs=(self.cache_entries,),
+            )
+        self._queue = asyncio.Queue()
+        self._batcher = asyncio.ensure_future(self._run_batches())
+
+        if isinstance(self.address, str):
+            self._server = await asyncio.start_unix_server(
+                self._handle, path=self.address
+            )
+        else:
+            host, port = self.address
+            self._server = await asyncio.start_server(self._handle, host, port)
+            self.address = self._server.sockets[0].getsockname()[0:2]
+
+    async def serve_forever(self):
+        """ Accepts connections until the server is closed """
+        if self._server is None:
+            await self.start()
+        try:
+            await self._server.serve_forever()
+        except asyncio.CancelledError:
+            pass
+
+    async def close(self):
+        """ Stops accepting connections and shuts down the worker pool
+
+        Requests that have not been classified yet are answered with an
+        error message, and the connections are closed.
+        """
+        self._closing = True
+        if self._server is not None:
+            self._server.close()
+        if self._batcher is not None:
+            self._batcher.cancel()
+            await asyncio.gather(self._batcher, return_exceptions=True)
+        if self._queue is not None:
+            while not self._queue.empty():
+                _fail_requests([self._queue.get_nowait()])
+        for task in list(self._batches):
+            task.cancel()
+        await asyncio.gather(*self._batches, return_exceptions=True)
+
+        # Let connections finish their responses, and close idle ones
+        for task in self._connections - self._responding:
+            task.cancel()
+        await asyncio.gather(*self._connections, return_exceptions=True)
+        if self._server is not None:
+            await self._server.wait_closed()
+        if self._pool is not None:
+            await asyncio.get_event_loop().run_in_executor(None, self._pool.shutdown)
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, *args):
+        await self.close()
+
+    async def _handle(self, reader, writer):
+        task = asyncio.current_task()
+        self._connections.add(task)
+        try:
+            while not self._closing:
+                try:
+                    header, data = await _read_message(reader)
+                except asyncio.IncompleteReadError:
+                    break
+                except Exception as e:
+                    # The rest of the stream cannot be parsed
+                    _write_message(
+                        writer,
+                        {"type": "error", "message": "Bad message: {}".format(e)},
+                    )
+                    await writer.drain()
+                    break
+                self._responding.add(task)
+                try:
+                    await self._respond(header, data, writer)
+                finally:
+                    self._responding.discard(task)
+        except asyncio.CancelledError:
+            # Idle connections are cancelled when the server closes
+            pass
+        finally:
+            self._connections.discard(task)
+            writer.close()
+
+    async def _respond(self, header, data, writer):
+        start = time.perf_counter()
+        try:
+            if header.get("type") != "classify":
+                raise ValueError("Unknown request type {}".format(header.get("type")))
+            if data is None and header.get("path") is None:
+                raise ValueError("A request needs a data array or a path")
+            request_params = header.get("params", {})
+            if not isinstance(request_params, dict):
+                raise ValueError("Request params must be a JSON object")
+            rejected = sorted(set(request_params) & set(SERVER_PARAMS))
+            if len(rejected) > 0:
+                raise ValueError("Requests cannot set {}".format(", ".join(rejected)))
+            params = dict(self.params, **request_params)
+
+            loop = asyncio.get_event_loop()
+            if data is None:
+                size = await loop.run_in_executor(None, _count_points, header["path"])
+            else:
+                size = data.shape[0]
+            if self._closing:
+                raise ServiceError("The server is shutting down")
+            future = loop.create_future()
+            await self._queue.put((size, (data, header.get("path"), params), future))
+            labels = await future
+        except Exception as e:
+            _write_message(writer, {"type": "error", "message": str(e)})
+            await writer.drain()
+            return
+
+        if params.get("use_las_codes", False):
+            n_ground = np.count_nonzero(labels == 2)
+        else:
+            n_ground = np.count_nonzero(labels)
+        for i in range(0, max(len(labels), 1), self.stream_block_size):
+            block = labels[i : i + self.stream_block_size]
+            _write_message(
+                writer, {"type": "labels", "start": i, "stop": i + len(block)}, block
+            )
+            await writer.drain()
+        _write_message(
+            writer,
+            {
+                "type": "finish",
+                "n_points": int(len(labels)),
+                "n_ground": int(n_ground),
+                "elapsed": time.perf_counter() - start,
+            },
+        )
+        await writer.drain()
+
+    async def _run_batches(self):
+        """ Groups queued requests into batches and sends them to the pool """
+        loop = asyncio.get_event_loop()
+        while True:
+            batch = [await self._queue.get()]
+            n_points = batch[0][0]
+            deadline = loop.time() + self.batch_delay
+            try:
+                while n_points < self.batch_points:
+                    try:
+                        item = await asyncio.wait_for(
+                            self._queue.get(), max(deadline - loop.time(), 0)
+                        )
+                    except asyncio.TimeoutError:
+                        break
+                    batch.append(item)
+                    n_points += item[0]
+            except asyncio.CancelledError:
+                _fail_requests(batch)
+                raise
+            task = asyncio.ensure_future(self._run_batch(batch))
+            self._batches.add(task)
+            task.add_done_callback(self._batches.discard)
+
+    async def _run_batch(self, batch):
+        """ Classifies a batch of requests, split among the workers """
+        groups = _split_batch(batch, self._n_workers)
+        try:
+            await asyncio.gather(*[self._run_group(group) for group in groups])
+        finally:
+            # Requests of a batch cancelled by close are not classified
+            _fail_requests(batch)
+
+    async def _run_group(self, group):
+        loop = asyncio.get_event_loop()
+        requests = [request for _, request, _ in group]
+        try:
+            results = await loop.run_in_executor(
+                self._pool, _classify_batch, self.method, requests
+            )
+        except Exception as e:
+            results = [(None, "Worker failed: {}".format(e))] * len(group)
+        for (_, _, future), (labels, error) in zip(group, results):
+            if future.done():
+                continue
+            if error is None:
+                future.set_result(labels)
+            else:
+                future.set_exception(ServiceError(error))
+
+
+def serve(address, **kwargs):
+    """ Runs a ClassificationServer until interrupted
+
+    Parameters
+    ----------
+        address: str or tuple
+            The path of a UNIX socket, or a (host, port) pair
+
+        Any other keyword argument to ClassificationServer
+    """
+
+    async def run():
+        async with ClassificationServer(address, **kwargs) as server:
+            await server.serve_forever()
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+
+
+def iter_labels(address, data=None, path=None, timeout=None, **params):
+    """ Sends a point cloud to a server and yields its labels as they arrive
+
+    Parameters
+    ----------
+        address: str or tuple
+            The path of a UNIX socket, or a (host, port) pair
+
+        data: array
+            A n x d data matrix with rows [x, y, z, r, g, b ...]
+
+        path: str
+            The path of a point cloud file readable by the server, instead
+            of data
+
+        timeout: float
+            Optional socket timeout in seconds
+
+        Any other keyword argument to the classification function. Values
+        must be JSON-serializable.
+
+    Yields
+    ------
+        Consecutive blocks of labels (1 is ground, 0 is nonground)
+    """
+    header = {"type": "classify", "params": params}
+    if path is not None:
+        header["path"] = path
+
+    family = socket.AF_UNIX if isinstance(address, str) else socket.AF_INET
+    with socket.socket(family, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        sock.connect(address)
+        sock.sendall(_encode_message(header, data))
+        while True:
+            header, labels = _receive_message(sock)
+            if header["type"] == "error":
+                raise ServiceError(header["message"])
+            if header["type"] == "finish":
+                return
+            yield labels
+
+
+def classify(address, data=None, path=None, timeout=None, **params):
+    """ Classifies a point cloud with a server
+
+    Parameters
+    ----------
+        See iter_labels
+
+    Returns
+    -------
+        labels: array
+            An n x 1 array of labels (1 is ground, 0 is nonground)
+    """
+    blocks = list(iter_labels(address, data, path, timeout=timeout, **params))
+    return np.concatenate(blocks)
+
+
+def _start_worker(cache_entries):
+    global _cache
+    _cache = ExcessHeightCache(max_entries=cache_entries)
+    # Import the lazily loaded dependencies before the first request
+    from sklearn import kernel_approximation, linear_model, pipeline  # noqa: F401
+    from . import features  # noqa: F401
+
+
+def _classify_batch(method, requests):
+    func = getattr(core, method)
+    results = []
+    for data, path, params in requests:
+        try:
+            if data is None:
+                from .ioutils import read_data
+
+                data = read_data(path)
+            params = dict(params, cache=_cache, return_report=False)
+            for name in ("scales", "tols"):
+                if name in params:
+                    params[name] = core.copy_scales(params[name])
+            _, labels = func(data, **params)
+            results.append((labels, None))
+        except Exception as e:
+            results.append((None, "{}: {}".format(type(e).__name__, e)))
+    return results
+
+
+def _fail_requests(items):
+    for _, _, future in items:
+        if not future.done():
+            future.set_exception(ServiceError("The server is shutting down"))
+
+
+def _split_batch(batch, n_groups):
+    """ Splits queued requests into groups with similar numbers of points """
+    groups = [[] for _ in range(min(n_groups, len(batch)))]
+    sizes = [0] * len(groups)
+    for item in sorted(batch, key=lambda item: item[0], reverse=True):
+        smallest = sizes.index(min(sizes))
+        groups[smallest].append(item)
+        sizes[smallest] += item[0]
+    return groups
+
+
+def _count_points(path):
+    """ Returns the number of points in a file without reading the points
+
+    LAS/LAZ files store the count in their header. Text files are assumed to
+    hold one point per line.
+    """
+    if path.endswith((".las", ".laz")):
+        count_64, offset_64 = _LAS_POINT_COUNT_64
+        with open(path, "rb") as f:
+            header = f.read(offset_64 + count_64.size)
+        if header[0:4] != b"LASF":
+            raise ValueError("{} is not a LAS/LAZ file".format(path))
+        count, offset = _LAS_POINT_COUNT
+        (n_points,) = count.unpack_from(header, offset)
+        if n_points == 0 and len(header) == offset_64 + count_64.size:
+            # LAS 1.4 files may only have the 64-bit count
+            (n_points,) = count_64.unpack_from(header, offset_64)
+        return n_points
+
+    with open(path, "rb") as f:
+        return sum(chunk.count(b"\n") for chunk in iter(lambda: f.read(2 ** 20), b""))
+
+
+def _encode_message(header, array=None):
+    payload = b""
+    if array is not None:
+        buffer = io.BytesIO()
+        np.save(buffer, np.asarray(array), allow_pickle=False)
+        payload = buffer.getvalue()
+    header = json.dumps(dict(header, nbytes=len(payload))).encode()
+    return _HEADER_LENGTH.pack(len(header)) + header + payload
+
+
+def _decode_payload(payload):
+    if len(payload) == 0:
+        return None
+    return np.load(io.BytesIO(payload), allow_pickle=False)
+
+
+def _write_message(writer, header, array=None):
+    writer.write(_encode_message(header, array))
+
+
+async def _read_message(reader):
+    (length,) = _HEADER_LENGTH.unpack(await reader.readexactly(_HEADER_LENGTH.size))
+    header = json.loads((await reader.readexactly(length)).decode())
+    payload = await reader.readexactly(header.get("nbytes", 0))
+    return header, _decode_payload(payload)
+
+
+def _receive_message(sock):
+    (length,) = _HEADER_LENGTH.unpack(_receive_exactly(sock, _HEADER_LENGTH.size))
+    header = json.loads(_receive_exactly(sock, length).decode())
+    payload = _receive_exactly(sock, header.get("nbytes", 0))
+    return header, _decode_payload(payload)
+
+
+def _receive_exactly(sock, n):
+    chunks = []
+    while n > 0:
+        chunk = sock.recv(min(n, 2 ** 20))
+        if not chunk:
+            raise ServiceError("The server closed the connection")
+        chunks.append(chunk)
+        n -= len(chunk)
+    return b"".join(chunks)
@@ -0,0 +1,315 @@
+""" Structured reporting of the progress of MCC and MCC-RGB runs """
+
+import sys
+import time
+
+from contextlib import contextmanager
+
+from .profiling import span
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+def peak_memory():
+    """ Returns the peak resident memory of this process in bytes
+
+    Returns None if the peak memory is not available on this platform.
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        return peak
+    return peak * 1024
+
+
+class RunReport(object):
+    """ A record of the steps of an MCC or MCC-RGB run
+
+    Each step is recorded as an event, a dictionary with the event type,
+    the time since the start of the run in seconds ("time"), the peak memory
+    of the process in bytes ("peak_memory"), and fields describing the step.
+    The event types are
+
+        scales: scales chosen from the point spacing, with field scales
+        pyramid: a coarse pyramid pass, with fields scale, tol, n_in, n_out
+            and phases
+        iteration: an MCC iteration, with fields algorithm, domain, scale,
+            tol, iteration, n_in, n_out, n_removed_mcc, update, n_reclassified,
+            surface and phases
+        max_iter: the maximum number of iterations was reached in a domain
+        timeout: the time budget ran out, with fields time_budget, domain
+            and iteration
+        finish: the end of the run, with fields n_points, n_ground,
+            timed_out and completed_domains
+        plan: the memory plan of a run with a memory limit, with fields
+            memory_limit, points_per_chunk, n_chunks, predict_block_size,
+            n_train, estimate and fits
+        checkpoint: a checkpoint was saved, with fields checkpoint, domain
+            and iteration
+        resume: a run resumed from a checkpoint, with fields checkpoint,
+            domain, iteration and n_active
+        tile: a run on one spatial chunk, with fields tile, n_tiles,
+            n_points, n_core and, for batch runs, elapsed. The events of the
+            run on the chunk follow, with a tile field.
+
+    The phases field is a dictionary of wall times in seconds of the phases
+    of a step: surface, features, training, predict and compaction.
+
+    Parameters
+    ----------
+        callback: function
+            Optional function called with each event as it is recorded
+
+        verbose: bool
+            If True, print each event as it is recorded. Default False.
+
+    Attributes
+    ----------
+        events: list
+            The recorded events in order
+    """
+
+    def __init__(self, callback=None, verbose=False):
+        self.callback = callback
+        self.verbose = verbose
+        self.events = []
+        self._start = time.perf_counter()
+
+    def emit(self, event, **fields):
+        """ Records an event and passes it to the callback """
+        record = {
+            "event": event,
+            "time": time.perf_counter() - self._start,
+            "peak_memory": peak_memory(),
+        }
+        record.update(fields)
+        self.events.append(record)
+
+        if self.verbose:
+            print_event(record)
+        if self.callback is not None:
+            self.callback(record)
+        return record
+
+    def forward(self, **fields):
+        """ Returns a callback that records the events of another run here
+
+        The events are recorded with the given extra fields, e.g., the tile
+        of a run on part of a point cloud.
+        """
+
+        def callback(record):
+            forwarded = {
+                key: value
+                for key, value in record.items()
+                if key not in ("event", "time", "peak_memory")
+            }
+            forwarded.update(fields)
+            self.emit(record["event"], **forwarded)
+
+        return callback
+
+    def select(self, event):
+        """ Returns all events of a type """
+        return [record for record in self.events if record["event"] == event]
+
+    def phase_times(self):
+        """ Returns the total wall time of each phase over the run """
+        totals = {}
+        for record in self.events:
+            for name, seconds in record.get("phases", {}).items():
+                totals[name] = totals.get(name, 0.0) + seconds
+        return totals
+
+    @property
+    def timed_out(self):
+        """ True if the run stopped early because its time budget ran out """
+        return len(self.select("timeout")) > 0
+
+    @property
+    def completed_domains(self):
+        """ The scale domains completed before the end of the run """
+        finish = self.select("finish")
+        if len(finish) == 0:
+            return []
+        return finish[-1].get("completed_domains", [])
+
+    @property
+    def elapsed(self):
+        """ The time of the last event """
+        if len(self.events) == 0:
+            return 0.0
+        return self.events[-1]["time"]
+
+
+class TimeBudgetExceeded(TimeoutError):
+    """ Raised by Deadline.check when a time budget has run out """
+
+
+class Deadline(object):
+    """ A wall-clock deadline for cooperative cancellation
+
+    Parameters
+    ----------
+        time_budget: float
+            The time budget in seconds from now. If None, the deadline never
+            expires.
+    """
+
+    def __init__(self, time_budget=None):
+        self.time_budget = time_budget
+        self._end = None
+        if time_budget is not None:
+            self._end = time.perf_counter() + time_budget
+
+    def remaining(self):
+        """ Returns the remaining time in seconds, or None without a budget """
+        if self._end is None:
+            return None
+        return max(0.0, self._end - time.perf_counter())
+
+    def expired(self):
+        """ Returns True if the time budget has run out """
+        return self._end is not None and time.perf_counter() >= self._end
+
+    def check(self):
+        """ Raises TimeBudgetExceeded if the time budget has run out """
+        if self.expired():
+            raise TimeBudgetExceeded(
+                "Time budget of {} s exceeded".format(self.time_budget)
+            )
+
+
+class PhaseTimer(object):
+    """ Accumulates the wall time of named phases
+
+    Use as a context manager, e.g., "with timer('surface'): ...". Times are
+    stored in the times attribute. If profiling is enabled, each phase is
+    also recorded as a span named prefix.name.
+    """
+
+    def __init__(self, prefix="core"):
+        self.prefix = prefix
+        self.times = {}
+
+    @contextmanager
+    def __call__(self, name):
+        start = time.perf_counter()
+        try:
+            with span(self.prefix + "." + name):
+                yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.times[name] = self.times.get(name, 0.0) + elapsed
+
+
+def print_event(event):
+    """ Prints an event of a RunReport as human-readable text """
+    kind = event["event"]
+    if kind == "scales":
+        print(
+            "Scales from point spacing: {}".format(
+                ", ".join("{:.2f}".format(scale) for scale in event["scales"])
+            )
+        )
+    elif kind == "pyramid":
+        _print_header("Pyramid pass")
+        print(
+            "Scale: {:.2f}, Relative height: {:.1e}".format(
+                event["scale"], event["tol"]
+            )
+        )
+        _print_removed(event["n_in"] - event["n_out"], event["n_in"])
+    elif kind == "iteration":
+        if event["algorithm"] == "mcc":
+            _print_header("MCC iteration")
+        else:
+            _print_header("MCC step")
+        print(
+            "Scale: {:.2f}, Relative height: {:.1e}, iter: {}".format(
+                event["scale"], event["tol"], event["iteration"]
+            )
+        )
+        _print_removed(event["n_removed_mcc"], event["n_in"])
+
+        surface = event.get("surface")
+        if surface is not None and surface["n_surface"] < surface["n_points"]:
+            print(
+                "Surface from {} of {} points ({:.2f} %) in {:.2f} s, "
+                "mean offset {:.2f}".format(
+                    surface["n_surface"],
+                    surface["n_points"],
+                    100 * (surface["n_surface"] / surface["n_points"]),
+                    surface["time"],
+                    surface["offset"],
+                )
+            )
+
+        if event.get("update", False):
+            _print_header("Classification update step")
+            print(
+                "Reclassified {} ground points as nonground ({:.2f} %)".format(
+                    event["n_reclassified"],
+                    _percent(event["n_reclassified"], event["n_in"]),
+                )
+            )
+    elif kind == "plan":
+        print(
+            "Memory limit {} bytes: {} chunks of up to {} points, "
+            "estimated {} bytes per chunk".format(
+                event["memory_limit"],
+                event["n_chunks"],
+                event["points_per_chunk"],
+                event["estimate"],
+            )
+        )
+    elif kind == "tile":
+        _print_header("Tile {} of {}".format(event["tile"] + 1, event["n_tiles"]))
+        print("{} points, {} in tile core".format(event["n_points"], event["n_core"]))
+    elif kind == "resume":
+        print(
+            "Resuming from {} at scale domain {}, iteration {} "
+            "with {} points".format(
+                event["checkpoint"],
+                event["domain"],
+                event["iteration"],
+                event["n_active"],
+            )
+        )
+    elif kind == "timeout":
+        print(
+            "Time budget of {} s exceeded at scale domain {}, iteration {}".format(
+                event["time_budget"], event["domain"], event["iteration"]
+            )
+        )
+    elif kind == "max_iter":
+        print("Reached maximum number of iterations ({})".format(event["max_iter"]))
+    elif kind == "finish":
+        print()
+        print(
+            "Retained {} ground points ({:.2f} %)".format(
+                event["n_ground"], _percent(event["n_ground"], event["n_points"])
+            )
+        )
+
+
+def _print_header(title):
+    print("-" * 20)
+    print(title)
+    print("-" * 20)
+
+
+def _print_removed(n_removed, n_points):
+    print(
+        "Removed {} nonground points ({:.2f} %)".format(
+            n_removed, _percent(n_removed, n_points)
+        )
+    )
+
+
+def _percent(count, total):
+    return 100 * (count / total) if total > 0 else 0.0
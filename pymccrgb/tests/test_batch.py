@@ -0,0 +1,51 @@
+""" Test classifying point clouds in balanced tiles """
+
+import os
+
+import pytest
+import unittest
+
+import numpy as np
+
+from context import pymccrgb
+
+TEST_DATA_DIR = os.path.join(os.path.dirname(__file__), "data")
+TEST_OUTPUT_DIR = os.path.join(os.path.dirname(__file__), "output")
+
+
+class ClassifyTilesTestCase(unittest.TestCase):
+    def setUp(self):
+        self.data = pymccrgb.ioutils.read_las(
+            os.path.join(TEST_DATA_DIR, "points_rgb.laz")
+        )
+
+    def test_classify_tiles(self):
+        _, true_labels = np.load(
+            os.path.join(TEST_OUTPUT_DIR, f"ground_labels_mcc_default.npy"),
+            allow_pickle=True,
+        )
+        test_points, test_labels, report = pymccrgb.batch.classify_tiles(
+            self.data, method="mcc", n_tiles=4, n_jobs=2, return_report=True
+        )
+        self.assertGreaterEqual(len(report.select("tile")), 4, "Too few tiles")
+        self.assertEqual(
+            test_points.shape[0],
+            test_labels.sum(),
+            "Ground points and labels disagree for tiled MCC",
+        )
+        self.assertGreater(
+            np.mean(test_labels == true_labels),
+            0.99,
+            "Tiled MCC disagrees with MCC on the whole point cloud",
+        )
+
+    def test_classify_tiles_profile(self):
+        with pymccrgb.profiling.profile() as profiler:
+            pymccrgb.batch.classify_tiles(self.data, method="mcc", n_tiles=4, n_jobs=2)
+        pids = {pid for _, _, _, pid, _, _ in profiler.spans}
+        self.assertIn("core.mcc", profiler.stats(), "Worker spans are missing")
+        self.assertNotIn(os.getpid(), pids, "Tile spans were recorded in the parent")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,44 @@
+""" Test saving and loading checkpoints """
+
+import os
+import tempfile
+
+import pytest
+import unittest
+
+import numpy as np
+
+from context import pymccrgb
+
+
+class CheckpointTestCase(unittest.TestCase):
+    def test_checkpoint_round_trip(self):
+        state = {"domain": 1, "iteration": 3, "scales": [0.5, 1.0]}
+        indices = np.arange(0, 100, 3)
+        model = {"coef": [1.0, 2.0]}
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, "run.npz")
+            pymccrgb.checkpoint.save_checkpoint(
+                filename, state, {"indices": indices}, model=model
+            )
+            self.assertFalse(
+                os.path.exists(filename + ".tmp"), "Temporary file was left behind"
+            )
+            test_state, arrays, test_model = pymccrgb.checkpoint.load_checkpoint(
+                filename
+            )
+        self.assertEqual(test_state, state, "Loop state was not restored")
+        self.assertTrue(np.array_equal(arrays["indices"], indices))
+        self.assertEqual(test_model, model, "Model was not restored")
+
+    def test_checkpoint_without_model(self):
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, "run.npz")
+            pymccrgb.checkpoint.save_checkpoint(filename, {}, {})
+            _, arrays, model = pymccrgb.checkpoint.load_checkpoint(filename)
+        self.assertEqual(arrays, {})
+        self.assertIsNone(model)
+
+
+if __name__ == "__main__":
+    unittest.main()
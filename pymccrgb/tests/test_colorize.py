@@ -0,0 +1,65 @@
+""" Test projecting image colors onto point clouds """
+
+import os
+
+import pytest
+import unittest
+
+import numpy as np
+
+from context import pymccrgb
+
+# Upper-left corner (100, 200) with 0.5 m pixels
+TEST_TRANSFORM = (100.0, 0.5, 0.0, 200.0, 0.0, -0.5)
+
+
+class ProjectColorsTestCase(unittest.TestCase):
+    def setUp(self):
+        rows, cols = np.meshgrid(np.arange(40), np.arange(60), indexing="ij")
+        self.image = np.stack([rows, cols, rows + cols], axis=-1).astype(np.uint16)
+        rng = np.random.RandomState(42)
+        self.data = np.column_stack(
+            [
+                rng.uniform(95, 135, size=500),
+                rng.uniform(175, 205, size=500),
+                rng.uniform(0, 10, size=500),
+            ]
+        )
+
+    def test_project_point_colors(self):
+        test = pymccrgb.colorize.project_point_colors(
+            self.data, self.image, TEST_TRANSFORM, block_size=37, window_size=8
+        )
+        rows = np.floor((200.0 - self.data[:, 1]) / 0.5).astype(int)
+        cols = np.floor((self.data[:, 0] - 100.0) / 0.5).astype(int)
+        inside = (rows >= 0) & (rows < 40) & (cols >= 0) & (cols < 60)
+
+        self.assertTrue(
+            np.array_equal(test[:, 0:3], self.data), "Coordinates are incorrect"
+        )
+        self.assertTrue(
+            np.array_equal(test[inside, 3], rows[inside])
+            and np.array_equal(test[inside, 4], cols[inside]),
+            "Projected colors are incorrect",
+        )
+        self.assertTrue(
+            np.isnan(test[~inside, 3:6]).all(),
+            "Points outside the image should not be colored",
+        )
+
+    def test_project_point_colors_extra_columns(self):
+        colors = np.zeros((self.data.shape[0], 3))
+        extra = np.arange(2 * self.data.shape[0]).reshape(-1, 2)
+        data = np.hstack([self.data, colors, extra])
+        test = pymccrgb.colorize.project_point_colors(data, self.image, TEST_TRANSFORM)
+        true = pymccrgb.colorize.project_point_colors(
+            self.data, self.image, TEST_TRANSFORM
+        )
+        self.assertEqual(test.shape, data.shape, "Output has the wrong shape")
+        self.assertTrue(
+            np.array_equal(test[:, 0:6], true, equal_nan=True),
+            "Colors were not replaced",
+        )
+        self.assertTrue(
+            np.array_equal(test[:, 6:], extra), "Extra columns were not kept"
+        )
@@ -1,10 +1,14 @@
 """ Test Python MCC bindings and MCC-RGB algorithm """
 
+import inspect
 import os
+import tempfile
 
 import pytest
 import unittest
 
+from unittest import mock
+
 import numpy as np
 
 from context import pymccrgb
@@ -16,6 +20,48 @@ TEST_SCALES = [0.5, 1.0, 1.5]
 TEST_TOLS = [0.01, 0.05, 0.3, 0.5, 1.0]
 SEED_VALUE = 42
 
+# Runs where the last iteration removes some points, no points and every point
+COMPACTION_PARAMS = [{}, {"tols": [1e9] * 3}, {"tols": [-1e9] * 3}]
+
+
+class IntersectRowsPoints(object):
+    """ Retains points by copying rows, and labels them with intersect_rows """
+
+    def __init__(self, data, mask=None):
+        self.data = data
+        self.n_total = data.shape[0]
+        self.retained = data if mask is None else data[mask, :]
+
+    @property
+    def n(self):
+        return self.retained.shape[0]
+
+    @property
+    def xyz(self):
+        return self.retained[:, 0:3]
+
+    @property
+    def indices(self):
+        return np.flatnonzero(self.labels())
+
+    def compact(self, keep):
+        self.retained = self.retained[keep, :]
+
+    def labels(self):
+        return pymccrgb.pointutils.intersect_rows(self.retained, self.data)
+
+
+def compaction_runs(method, data, **params):
+    """ Runs method with and without copying rows, on unique rows of data """
+    _, index = np.unique(data, axis=0, return_index=True)
+    data = data[np.sort(index), :]
+    func = getattr(pymccrgb.core, method)
+    with mock.patch.object(pymccrgb.core, "_ActivePoints", IntersectRowsPoints):
+        _, true_labels = func(data, **params)
+    _, test_labels, report = func(data, return_report=True, **params)
+    iterations = [event for event in report.events if event["event"] == "iteration"]
+    return true_labels, test_labels, iterations
+
 
 class MCCTestCase(unittest.TestCase):
     def setUp(self):
@@ -40,6 +86,74 @@ class MCCTestCase(unittest.TestCase):
             for tol in TEST_TOLS:
                 self._test_classify_ground_mcc(scale, tol)
 
+    def test_mcc_classification_multiple_tols(self):
+        for scale in TEST_SCALES:
+            test = pymccrgb.core.classify_ground_mcc_tols(self.data, scale, TEST_TOLS)
+            for i, tol in enumerate(TEST_TOLS):
+                true = np.load(
+                    os.path.join(
+                        TEST_OUTPUT_DIR, f"classification_mcc_{scale}_{tol}.npy"
+                    ),
+                    allow_pickle=True,
+                )
+                self.assertSequenceEqual(
+                    test[:, i].tolist(),
+                    true.tolist(),
+                    f"Multiple tolerance MCC classification is incorrect for scale {scale} and height tolerance {tol}",
+                )
+
+    def test_mcc_classification_downsample(self):
+        rng = np.random.RandomState(SEED_VALUE)
+        xy = rng.uniform(0, 50, (20000, 2))
+        z = 0.5 * xy[:, 0] + 0.2 * np.sin(xy[:, 1] / 3)
+        z += (rng.rand(xy.shape[0]) < 0.2) * rng.uniform(1, 5, xy.shape[0])
+        slope = np.column_stack([xy, z])
+        for scale in TEST_SCALES:
+            true = pymccrgb.core.classify_ground_mcc(slope, scale, 0.3)
+            for downsample in [True, "voxel"]:
+                test = pymccrgb.core.classify_ground_mcc(
+                    slope, scale, 0.3, downsample=downsample
+                )
+                self.assertGreater(
+                    np.mean(test == true),
+                    0.95,
+                    f"Downsampled MCC classification ({downsample}) disagrees with full resolution on a slope at scale {scale}",
+                )
+
+    def test_mcc_classification_cache(self):
+        cache = pymccrgb.cache.ExcessHeightCache()
+        for _ in range(2):
+            test = pymccrgb.core.classify_ground_mcc(self.data, 1.0, 0.3, cache=cache)
+        true = np.load(
+            os.path.join(TEST_OUTPUT_DIR, f"classification_mcc_1.0_0.3.npy"),
+            allow_pickle=True,
+        )
+        self.assertSequenceEqual(
+            test.tolist(),
+            true.tolist(),
+            "MCC ground classification is incorrect using cached excess heights",
+        )
+        self.assertEqual(
+            (cache.hits, cache.misses),
+            (1, 1),
+            "Excess height cache statistics are incorrect",
+        )
+
+    def test_fingerprint(self):
+        xyz = self.data[:, 0:3]
+        swapped = xyz.copy()
+        swapped[[1, 2]] = swapped[[2, 1]]
+        self.assertEqual(
+            pymccrgb.cache.fingerprint(xyz),
+            pymccrgb.cache.fingerprint(xyz.copy()),
+            "Fingerprints of equal arrays differ",
+        )
+        self.assertNotEqual(
+            pymccrgb.cache.fingerprint(xyz),
+            pymccrgb.cache.fingerprint(swapped),
+            "Fingerprints of reordered points with equal sums collide",
+        )
+
     def test_mcc_default(self):
         test_points, test_labels = pymccrgb.core.mcc(self.data, verbose=True)
         true_points, true_labels = np.load(
@@ -56,6 +170,136 @@ class MCCTestCase(unittest.TestCase):
             "Classification is incorrect for default MCC configuration",
         )
 
+    def test_mcc_candidates(self):
+        candidates = np.arange(self.data.shape[0]) % 2 == 0
+        test_points, test_labels = pymccrgb.core.mcc(
+            self.data, candidates=candidates
+        )
+        self.assertFalse(
+            test_labels[~candidates].any(),
+            "Points that cannot be ground are classified as ground",
+        )
+
+        _, int_labels = pymccrgb.core.mcc(self.data, candidates=candidates.astype(int))
+        self.assertSequenceEqual(
+            int_labels.tolist(),
+            test_labels.tolist(),
+            "Integer candidates give a different classification",
+        )
+
+    def test_read_data_prefilter(self):
+        data, candidates = pymccrgb.ioutils.read_data(
+            os.path.join(TEST_DATA_DIR, "points_rgb.laz"), prefilter=True
+        )
+        self.assertEqual(data.shape, self.data.shape, "Prefiltered data is incorrect")
+        self.assertEqual(candidates.dtype, bool, "Ground candidates are not a mask")
+        self.assertEqual(
+            candidates.shape, (data.shape[0],), "Ground candidates are incorrect"
+        )
+        _, test_labels = pymccrgb.core.mcc(data, candidates=candidates)
+        self.assertFalse(
+            test_labels[~candidates].any(),
+            "Points that cannot be ground are classified as ground",
+        )
+
+    def test_ground_candidates(self):
+        test = pymccrgb.ioutils.ground_candidates(
+            np.array([1, 2, 1, 1, 0]),
+            np.array([2, 2, 1, 1, 0]),
+            np.array([1, 1, 2, 5, 0]),
+        )
+        self.assertSequenceEqual(
+            test.tolist(),
+            [False, True, True, False, True],
+            "Ground candidates from LAS attributes are incorrect",
+        )
+
+    def test_mcc_pyramid(self):
+        _, true_labels, true_report = pymccrgb.core.mcc(self.data, return_report=True)
+        _, test_labels, test_report = pymccrgb.core.mcc(
+            self.data, pyramid=True, return_report=True
+        )
+        pyramid = test_report.select("pyramid")
+        self.assertEqual(len(pyramid), 1, "Pyramid pass was not run")
+        self.assertLess(
+            pyramid[0]["n_out"], pyramid[0]["n_in"], "Pyramid pass removed no points"
+        )
+        self.assertLess(
+            sum(event["n_in"] for event in test_report.select("iteration")),
+            sum(event["n_in"] for event in true_report.select("iteration")),
+            "Pyramid pass did not reduce the points in full resolution iterations",
+        )
+        self.assertGreater(
+            np.mean(test_labels == true_labels),
+            0.99,
+            "MCC with a pyramid pass disagrees with MCC",
+        )
+
+    def test_mcc_report(self):
+        events = []
+        test_points, test_labels, report = pymccrgb.core.mcc(
+            self.data, callback=events.append, return_report=True
+        )
+        self.assertEqual(len(events), len(report.events), "Callback missed events")
+        iterations = report.select("iteration")
+        self.assertEqual(
+            iterations[-1]["n_out"],
+            test_points.shape[0],
+            "Reported and returned ground point counts disagree",
+        )
+        self.assertEqual(
+            report.events[-1]["event"], "finish", "Report does not end with finish"
+        )
+        self.assertIn("surface", report.phase_times(), "Surface phase not timed")
+
+    def test_mcc_auto_scales(self):
+        test_points, test_labels, report = pymccrgb.core.mcc(
+            self.data, scales="auto", return_report=True
+        )
+        scales = report.select("scales")[0]["scales"]
+        self.assertEqual(len(scales), 3, "Incorrect number of scales")
+        self.assertTrue(np.all(np.diff(scales) > 0), "Scales are not increasing")
+        self.assertEqual(
+            test_points.shape[0],
+            test_labels.sum(),
+            "Ground points and labels disagree for MCC with automatic scales",
+        )
+
+        rng = np.random.RandomState(SEED_VALUE)
+        for spacing in [0.5, 2.0]:
+            x, y = np.meshgrid(np.arange(0, 50, spacing), np.arange(0, 50, spacing))
+            grid = np.column_stack(
+                [x.ravel(), y.ravel(), rng.normal(0, 0.01, size=x.size)]
+            )
+            _, _, report = pymccrgb.core.mcc(grid, scales="auto", return_report=True)
+            np.testing.assert_allclose(
+                report.select("scales")[0]["scales"],
+                spacing * np.array(pymccrgb.core.AUTO_SCALE_FACTORS),
+                rtol=0.1,
+                err_msg="Automatic scales do not follow the point spacing",
+            )
+
+    def test_mcc_time_budget(self):
+        self.assertEqual(
+            len(pymccrgb.core.mcc(self.data, time_budget=0)),
+            2,
+            "A time budget changed the return values",
+        )
+        test_points, test_labels, report = pymccrgb.core.mcc(
+            self.data, time_budget=0, return_report=True
+        )
+        self.assertTrue(report.timed_out, "Run did not time out")
+        self.assertEqual(report.completed_domains, [], "Domains were completed")
+        self.assertTrue(
+            test_labels.all(), "Unclassified points are not labeled as ground"
+        )
+
+        test_points, test_labels, report = pymccrgb.core.mcc(
+            self.data, time_budget=3600, return_report=True
+        )
+        self.assertFalse(report.timed_out, "Run timed out with a generous budget")
+        self.assertEqual(report.completed_domains, [0, 1, 2])
+
     def test_mcc_default_las_codes(self):
         test_points, test_labels = pymccrgb.core.mcc(self.data,
                                                      verbose=True,
@@ -78,6 +322,27 @@ class MCCTestCase(unittest.TestCase):
             "Classification is incorrect for default MCC configuration using LAS codes",
         )
 
+    def test_mcc_compaction(self):
+        last_iterations = []
+        for params in COMPACTION_PARAMS:
+            true_labels, test_labels, iterations = compaction_runs(
+                "mcc", self.data[::10], **params
+            )
+            self.assertSequenceEqual(
+                test_labels.tolist(),
+                true_labels.tolist(),
+                f"Compacted MCC disagrees with copying rows for {params}",
+            )
+            last_iterations.append(iterations[-1])
+        self.assertEqual(
+            last_iterations[1]["n_out"],
+            last_iterations[1]["n_in"],
+            "Last iteration of the second run removed points",
+        )
+        self.assertEqual(
+            last_iterations[2]["n_out"], 0, "Third run did not remove every point"
+        )
+
 class MCCRGBTestCase(unittest.TestCase):
     def setUp(self):
         self.data = pymccrgb.ioutils.read_las(
@@ -102,6 +367,35 @@ class MCCRGBTestCase(unittest.TestCase):
             "Classification is incorrect for default MCC-RGB configuration",
         )
 
+    def test_positional_parameters(self):
+        expected = {
+            "mcc": ["data", "scales", "tols", "threshs", "use_las_codes", "verbose"],
+            "mcc_rgb": [
+                "data",
+                "scales",
+                "tols",
+                "threshs",
+                "training_scales",
+                "training_tols",
+                "n_train",
+                "max_iter",
+                "n_jobs",
+                "seed",
+                "use_las_codes",
+                "verbose",
+            ],
+        }
+        for method, names in expected.items():
+            parameters = inspect.signature(getattr(pymccrgb.core, method)).parameters
+            positional = [
+                name
+                for name, parameter in parameters.items()
+                if parameter.kind == parameter.POSITIONAL_OR_KEYWORD
+            ]
+            self.assertListEqual(
+                positional, names, f"Positional parameters of {method} changed"
+            )
+
     def test_mcc_default_las_codes(self):
         test_points, test_labels = pymccrgb.core.mcc_rgb(self.data,
                                                          seed=SEED_VALUE,
@@ -143,6 +437,95 @@ class MCCRGBTestCase(unittest.TestCase):
             "Classification is incorrect for default MCC-RGB configuration with parallelization",
         )
 
+    def test_mcc_rgb_memory_limit(self):
+        test_points, test_labels, report = pymccrgb.core.mcc_rgb(
+            self.data, seed=SEED_VALUE, memory_limit="16MB", return_report=True
+        )
+        self.assertEqual(
+            test_points.shape[0],
+            test_labels.sum(),
+            "Ground points and labels disagree for MCC-RGB with a memory limit",
+        )
+        plan = report.select("plan")[0]
+        self.assertEqual(
+            len(report.select("finish")),
+            max(1, len(report.select("tile"))) + 1,
+            "Chunks were not all classified",
+        )
+        self.assertLessEqual(
+            plan["predict_block_size"],
+            pymccrgb.classification.DEFAULT_PREDICT_BLOCK_SIZE,
+            "Prediction block size exceeds the default",
+        )
+        with self.assertRaises(ValueError):
+            pymccrgb.core.mcc_rgb(self.data, memory_limit=self.data.nbytes)
+
+    def test_mcc_rgb_checkpoint(self):
+        class Interrupted(Exception):
+            pass
+
+        def interrupt(event):
+            if event["event"] == "checkpoint":
+                raise Interrupted()
+
+        true_points, true_labels = pymccrgb.core.mcc_rgb(self.data, seed=SEED_VALUE)
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, "checkpoint.npz")
+            with self.assertRaises(Interrupted):
+                pymccrgb.core.mcc_rgb(
+                    self.data, seed=SEED_VALUE, checkpoint=filename, callback=interrupt
+                )
+            candidates = np.arange(self.data.shape[0]) % 2 == 0
+            for params in [{"n_train": 500}, {"candidates": candidates}]:
+                with self.assertRaises(ValueError):
+                    pymccrgb.core.mcc_rgb(
+                        self.data, seed=SEED_VALUE, checkpoint=filename, **params
+                    )
+            test_points, test_labels, report = pymccrgb.core.mcc_rgb(
+                self.data, seed=SEED_VALUE, checkpoint=filename, return_report=True
+            )
+        self.assertEqual(report.events[0]["event"], "resume", "Run did not resume")
+        self.assertSequenceEqual(
+            test_labels.tolist(),
+            true_labels.tolist(),
+            "Classification is incorrect for MCC-RGB resumed from a checkpoint",
+        )
+
+    def test_mcc_rgb_candidates(self):
+        candidates = np.arange(self.data.shape[0]) % 2 == 0
+        _, true_labels = pymccrgb.core.mcc_rgb(
+            self.data, candidates=candidates, seed=SEED_VALUE
+        )
+        _, test_labels = pymccrgb.core.mcc_rgb(
+            self.data, candidates=candidates.astype(int), seed=SEED_VALUE
+        )
+        self.assertFalse(
+            test_labels[~candidates].any(),
+            "Points that cannot be ground are classified as ground",
+        )
+        self.assertSequenceEqual(
+            test_labels.tolist(),
+            true_labels.tolist(),
+            "Integer candidates give a different classification",
+        )
+
+    def test_mcc_rgb_geometric_features_duplicates(self):
+        _, true_labels = pymccrgb.core.mcc_rgb(self.data, seed=SEED_VALUE)
+        ground = np.flatnonzero(true_labels)[0]
+        data = np.vstack([self.data, np.repeat(self.data[ground : ground + 1], 12, 0)])
+        G = pymccrgb.features.calculate_eigenvalue_features(data)
+        self.assertTrue(
+            np.isnan(G[-12:]).any(axis=1).all(), "Duplicate features are not NaN"
+        )
+
+        test_points, test_labels = pymccrgb.core.mcc_rgb(
+            data, seed=SEED_VALUE, geometric_features=True
+        )
+        self.assertTrue(
+            test_labels[-12:].all(),
+            "Duplicate ground points with NaN geometric features are not ground",
+        )
+
     def test_mcc_rgb_two_training_tols(self):
         test_points, test_labels = pymccrgb.core.mcc_rgb(
             self.data,
@@ -166,3 +549,95 @@ class MCCRGBTestCase(unittest.TestCase):
             true_labels.tolist(),
             "Classification is incorrect for MCC-RGB using training tols 1.0 and 0.3",
         )
+
+    def test_mcc_rgb_auto_scales(self):
+        rng = np.random.RandomState(SEED_VALUE)
+        x, y = np.meshgrid(np.arange(0, 50, 0.5), np.arange(0, 50, 0.5))
+        grid = np.column_stack(
+            [
+                x.ravel(),
+                y.ravel(),
+                rng.normal(0, 0.01, size=x.size),
+                rng.randint(0, 256, size=(x.size, 3)),
+            ]
+        )
+        _, _, report = pymccrgb.core.mcc_rgb(
+            grid,
+            scales="auto",
+            training_scales=5.0,
+            seed=SEED_VALUE,
+            return_report=True,
+        )
+        np.testing.assert_allclose(
+            report.select("scales")[0]["scales"],
+            0.5 * np.array(pymccrgb.core.AUTO_SCALE_FACTORS),
+            rtol=0.1,
+            err_msg="Automatic scales are incorrect or include the training scale",
+        )
+
+    def test_mcc_rgb_max_iter(self):
+        test_points, test_labels, report = pymccrgb.core.mcc_rgb(
+            self.data, seed=SEED_VALUE, max_iter=0, return_report=True
+        )
+        self.assertEqual(
+            {event["domain"] for event in report.select("iteration")},
+            {0},
+            "Domains after max_iter were run",
+        )
+        self.assertEqual(
+            report.completed_domains, [0], "Domains that never ran were completed"
+        )
+
+    def test_mcc_rgb_two_training_tols_warm_start(self):
+        from sklearn.linear_model import SGDClassifier
+
+        fit = SGDClassifier.fit
+        with mock.patch.object(
+            SGDClassifier, "fit", autospec=True, side_effect=fit
+        ) as mock_fit:
+            test_points, test_labels = pymccrgb.core.mcc_rgb(
+                self.data,
+                tols=[1.0, 0.3, 0.3],
+                scales=[0.5, 1.0, 1.5],
+                training_tols=[1.0, 0.3],
+                training_scales=[0.5, 0.5],
+                seed=SEED_VALUE,
+                warm_start=True,
+            )
+        coef_inits = [call[1].get("coef_init") for call in mock_fit.call_args_list]
+        self.assertEqual(len(coef_inits), 2, "Classifier was not trained twice")
+        self.assertIsNone(coef_inits[0], "First classifier was warm-started")
+        self.assertIsNotNone(
+            coef_inits[1], "Second classifier did not start from coefficients"
+        )
+
+        true_points, true_labels = np.load(
+            os.path.join(TEST_OUTPUT_DIR, f"ground_labels_mccrgb_twotols_1.0_0.3.npy"),
+            allow_pickle=True,
+        )
+        self.assertGreater(
+            np.mean(test_labels == true_labels),
+            0.9,
+            "Warm-started MCC-RGB disagrees with MCC-RGB trained from scratch",
+        )
+
+    def test_mcc_rgb_compaction(self):
+        last_iterations = []
+        for params in COMPACTION_PARAMS:
+            true_labels, test_labels, iterations = compaction_runs(
+                "mcc_rgb", self.data[::10], seed=SEED_VALUE, **params
+            )
+            self.assertSequenceEqual(
+                test_labels.tolist(),
+                true_labels.tolist(),
+                f"Compacted MCC-RGB disagrees with copying rows for {params}",
+            )
+            last_iterations.append(iterations[-1])
+        self.assertEqual(
+            last_iterations[1]["n_out"],
+            last_iterations[1]["n_in"],
+            "Last iteration of the second run removed points",
+        )
+        self.assertEqual(
+            last_iterations[2]["n_out"], 0, "Third run did not remove every point"
+        )
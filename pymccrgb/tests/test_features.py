@@ -49,3 +49,99 @@ class ColorFeatureTestCase(unittest.TestCase):
         true = self.target[:, VDVI_INDEX]
         true = true[np.isfinite(true)]
         self.assertTrue(np.allclose(test, true), "VDVI calculation is incorrect")
+
+    def test_calculate_color_features_with_statistics(self):
+        stats = pymccrgb.features.ColorStatistics.from_data(self.data, chunk_size=1000)
+        true = pymccrgb.features.calculate_color_features(self.data, stats=stats)
+
+        # A few saturated points do not change the features of the others
+        outliers = self.data[0:5].copy()
+        outliers[:, 3:6] = 65535
+        data = np.vstack([self.data, outliers])
+        stats = pymccrgb.features.ColorStatistics.from_data(data, chunk_size=1000)
+        test = pymccrgb.features.calculate_color_features(data, stats=stats)
+        finite = np.isfinite(true).all(axis=1)
+        self.assertGreater(
+            np.isclose(test[:-5][finite], true[finite], atol=0.02).all(axis=1).mean(),
+            0.99,
+            "Color features with color statistics are not robust to outliers",
+        )
+
+
+class ColorStatisticsTestCase(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.RandomState(42)
+        self.data = np.hstack(
+            [rng.uniform(0, 10, size=(1000, 3)), rng.randint(0, 256, size=(1000, 3))]
+        )
+
+    def test_merge(self):
+        true = pymccrgb.features.ColorStatistics.from_data(self.data)
+        test = pymccrgb.features.ColorStatistics().update(self.data[0:300])
+        test.merge(pymccrgb.features.ColorStatistics().update(self.data[300:]))
+        self.assertTrue(
+            np.array_equal(test.min, self.data[:, 3:6].min(axis=0))
+            and np.array_equal(test.max, self.data[:, 3:6].max(axis=0)),
+            "Merged color range is incorrect",
+        )
+        self.assertTrue(
+            np.array_equal(test.percentile(50), true.percentile(50)),
+            "Merged color percentiles are incorrect",
+        )
+        self.assertTrue(
+            np.allclose(
+                test.percentile(50), np.percentile(self.data[:, 3:6], 50, axis=0), atol=1
+            ),
+            "Color percentiles are incorrect",
+        )
+
+    def test_in_range(self):
+        data = self.data.copy()
+        data[:, 5] = data[:, 5] // 4
+        data[0, 3:6] = 65535
+        stats = pymccrgb.features.ColorStatistics.from_data(data)
+        low, high = stats.in_range()
+        self.assertTrue(
+            np.allclose(low, np.percentile(data[:, 3:6], 1, axis=0), atol=1)
+            and np.allclose(high, np.percentile(data[:, 3:6], 99, axis=0), atol=1),
+            "Color range of each channel is incorrect",
+        )
+
+    def test_invalid_colors(self):
+        data = self.data.copy()
+        data[:, 3:6] /= 255
+        with self.assertRaises(ValueError):
+            pymccrgb.features.ColorStatistics.from_data(data)
+
+
+class EigenvalueFeatureTestCase(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.RandomState(42)
+        xy = rng.uniform(0, 10, size=(2000, 2))
+        self.plane = np.column_stack([xy, np.zeros(2000)])
+        self.line = np.column_stack([xy[:, 0], np.zeros(2000), np.zeros(2000)])
+
+    def test_planar_features(self):
+        for kwargs in [{"k": 10}, {"radius": 0.5}]:
+            test = pymccrgb.features.calculate_eigenvalue_features(
+                self.plane, n_jobs=2, chunk_size=300, **kwargs
+            )
+            test = test[np.isfinite(test).all(axis=1)]
+            self.assertTrue(
+                np.allclose(test[:, 0] + test[:, 1], 1),
+                "Linearity and planarity of horizontal plane are incorrect",
+            )
+            self.assertTrue(
+                np.allclose(test[:, 2], 0),
+                "Sphericity of horizontal plane is incorrect",
+            )
+            self.assertTrue(
+                np.allclose(test[:, 4], 0),
+                "Verticality of horizontal plane is incorrect",
+            )
+
+    def test_linear_features(self):
+        test = pymccrgb.features.calculate_eigenvalue_features(self.line, k=10)
+        self.assertTrue(
+            np.allclose(test[:, 0], 1), "Linearity of a line is incorrect"
+        )
@@ -0,0 +1,49 @@
+""" Test lazy loading of submodules and dependencies """
+
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+import unittest
+
+from context import pymccrgb
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "../.."))
+
+
+def loaded_after(statement, modules):
+    script = (
+        "import json, sys\n{}\nprint(json.dumps([m for m in {!r} if m in sys.modules]))"
+    )
+    output = subprocess.run(
+        [sys.executable, "-c", script.format(statement, modules)],
+        cwd=ROOT,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return json.loads(output.stdout)
+
+
+class LazyImportTestCase(unittest.TestCase):
+    def test_import_is_lazy(self):
+        heavy = ["matplotlib", "pdal", "skimage", "sklearn", "pymccrgb.core"]
+        self.assertEqual(
+            loaded_after("import pymccrgb", heavy),
+            [],
+            "Importing pymccrgb loaded heavy modules",
+        )
+
+    def test_lazy_attributes(self):
+        self.assertIs(pymccrgb.mcc, pymccrgb.core.mcc)
+        self.assertIs(pymccrgb.mcc_rgb, pymccrgb.core.mcc_rgb)
+        self.assertIs(pymccrgb.read_data, pymccrgb.ioutils.read_data)
+        self.assertIn("tiling", dir(pymccrgb))
+        with self.assertRaises(AttributeError):
+            pymccrgb.not_a_module
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,121 @@
+""" Test incremental classification of appended points """
+
+import os
+import tempfile
+
+import pytest
+import unittest
+
+from unittest import mock
+
+import numpy as np
+
+from context import pymccrgb
+
+TEST_DATA_DIR = os.path.join(os.path.dirname(__file__), "data")
+SEED_VALUE = 42
+
+
+class TileStoreTestCase(unittest.TestCase):
+    def setUp(self):
+        self.data = pymccrgb.ioutils.read_las(
+            os.path.join(TEST_DATA_DIR, "points_rgb.laz")
+        )
+        x = self.data[:, 0]
+        self.old = x < np.percentile(x, 75)
+
+    def test_update(self):
+        rng = np.random.RandomState(SEED_VALUE)
+        held = rng.uniform(size=self.data.shape[0]) < 0.1
+        with tempfile.TemporaryDirectory() as directory:
+            store = pymccrgb.incremental.TileStore.create(
+                directory, self.data[~held], max_points=10000, seed=SEED_VALUE
+            )
+            self.assertGreaterEqual(len(store), 4, "Too few tiles")
+
+            # Add points in the core of one tile, away from its buffer
+            xy = self.data[:, 0:2]
+            interior = [
+                held & pymccrgb.tiling.tile_mask(xy, bounds, buffer=-store.buffer)
+                for bounds in store.tiles
+            ]
+            tile = int(np.argmax([np.count_nonzero(mask) for mask in interior]))
+            new = interior[tile]
+            true_labels = [store._load(i)[1]["labels"] for i in range(len(store))]
+
+            with mock.patch.object(
+                pymccrgb.core,
+                "update_sgd_pipeline",
+                wraps=pymccrgb.core.update_sgd_pipeline,
+            ) as update:
+                tiles = store.update(self.data[new])
+            self.assertTrue(update.called, "Stored classifiers were not reused")
+            self.assertIn(tile, tiles, "The tile with new points was not reclassified")
+            self.assertTrue(
+                set(tiles) <= set(store._neighbors(tile)),
+                "Tiles away from the new points were reclassified",
+            )
+            self.assertLess(len(tiles), len(store), "All tiles were reclassified")
+
+            store = pymccrgb.incremental.TileStore(directory)
+            for i in range(len(store)):
+                if i not in tiles:
+                    self.assertEqual(
+                        store._load(i)[1]["labels"].tobytes(),
+                        true_labels[i].tobytes(),
+                        "Labels of an untouched tile changed",
+                    )
+            self.assertEqual(
+                store.n_points, np.count_nonzero(~held) + np.count_nonzero(new)
+            )
+            test_points, test_labels = store.read()
+            np.testing.assert_array_equal(
+                test_points,
+                np.vstack([self.data[~held], self.data[new]]),
+                "Stored points are not in the order they were added",
+            )
+            self.assertIsNotNone(store.model(tile), "No classifier was stored")
+
+            _, true_labels = pymccrgb.core.mcc_rgb(test_points, seed=SEED_VALUE)
+            self.assertGreater(
+                np.mean(test_labels == true_labels),
+                0.95,
+                "Incremental labels disagree with MCC-RGB on the whole point cloud",
+            )
+
+    def test_update_failure(self):
+        with tempfile.TemporaryDirectory() as directory:
+            store = pymccrgb.incremental.TileStore.create(
+                directory, self.data[self.old], method="mcc", max_points=50000
+            )
+            true_points, true_labels = store.read()
+            with mock.patch.object(
+                pymccrgb.incremental, "save_checkpoint", side_effect=OSError("full")
+            ):
+                with self.assertRaises(OSError):
+                    store.update(self.data[~self.old])
+
+            store = pymccrgb.incremental.TileStore(directory)
+            test_points, test_labels = store.read()
+            self.assertEqual(store.n_points, true_points.shape[0])
+            np.testing.assert_array_equal(
+                test_points, true_points, "A failed update changed the points"
+            )
+            self.assertFalse(
+                any(name.endswith(".new") for name in os.listdir(directory)),
+                "A failed update left staged tiles",
+            )
+
+    def test_create_existing(self):
+        with tempfile.TemporaryDirectory() as directory:
+            pymccrgb.incremental.TileStore.create(
+                directory, self.data[self.old], method="mcc", max_points=50000
+            )
+            with self.assertRaises(ValueError):
+                pymccrgb.incremental.TileStore.create(
+                    directory, self.data[self.old], method="mcc"
+                )
+
+
+if __name__ == "__main__":
+    unittest.main()
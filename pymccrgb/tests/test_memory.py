@@ -0,0 +1,67 @@
+""" Test memory estimates and budget plans """
+
+import pytest
+import unittest
+
+from context import pymccrgb
+
+
+class MemoryPlanTestCase(unittest.TestCase):
+    def test_parse_memory_size(self):
+        parse = pymccrgb.memory.parse_memory_size
+        self.assertEqual(parse(1024), 1024)
+        self.assertEqual(parse("512MB"), 512 * 2 ** 20)
+        self.assertEqual(parse("1.5 GiB"), int(1.5 * 2 ** 30))
+        self.assertEqual(parse("4g"), 4 * 2 ** 30)
+        with self.assertRaises(ValueError):
+            parse("lots")
+
+    def test_estimate_scales_with_points(self):
+        estimate = pymccrgb.memory.estimate_mcc_rgb_memory
+        small = estimate(1000)
+        large = estimate(2000)
+        self.assertEqual(small["training"], large["training"])
+        self.assertEqual(
+            2 * small["surface"], large["surface"], "Surface memory is not linear"
+        )
+
+    def test_plan_within_budget(self):
+        limit = 64 * 2 ** 20
+        plan = pymccrgb.memory.plan_mcc_rgb_memory(10 ** 7, limit)
+        self.assertTrue(plan["fits"], "Plan does not fit a reasonable budget")
+        self.assertGreater(plan["n_chunks"], 1, "Large cloud was not chunked")
+        self.assertLessEqual(
+            plan["estimate"]["total"], limit, "Chunk estimate exceeds budget"
+        )
+
+    def test_plan_small_budget(self):
+        plan = pymccrgb.memory.plan_mcc_rgb_memory(10 ** 6, "1MB")
+        self.assertFalse(plan["fits"], "Impossible budget was reported as met")
+        self.assertEqual(
+            plan["predict_block_size"], pymccrgb.memory.MIN_PREDICT_BLOCK_SIZE
+        )
+        self.assertEqual(plan["n_train"], pymccrgb.memory.MIN_TRAIN)
+
+    def test_plan_resident_bytes(self):
+        limit = 64 * 2 ** 20
+        resident = pymccrgb.memory.resident_mcc_rgb_memory(10 ** 6)
+        plan = pymccrgb.memory.plan_mcc_rgb_memory(
+            10 ** 7, limit, resident_bytes=resident
+        )
+        free = pymccrgb.memory.plan_mcc_rgb_memory(10 ** 7, limit)
+        self.assertLess(
+            plan["points_per_chunk"],
+            free["points_per_chunk"],
+            "Resident memory did not reduce the chunk size",
+        )
+        self.assertLessEqual(
+            plan["estimate"]["total"] + resident,
+            limit,
+            "Chunk and resident memory exceed budget",
+        )
+        with self.assertRaises(ValueError):
+            pymccrgb.memory.plan_mcc_rgb_memory(10 ** 7, limit, resident_bytes=limit)
+
+
+if __name__ == "__main__":
+    unittest.main()
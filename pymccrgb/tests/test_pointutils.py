@@ -0,0 +1,228 @@
+""" Test common point cloud operations """
+
+import os
+import pickle
+import tempfile
+
+import pytest
+import unittest
+
+import numpy as np
+
+from context import pymccrgb
+
+SEED_VALUE = 42
+
+
+class PointIndexTestCase(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.RandomState(SEED_VALUE)
+        self.points = rng.uniform(0, 10, size=(1000, 3))
+        self.targets = rng.uniform(0, 10, size=(100, 2))
+
+    def test_query_nearest(self):
+        index = pymccrgb.pointutils.PointIndex(self.points)
+        _, test = index.query(self.targets, chunk_size=7)
+        dist = np.linalg.norm(
+            self.targets[:, None, :] - self.points[None, :, 0:2], axis=-1
+        )
+        true = dist.argmin(axis=1)
+        self.assertSequenceEqual(
+            test.tolist(), true.tolist(), "Nearest neighbor query is incorrect"
+        )
+
+    def test_query_radius(self):
+        index = pymccrgb.pointutils.PointIndex(self.points)
+        test = index.query_radius(self.targets, 1.0, chunk_size=7)
+        counts = index.query_radius(self.targets, 1.0, chunk_size=7, counts=True)
+        dist = np.linalg.norm(
+            self.targets[:, None, :] - self.points[None, :, 0:2], axis=-1
+        )
+        for i, neighbors in enumerate(test):
+            true = np.flatnonzero(dist[i] <= 1.0)
+            self.assertSequenceEqual(
+                sorted(neighbors.tolist()), true.tolist(), "Radius query is incorrect",
+            )
+            self.assertEqual(counts[i], len(true), "Radius query count is incorrect")
+
+    def test_pickle_and_load(self):
+        index = pymccrgb.pointutils.PointIndex(self.points)
+        _, true = index.query(self.targets, k=3)
+        _, test = pickle.loads(pickle.dumps(index)).query(self.targets, k=3)
+        self.assertTrue(np.array_equal(test, true), "Pickled index is incorrect")
+
+        with tempfile.TemporaryDirectory() as path:
+            filename = os.path.join(path, "index.npy")
+            index.save(filename)
+            loaded = pymccrgb.pointutils.PointIndex.load(filename)
+            _, test = loaded.query(self.targets, k=3)
+        self.assertTrue(np.array_equal(test, true), "Loaded index is incorrect")
+
+    def test_sample_point_cloud(self):
+        index = pymccrgb.pointutils.PointIndex(self.points)
+        test = pymccrgb.pointutils.sample_point_cloud(
+            self.points, self.targets, index=index
+        )
+        _, idx = index.query(self.targets)
+        self.assertTrue(
+            np.array_equal(test[:, 2], self.points[idx, 2]),
+            "Resampled heights are incorrect",
+        )
+
+
+class GridIndexTestCase(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.RandomState(SEED_VALUE)
+        self.points = rng.uniform(0, 10, size=(1000, 3))
+        self.targets = rng.uniform(-1, 11, size=(100, 2))
+
+    def test_query_radius(self):
+        grid = pymccrgb.pointutils.GridIndex(self.points, 0.5)
+        test = grid.query_radius(self.targets, 1.2, chunk_size=7)
+        counts = grid.query_radius(self.targets, 1.2, counts=True)
+        dist = np.linalg.norm(
+            self.targets[:, None, :] - self.points[None, :, 0:2], axis=-1
+        )
+        for i, neighbors in enumerate(test):
+            true = np.flatnonzero(dist[i] <= 1.2)
+            self.assertSequenceEqual(
+                sorted(neighbors.tolist()),
+                true.tolist(),
+                "Grid radius query is incorrect",
+            )
+            self.assertEqual(counts[i], len(true), "Grid radius count is incorrect")
+
+    def test_reduce(self):
+        grid = pymccrgb.pointutils.GridIndex(self.points, 2.0)
+        xy = self.points[:, 0:2]
+        cells = np.floor((xy - xy.min(axis=0)) / 2.0).astype(int)
+        for i, indices in enumerate(grid):
+            self.assertTrue(
+                (cells[indices] == cells[indices[0]]).all(),
+                "Points in a grid cell are incorrect",
+            )
+            z = self.points[indices, 2]
+            self.assertEqual(grid.reduce(self.points[:, 2], "min")[i], z.min())
+            self.assertAlmostEqual(grid.reduce(self.points[:, 2], "mean")[i], z.mean())
+            self.assertEqual(grid.reduce(self.points[:, 2], "count")[i], len(z))
+        self.assertSequenceEqual(
+            grid.lookup(self.points).tolist(),
+            grid.inverse.tolist(),
+            "Grid cell lookup is incorrect",
+        )
+
+    def test_grid_decimate(self):
+        points, inverse = pymccrgb.pointutils.grid_decimate(self.points, 2.0)
+        for i in range(points.shape[0]):
+            self.assertEqual(
+                points[i, 2],
+                self.points[inverse == i, 2].min(),
+                "Grid minimum decimation is incorrect",
+            )
+
+    def test_local_gradients(self):
+        values = 0.5 * self.points[:, 0] - 0.25 * self.points[:, 1] + 3.0
+        test = pymccrgb.pointutils.local_gradients(self.points, values, 1.0)
+        np.testing.assert_allclose(
+            test,
+            np.tile([0.5, -0.25], (self.points.shape[0], 1)),
+            err_msg="Gradients of a plane are incorrect",
+        )
+        test = pymccrgb.pointutils.local_gradients(self.points[0:1], values[0:1], 1.0)
+        self.assertSequenceEqual(
+            test.tolist(), [[0.0, 0.0]], "Gradient of an isolated point is not zero"
+        )
+
+
+class NominalSpacingTestCase(unittest.TestCase):
+    def test_nominal_spacing(self):
+        # A 0.5 m grid with a sparse 2 m grid beside it
+        x, y = np.meshgrid(np.arange(0, 50, 0.5), np.arange(0, 50, 0.5))
+        dense = np.column_stack([x.ravel(), y.ravel(), np.zeros(x.size)])
+        x, y = np.meshgrid(np.arange(50, 100, 2.0), np.arange(0, 50, 2.0))
+        sparse = np.column_stack([x.ravel(), y.ravel(), np.zeros(x.size)])
+
+        spacing = pymccrgb.pointutils.nominal_spacing(dense)
+        self.assertAlmostEqual(spacing, 0.5, delta=0.05, msg="Spacing is incorrect")
+
+        points = np.vstack([dense, sparse])
+        self.assertGreater(
+            pymccrgb.pointutils.nominal_spacing(points, q=90),
+            pymccrgb.pointutils.nominal_spacing(points, q=10),
+            "Spacing of sparse areas is not larger",
+        )
+
+
+class RemoveDuplicatesTestCase(unittest.TestCase):
+    def setUp(self):
+        self.data = np.array(
+            [
+                [0.0, 0.0, 0.0, 10, 20, 30],
+                [1.0, 1.0, 1.0, 40, 50, 60],
+                [0.0, 0.0, 0.0, 70, 80, 90],
+                [1.01, 1.0, 1.0, 100, 10, 10],
+                [2.0, 2.0, 2.0, 0, 0, 0],
+            ]
+        )
+
+    def test_exact_duplicates(self):
+        thinned, inverse = pymccrgb.pointutils.remove_duplicates(self.data)
+        self.assertTrue(
+            np.array_equal(thinned, self.data[[0, 1, 3, 4]]),
+            "Exact duplicate removal is incorrect",
+        )
+        self.assertTrue(
+            np.array_equal(thinned[inverse, 0:3], self.data[:, 0:3]),
+            "Inverse index of exact duplicates is incorrect",
+        )
+
+    def test_near_duplicates(self):
+        thinned, inverse = pymccrgb.pointutils.remove_duplicates(
+            self.data, resolution=0.5, policy="max"
+        )
+        self.assertSequenceEqual(
+            inverse.tolist(), [0, 1, 0, 1, 2], "Near duplicate groups are incorrect"
+        )
+        self.assertSequenceEqual(
+            thinned[1].tolist(),
+            [1.0, 1.0, 1.0, 100, 50, 60],
+            "Maximum color policy is incorrect",
+        )
+
+        thinned, _ = pymccrgb.pointutils.remove_duplicates(
+            self.data, resolution=0.5, policy="mean"
+        )
+        self.assertTrue(
+            np.allclose(thinned[0], [0, 0, 0, 40, 50, 60]), "Mean policy is incorrect",
+        )
+
+
+class PointGridTestCase(unittest.TestCase):
+    def test_iter_point_grid(self):
+        true = pymccrgb.pointutils.point_grid(0, 10, 0, 5, 0.5)
+        blocks = list(
+            pymccrgb.pointutils.iter_point_grid(0, 10, 0, 5, 0.5, block_shape=(3, 4))
+        )
+        test = np.vstack(blocks)
+        self.assertGreater(len(blocks), 1, "Grid was not generated in blocks")
+        self.assertSequenceEqual(
+            sorted(map(tuple, test.tolist())),
+            sorted(map(tuple, true.tolist())),
+            "Grid points generated in blocks are incorrect",
+        )
+
+    def test_sample_point_grid(self):
+        rng = np.random.RandomState(SEED_VALUE)
+        source = rng.uniform(0, 10, size=(1000, 3))
+        grid = pymccrgb.pointutils.point_grid(0, 10, 0, 10, 0.5)
+        true = pymccrgb.pointutils.sample_point_cloud(source, grid)
+        test = np.vstack(
+            list(
+                pymccrgb.pointutils.sample_point_grid(
+                    source, 0, 10, 0, 10, 0.5, block_shape=(4, 100)
+                )
+            )
+        )
+        self.assertTrue(
+            np.array_equal(test, true), "Grid sampled in blocks is incorrect"
+        )
@@ -0,0 +1,72 @@
+""" Test profiling spans and trace export """
+
+import json
+import os
+import tempfile
+
+import pytest
+import unittest
+
+import numpy as np
+
+from context import pymccrgb
+
+
+class ProfilingTestCase(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.RandomState(42)
+        self.data = np.column_stack(
+            [rng.uniform(0, 10, size=(500, 3)), rng.randint(0, 256, size=(500, 3))]
+        )
+
+    def test_spans_disabled(self):
+        profiler = pymccrgb.profiling.get_profiler()
+        n_spans = len(profiler.spans)
+        if not pymccrgb.profiling.is_enabled():
+            with pymccrgb.profiling.span("test.disabled"):
+                pass
+            self.assertEqual(
+                len(profiler.spans), n_spans, "Span recorded while disabled"
+            )
+
+    def test_profile_stats(self):
+        with pymccrgb.profiling.profile() as profiler:
+            pymccrgb.features.calculate_color_features(self.data)
+            pymccrgb.features.calculate_eigenvalue_features(self.data, chunk_size=200)
+        stats = profiler.stats()
+        self.assertEqual(stats["features.color"]["count"], 1, "Color span missing")
+        self.assertEqual(
+            stats["features.eigenvalue_chunk"]["count"],
+            3,
+            "Eigenvalue chunk spans missing",
+        )
+        self.assertLessEqual(
+            stats["features.eigenvalue_chunk"]["total"],
+            stats["features.eigenvalue"]["total"],
+            "Nested spans are longer than their parent",
+        )
+
+    def test_span_records_in_profiler_at_entry(self):
+        with pymccrgb.profiling.profile() as profiler:
+            span = pymccrgb.profiling.span("test.bound")
+            span.__enter__()
+        span.__exit__(None, None, None)
+        self.assertIn(
+            "test.bound", profiler.stats(), "Span not recorded where it started"
+        )
+
+    def test_export_chrome_trace(self):
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, "trace.json")
+            with pymccrgb.profiling.profile(filename):
+                pymccrgb.features.calculate_ngrdvi(self.data)
+            with open(filename) as f:
+                trace = json.load(f)
+        events = trace["traceEvents"]
+        self.assertEqual(len(events), 1, "Incorrect number of trace events")
+        self.assertEqual(events[0]["name"], "features.ngrdvi")
+        self.assertEqual(events[0]["ph"], "X", "Trace event is not a complete event")
+
+
+if __name__ == "__main__":
+    unittest.main()
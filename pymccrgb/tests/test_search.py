@@ -0,0 +1,74 @@
+""" Test running parameter grids of the MCC algorithm """
+
+import os
+
+import pytest
+import unittest
+
+import numpy as np
+
+from context import pymccrgb
+
+TEST_DATA_DIR = os.path.join(os.path.dirname(__file__), "data")
+TEST_OUTPUT_DIR = os.path.join(os.path.dirname(__file__), "output")
+
+TEST_TOLS = [0.3, 0.5]
+SEED_VALUE = 42
+
+
+class ParameterGridTestCase(unittest.TestCase):
+    def setUp(self):
+        self.data = pymccrgb.ioutils.read_las(
+            os.path.join(TEST_DATA_DIR, "points_rgb.laz")
+        )
+
+    def test_parameter_grid(self):
+        grid = pymccrgb.search.parameter_grid(
+            scales=[[0.5, 1, 1.5], [1, 2, 3]], tols=[[tol] * 3 for tol in TEST_TOLS]
+        )
+        self.assertEqual(len(grid), 4, "Parameter grid has the wrong size")
+        self.assertDictEqual(
+            grid[0],
+            {"scales": [0.5, 1, 1.5], "tols": [0.3, 0.3, 0.3]},
+            "Parameter grid combinations are incorrect",
+        )
+
+    def test_run_parameter_grid_shared(self):
+        grid = [{}, {"tols": [0.3, 0.3, 0.3]}]
+        _, true_labels = np.load(
+            os.path.join(TEST_OUTPUT_DIR, f"ground_labels_mcc_default.npy"),
+            allow_pickle=True,
+        )
+        results = pymccrgb.search.run_parameter_grid(
+            self.data, grid, method="mcc", n_jobs=2, reference=true_labels
+        )
+        for result in results:
+            self.assertSequenceEqual(
+                result["labels"].tolist(),
+                true_labels.tolist(),
+                "Classification is incorrect for MCC run from shared memory",
+            )
+            self.assertEqual(
+                result["reference_agreement"],
+                1.0,
+                "Agreement with reference labels is incorrect",
+            )
+
+    def test_run_parameter_grid_serial(self):
+        grid = pymccrgb.search.parameter_grid(
+            scales=[[0.5, 1, 1.5]],
+            tols=[[tol] * 3 for tol in TEST_TOLS],
+            seed=[SEED_VALUE],
+        )
+        serial = pymccrgb.search.run_parameter_grid(self.data, grid, n_jobs=1)
+        parallel = pymccrgb.search.run_parameter_grid(self.data, grid, n_jobs=2)
+        for params in grid:
+            self.assertSequenceEqual(
+                params["scales"], [0.5, 1, 1.5], "Grid scales were modified"
+            )
+        for serial_result, parallel_result in zip(serial, parallel):
+            self.assertSequenceEqual(
+                serial_result["labels"].tolist(),
+                parallel_result["labels"].tolist(),
+                "Serial and parallel runs of a grid disagree",
+            )
@@ -0,0 +1,119 @@
+""" Test the local classification server """
+
+import asyncio
+import os
+import socket
+import tempfile
+import threading
+import time
+
+import pytest
+import unittest
+
+import numpy as np
+
+from concurrent.futures import ThreadPoolExecutor
+
+from context import pymccrgb
+
+TEST_DATA_DIR = os.path.join(os.path.dirname(__file__), "data")
+SEED_VALUE = 42
+
+
+class ClassificationServerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.filename = os.path.join(TEST_DATA_DIR, "points_rgb.laz")
+        self.data = pymccrgb.ioutils.read_las(self.filename)
+        self.directory = tempfile.TemporaryDirectory()
+        self.address = os.path.join(self.directory.name, "server.sock")
+
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+        self.server = pymccrgb.service.ClassificationServer(
+            self.address, n_jobs=2, seed=SEED_VALUE, stream_block_size=10000
+        )
+        self.run_in_loop(self.server.start())
+
+    def tearDown(self):
+        self.run_in_loop(self.server.close())
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.directory.cleanup()
+
+    def run_in_loop(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+    def test_classify(self):
+        _, true_labels = pymccrgb.core.mcc_rgb(self.data, seed=SEED_VALUE)
+        test_labels = pymccrgb.service.classify(self.address, self.data)
+        np.testing.assert_array_equal(
+            test_labels, true_labels, "Server labels differ from MCC-RGB"
+        )
+
+        self.assertEqual(
+            pymccrgb.service._count_points(self.filename),
+            self.data.shape[0],
+            "Point count from the file header is incorrect",
+        )
+        blocks = list(pymccrgb.service.iter_labels(self.address, path=self.filename))
+        self.assertGreater(len(blocks), 1, "Labels were not streamed in blocks")
+        np.testing.assert_array_equal(
+            np.concatenate(blocks), true_labels, "Server labels differ for a file"
+        )
+
+    def test_classify_concurrent(self):
+        chunks = np.array_split(self.data, 4)
+
+        def classify(chunk):
+            return pymccrgb.service.classify(self.address, chunk)
+
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            results = list(pool.map(classify, chunks))
+        for chunk, test_labels in zip(chunks, results):
+            _, true_labels = pymccrgb.core.mcc_rgb(chunk, seed=SEED_VALUE)
+            np.testing.assert_array_equal(
+                test_labels, true_labels, "Batched server labels differ from MCC-RGB"
+            )
+
+    def test_split_batch(self):
+        batch = [(size, None, None) for size in [1, 5, 2, 1]]
+        groups = pymccrgb.service._split_batch(batch, 2)
+        self.assertEqual(
+            sorted(sum(size for size, _, _ in group) for group in groups),
+            [4, 5],
+            "Requests were not split among the workers by size",
+        )
+
+    def test_classify_error(self):
+        with self.assertRaises(pymccrgb.service.ServiceError):
+            pymccrgb.service.classify(
+                self.address, path=os.path.join(self.directory.name, "missing.laz")
+            )
+        with self.assertRaises(pymccrgb.service.ServiceError):
+            pymccrgb.service.classify(self.address, self.data, checkpoint="run.npz")
+
+    def test_bad_message(self):
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(60)
+            sock.connect(self.address)
+            sock.sendall(pymccrgb.service._HEADER_LENGTH.pack(9) + b"not json!")
+            header, _ = pymccrgb.service._receive_message(sock)
+            self.assertEqual(header["type"], "error", "Bad message was not rejected")
+            self.assertEqual(sock.recv(1), b"", "Connection was not closed")
+
+    def test_close_pending(self):
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            future = pool.submit(pymccrgb.service.classify, self.address, self.data)
+            time.sleep(0.5)
+            self.run_in_loop(self.server.close())
+            try:
+                test_labels = future.result(timeout=60)
+            except pymccrgb.service.ServiceError:
+                pass
+            else:
+                self.assertEqual(len(test_labels), self.data.shape[0])
+
+
+if __name__ == "__main__":
+    unittest.main()
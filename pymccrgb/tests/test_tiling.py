@@ -0,0 +1,61 @@
+""" Test spatial tiling of point clouds """
+
+import pytest
+import unittest
+
+import numpy as np
+
+from context import pymccrgb
+
+
+class TilingTestCase(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.RandomState(42)
+        self.xy = rng.uniform(0, [40, 10], size=(1000, 2))
+
+    def test_tile_shape(self):
+        nx, ny = pymccrgb.tiling.tile_shape(self.xy, 8)
+        self.assertGreaterEqual(nx * ny, 8, "Too few tiles")
+        self.assertGreater(nx, ny, "Tiles are not roughly square")
+
+    def test_tiles_partition_points(self):
+        tiles = pymccrgb.tiling.uniform_tiles(self.xy, 6)
+        counts = pymccrgb.tiling.tile_counts(self.xy, tiles)
+        self.assertEqual(counts.sum(), self.xy.shape[0], "Tiles overlap or miss points")
+
+        seen = np.zeros(self.xy.shape[0], dtype=int)
+        for _, indices, core in pymccrgb.tiling.iter_tiles(self.xy, tiles, buffer=2):
+            seen[indices[core]] += 1
+            self.assertGreaterEqual(len(indices), core.sum(), "Buffer lost points")
+        self.assertTrue(np.all(seen == 1), "Tile cores do not partition the points")
+
+    def test_tile_buffer(self):
+        tiles = pymccrgb.tiling.uniform_tiles(self.xy, 4)
+        counts = pymccrgb.tiling.tile_counts(self.xy, tiles)
+        buffered = pymccrgb.tiling.tile_counts(self.xy, tiles, buffer=1)
+        self.assertTrue(np.all(buffered >= counts), "Buffered tiles are smaller")
+        self.assertGreater(buffered.sum(), counts.sum(), "Buffers add no points")
+
+    def test_balanced_tiles(self):
+        # A dense cluster in one corner of a sparse cloud
+        rng = np.random.RandomState(42)
+        xy = np.vstack([self.xy, rng.uniform(0, 5, size=(4000, 2))])
+        tiles = pymccrgb.tiling.balanced_tiles(xy, max_points=1000)
+        counts = pymccrgb.tiling.tile_counts(xy, tiles)
+        self.assertEqual(counts.sum(), xy.shape[0], "Tiles overlap or miss points")
+        self.assertLessEqual(counts.max(), 1000, "Tiles exceed max_points")
+
+        uniform = pymccrgb.tiling.uniform_tiles(xy, len(tiles))
+        self.assertLess(
+            counts.max(),
+            pymccrgb.tiling.tile_counts(xy, uniform).max(),
+            "Balanced tiles are no more even than uniform tiles",
+        )
+
+    def test_balanced_tiles_count(self):
+        tiles = pymccrgb.tiling.balanced_tiles(self.xy, n_tiles=5)
+        self.assertGreaterEqual(len(tiles), 5, "Too few tiles")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,251 @@
+""" Spatial tiling of point clouds for classification in parts """
+
+import heapq
+import math
+
+import numpy as np
+
+from .pointutils import GridIndex
+
+DEFAULT_DENSITY_GRID_SIZE = 256
+
+
+def tile_shape(xy, n_tiles):
+    """ Chooses a grid of at least n_tiles tiles with roughly square tiles
+
+    Parameters
+    ----------
+        xy: array
+            An n x 2 (or more) array of coordinates with rows [x, y, ...]
+
+        n_tiles: int
+            The minimum number of tiles
+
+    Returns
+    -------
+        The number of tiles in x and y
+    """
+    if n_tiles <= 1 or xy.shape[0] == 0:
+        return 1, 1
+    width = np.ptp(xy[:, 0])
+    height = np.ptp(xy[:, 1])
+    if width <= 0 or height <= 0:
+        nx = n_tiles if width > 0 else 1
+        return nx, n_tiles // nx
+    nx = max(1, int(round(math.sqrt(n_tiles * width / height))))
+    ny = max(1, math.ceil(n_tiles / nx))
+    return nx, ny
+
+
+def uniform_tiles(xy, n_tiles):
+    """ Splits the extent of a point cloud into a grid of equal tiles
+
+    Parameters
+    ----------
+        xy: array
+            An n x 2 (or more) array of coordinates with rows [x, y, ...]
+
+        n_tiles: int
+            The minimum number of tiles (see tile_shape)
+
+    Returns
+    -------
+        A k x 4 array of tile bounds with rows [x_min, y_min, x_max, y_max].
+        The outer edges of the grid are infinite, so that every point, and
+        every point added later, lies in exactly one tile (see tile_mask).
+    """
+    nx, ny = tile_shape(xy, n_tiles)
+    x_edges = np.linspace(xy[:, 0].min(), xy[:, 0].max(), nx + 1)
+    y_edges = np.linspace(xy[:, 1].min(), xy[:, 1].max(), ny + 1)
+    x_edges[[0, -1]] = -np.inf, np.inf
+    y_edges[[0, -1]] = -np.inf, np.inf
+
+    tiles = [
+        [x_edges[i], y_edges[j], x_edges[i + 1], y_edges[j + 1]]
+        for j in range(ny)
+        for i in range(nx)
+    ]
+    return np.array(tiles, dtype=np.float64)
+
+
+def tile_mask(xy, bounds, buffer=0.0):
+    """ Returns a mask of points within a tile
+
+    Tiles are half-open, including their minimum and excluding their maximum
+    edges, so tiles that share an edge do not share points.
+
+    Parameters
+    ----------
+        xy: array
+            An n x 2 (or more) array of coordinates with rows [x, y, ...]
+
+        bounds: array
+            The tile bounds [x_min, y_min, x_max, y_max]
+
+        buffer: float
+            The distance to extend the tile by on each side. Default 0.
+
+    Returns
+    -------
+        An n x 1 boolean array, True for points within the (buffered) tile
+    """
+    x_min, y_min, x_max, y_max = bounds
+    return (
+        (xy[:, 0] >= x_min - buffer)
+        & (xy[:, 0] < x_max + buffer)
+        & (xy[:, 1] >= y_min - buffer)
+        & (xy[:, 1] < y_max + buffer)
+    )
+
+
+def iter_tiles(xy, tiles, buffer=0.0):
+    """ Generates the points of each tile with a buffer around it
+
+    Parameters
+    ----------
+        xy: array
+            An n x 2 (or more) array of coordinates with rows [x, y, ...]
+
+        tiles: array
+            A k x 4 array of tile bounds, e.g., from uniform_tiles
+
+        buffer: float
+            The width of the buffer around each tile. Buffer points are
+            classified with the tile to avoid edge effects, but their labels
+            are taken from the tile that contains them.
+
+    Yields
+    ------
+        tile: int
+            The index of the tile in tiles
+
+        indices: array
+            An m x 1 array of the indices of the points in the buffered tile
+
+        core: array
+            An m x 1 boolean array, True for the points of indices within
+            the tile itself
+    """
+    for tile, bounds in enumerate(tiles):
+        indices = np.flatnonzero(tile_mask(xy, bounds, buffer=buffer))
+        core = tile_mask(xy[indices], bounds)
+        if np.any(core):
+            yield tile, indices, core
+
+
+def tile_counts(xy, tiles, buffer=0.0):
+    """ Returns the number of points in each buffered tile
+
+    Parameters
+    ----------
+        xy: array
+            An n x 2 (or more) array of coordinates with rows [x, y, ...]
+
+        tiles: array
+            A k x 4 array of tile bounds, e.g., from uniform_tiles
+
+        buffer: float
+            The width of the buffer around each tile. Default 0.
+
+    Returns
+    -------
+        A k x 1 array of point counts
+    """
+    return np.array(
+        [np.count_nonzero(tile_mask(xy, bounds, buffer=buffer)) for bounds in tiles],
+        dtype=np.intp,
+    )
+
+
+def balanced_tiles(
+    xy, max_points=None, n_tiles=None, buffer=0.0, grid_size=DEFAULT_DENSITY_GRID_SIZE
+):
+    """ Splits a point cloud into tiles of similar numbers of points
+
+    The points are counted in a density grid, which is split k-d tree
+    fashion: the tile with the most points is split at the weighted median
+    of its longer axis, until every tile (with its buffer) has at most
+    max_points points and there are at least n_tiles tiles. Tiles are split
+    along grid cell edges, and a tile is not split if its halves would be
+    narrower than twice the buffer.
+
+    Parameters
+    ----------
+        xy: array
+            An n x 2 (or more) array of coordinates with rows [x, y, ...]
+
+        max_points: int
+            The maximum number of points in a buffered tile
+
+        n_tiles: int
+            The minimum number of tiles
+
+        buffer: float
+            The width of the buffer around each tile. Default 0.
+
+        grid_size: int
+            The number of density grid cells along the longer side of the
+            point cloud. Defaults to 256.
+
+    Returns
+    -------
+        A k x 4 array of tile bounds with rows [x_min, y_min, x_max, y_max].
+        As with uniform_tiles, the outer edges are infinite.
+    """
+    if max_points is None and n_tiles is None:
+        raise ValueError("Please give max_points, n_tiles or both.")
+    if xy.shape[0] == 0:
+        return np.array([[-np.inf, -np.inf, np.inf, np.inf]])
+
+    extent = np.ptp(xy[:, 0:2], axis=0).max()
+    cell_size = extent / grid_size if extent > 0 else 1.0
+    grid = GridIndex(xy, cell_size, dims=2)
+    cells = grid.cell_coords()
+    counts = grid.counts
+    ring = int(np.ceil(buffer / cell_size))
+    min_width = max(1, int(np.ceil(2 * buffer / cell_size)))
+
+    def count(lo, hi):
+        inside = np.all((cells >= lo - ring) & (cells < hi + ring), axis=1)
+        return int(counts[inside].sum())
+
+    def split(lo, hi):
+        inside = np.all((cells >= lo) & (cells < hi), axis=1)
+        for axis in np.argsort(hi - lo)[::-1]:
+            values, inverse = np.unique(cells[inside, axis], return_inverse=True)
+            if values[-1] - values[0] + 1 < 2 * min_width:
+                continue
+            weights = np.cumsum(np.bincount(inverse, weights=counts[inside]))
+            median = values[np.searchsorted(weights, weights[-1] / 2)] + 1
+            edge = int(
+                np.clip(median, values[0] + min_width, values[-1] + 1 - min_width)
+            )
+            left_hi, right_lo = hi.copy(), lo.copy()
+            left_hi[axis] = right_lo[axis] = edge
+            return (lo, left_hi), (right_lo, hi)
+        return None
+
+    lo, hi = np.zeros(2, dtype=np.intp), np.asarray(grid.shape, dtype=np.intp)
+    heap = [(-count(lo, hi), 0, lo, hi)]
+    leaves = []
+    n_pushed = 1
+    while heap:
+        n_points, _, lo, hi = heapq.heappop(heap)
+        n_leaves = len(leaves) + len(heap) + 1
+        done = (max_points is None or -n_points <= max_points) and (
+            n_tiles is None or n_leaves >= n_tiles
+        )
+        halves = None if done else split(lo, hi)
+        if halves is None:
+            leaves.append((lo, hi))
+            continue
+        for half_lo, half_hi in halves:
+            heapq.heappush(heap, (-count(half_lo, half_hi), n_pushed, half_lo, half_hi))
+            n_pushed += 1
+
+    tiles = []
+    for lo, hi in leaves:
+        lower = np.where(lo == 0, -np.inf, grid.origin + lo * cell_size)
+        upper = np.where(hi == grid.shape, np.inf, grid.origin + hi * cell_size)
+        tiles.append([lower[0], lower[1], upper[0], upper[1]])
+    return np.array(tiles, dtype=np.float64)
@@ -24,7 +24,7 @@ setuptools.setup(
         "License :: OSI Approved :: MIT License",
         "Operating System :: OS Independent",
     ],
-    python_require=">=3.6",
+    python_requires=">=3.8",
     install_requires=[
         "cmake",
         "cython",